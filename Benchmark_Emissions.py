@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the emissions calculation on synthetic powerplant fleets and NetLogo results.
+
+Usage:
+    python Benchmark_Emissions.py [--cases small medium] [--baseline benchmark_baseline.json] [--save-baseline]
+
+The real inputs are on the private share, thus we generate 'powerplants_average_day_<year>.csv' tables and
+NetLogo '_pre.csv' files of configurable size. Every case runs in its own process, so its peak memory is its own.
+For every stage we record the wall time, the CPU time, the peak resident memory (RSS) after the stage, and the rows
+per second (see 'Stage_Instrumentation.py').
+With a stored baseline, the run fails if a stage got slower (or needs more memory) than the tolerance allows.
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from queue import Empty
+
+import numpy as np
+import pandas as pd
+
+from Merit_Order_Dispatch import load_merit_order, lookup_from_bundle, calculate_hourly_emissions
+from NetLogo_Results import read_netlogo_results, write_emission_results, emission_result_columns
+from Emission_Pipeline import allocate_results, attach_results, fill_emission_results
+from Stage_Instrumentation import StageRecorder
+
+#%%
+
+######################################################################################################
+########################           Synthetic inputs                         ##########################
+######################################################################################################
+
+# Plant types and their share of the fleet, roughly as in 'Power_Plants_in_CA.py'
+synthetic_plant_types = {'Solar': 0.6, 'Combined_cycle': 0.1, 'Gas_undefined': 0.1, 'Cogen': 0.05, 'Hydro': 0.1, 'Wind': 0.05}
+
+# Benchmark cases: runs, plants, and NetLogo columns that are not used by the calculation
+benchmark_cases = {'small': {'runs': 10, 'plants': 1700, 'extra_columns': 100},
+                   'medium': {'runs': 1000, 'plants': 5000, 'extra_columns': 100},
+                   'large': {'runs': 10000, 'plants': 20000, 'extra_columns': 100},
+                   'huge': {'runs': 100000, 'plants': 50000, 'extra_columns': 0}}
+
+hours = list(range(0,24))
+
+
+def synthetic_powerplants(plants, year, seed=0):
+    """Return a synthetic 'powerplants_average_day_<year>' table with 'plants' powerplants."""
+
+    rng = np.random.default_rng([seed, year])
+
+    types = list(synthetic_plant_types)
+    plant_type = rng.choice(types, size=plants, p=list(synthetic_plant_types.values()))
+
+    solar = plant_type == 'Solar'
+    intermittent = np.isin(plant_type, ['Hydro', 'Wind'])
+    controllable = ~(solar | intermittent)
+
+    capacity = np.where(solar, rng.lognormal(0, 1, plants), rng.lognormal(4, 1.2, plants))
+    capacity_factor = np.where(controllable, rng.uniform(0.1, 0.9, plants), rng.uniform(0.2, 0.5, plants))
+    emission_factor = np.where(controllable, rng.uniform(0.35, 1.1, plants), 0)
+
+    # Solar follows a day profile (no production at night)
+    pv_generation_profile = np.clip(np.sin((np.array(hours) - 6) / 12 * np.pi), 0, None)
+    pv_generation_profile = pv_generation_profile / pv_generation_profile.sum()
+
+    columns = {'PLANT_TYPE': plant_type,
+               'CAPACITY_[MW]_' + str(year): capacity,
+               'CAPACITY_FACTOR_' + str(year): capacity_factor,
+               'EMISSIONS_[tCO2/MWh]_' + str(year): emission_factor}
+
+    merit_order = np.where(solar, 0.025, np.where(intermittent, 0.05, 1 - capacity_factor))
+
+    for x in hours:
+        columns['MO_' + str(x)] = merit_order
+
+    for x in hours:
+        columns['CAPACITY_MO_[MW]_' + str(x)] = np.where(solar, capacity * 0.2 * 24 * pv_generation_profile[x],
+                                                np.where(intermittent, capacity * capacity_factor, capacity))
+
+    return pd.DataFrame(columns, index=['plant_' + str(i) for i in range(plants)])
+
+
+def synthetic_netlogo_results(runs, years, total_capacity, extra_columns=0, seed=1):
+    """Return a synthetic NetLogo results table with 'runs' runs of all 'years'."""
+
+    rng = np.random.default_rng(seed)
+
+    rows = runs * len(years)
+
+    columns = {'[run number]': np.repeat(np.arange(1, runs + 1), len(years)),
+               'Year': np.tile(years, runs)}
+
+    # Demand between 30 % and 90 % of the capacity, with a day profile
+    day_profile = 0.6 + 0.2 * np.sin((np.array(hours) - 10) / 24 * 2 * np.pi)
+
+    for x in hours:
+        columns['system-load-profile_' + str(x)] = total_capacity * day_profile[x] * rng.uniform(0.5, 1.5, rows)
+
+    columns['annual-CO2-emission-reductions-from-gasoline-displacement'] = rng.uniform(0, 1, rows)
+
+    for i in range(extra_columns):
+        columns['netlogo-output_' + str(i)] = rng.uniform(0, 1, rows)
+
+    return pd.DataFrame(columns)
+
+
+synthetic_netlogo_file = "synthetic_pre.csv"
+
+
+def write_synthetic_inputs(folder, runs, plants, years, extra_columns=0):
+    """Write the fleet tables and the NetLogo file of one case to 'folder'. Returns the NetLogo file."""
+
+    total_capacity = 0
+
+    for y in years:
+        powerplants_average_day = synthetic_powerplants(plants, y)
+        powerplants_average_day.to_csv(os.path.join(folder, "powerplants_average_day_" + str(y) + ".csv"))
+
+        total_capacity = max(total_capacity, powerplants_average_day['CAPACITY_MO_[MW]_12'].sum())
+
+    netlogo_path = os.path.join(folder, synthetic_netlogo_file)
+    synthetic_netlogo_results(runs, years, total_capacity, extra_columns).to_csv(netlogo_path, index=False)
+
+    return netlogo_path
+
+#%%
+
+######################################################################################################
+########################           Stages                                   ##########################
+######################################################################################################
+
+def run_case(case, years, folder, netlogo_path):
+    """Run all stages of the emissions calculation on the synthetic inputs of one case (see 'write_synthetic_inputs').
+    Returns the measurements per stage.
+    """
+
+    recorder = StageRecorder()
+
+    rows = case['runs'] * len(years)
+
+    with recorder.stage('merit_order', rows=case['plants'] * len(years)):
+        lookup = lookup_from_bundle(load_merit_order(folder, years, hours))
+
+    with recorder.stage('read', rows=rows):
+        df = read_netlogo_results(netlogo_path, 'full')
+
+    # Same steps as 'process_scenario' in 'Emission_Pipeline.py'
+    columns = emission_result_columns(hours)
+
+    with recorder.stage('dispatch', rows=rows):
+        results = allocate_results(len(df), columns)
+        hourly_emissions = calculate_hourly_emissions(df, lookup, years, hours, verbose=False, out=results[:, :len(hours)])
+
+    with recorder.stage('aggregation', rows=rows):
+        fill_emission_results(df, hourly_emissions, results, columns, years)
+        df = attach_results(df, results, columns)
+
+    with recorder.stage('write', rows=rows):
+        write_emission_results(df, os.path.join(folder, "synthetic_pre_em.csv"), hours, 'csv')
+
+    stages = {}
+
+    for record in recorder.records:
+        stages[record['stage']] = dict((k, record[k]) for k in ['wall_time_s', 'cpu_time_s', 'rss_start_mb', 'peak_rss_mb', \
+                                                                 'peak_rss_scope', 'rows', 'rows_per_s'])
+
+    return stages
+
+
+def _run_case_worker(case, years, folder, netlogo_path, queue):
+
+    try:
+        queue.put({'stages': run_case(case, years, folder, netlogo_path)})
+    except BaseException as error:
+        # E.g., MemoryError on a large case: the parent needs an answer instead of waiting forever
+        queue.put({'error': type(error).__name__ + ": " + str(error)})
+
+
+def _write_inputs_worker(case, years, folder):
+
+    write_synthetic_inputs(folder, case['runs'], case['plants'], years, case['extra_columns'])
+
+
+def _measure_case(context, case, years, folder, netlogo_path, poll_s):
+
+    queue = context.Queue()
+
+    process = context.Process(target=_run_case_worker, args=(case, years, folder, netlogo_path, queue))
+    process.start()
+
+    answer = None
+
+    while answer is None:
+
+        try:
+            answer = queue.get(timeout=poll_s)
+
+        except Empty:
+            # A dead process has put its answer (if any) before exiting
+            if not process.is_alive():
+                try:
+                    answer = queue.get(timeout=poll_s)
+                except Empty:
+                    process.join()
+                    raise RuntimeError("Case process exited without result (exit code " + str(process.exitcode) + ")")
+
+    process.join()
+
+    if 'error' in answer:
+        raise RuntimeError(answer['error'])
+
+    return answer['stages']
+
+
+def run_case_in_process(case, years, poll_s=1.0):
+    """Run one case in a fresh process, so that peak memory is not carried over from other cases.
+
+    The inputs are generated before, in a process of their own, so that the measured process only holds what the
+    stages need. Raises RuntimeError if the case fails or its process dies without a result (e.g., killed for its
+    memory).
+    """
+
+    context = multiprocessing.get_context('spawn')
+    folder = tempfile.mkdtemp(prefix='emission_benchmark_')
+
+    try:
+        generator = context.Process(target=_write_inputs_worker, args=(case, years, folder))
+        generator.start()
+        generator.join()
+
+        if generator.exitcode != 0:
+            raise RuntimeError("Generating the inputs failed (exit code " + str(generator.exitcode) + ")")
+
+        return _measure_case(context, case, years, folder, os.path.join(folder, synthetic_netlogo_file), poll_s)
+
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+#%%
+
+######################################################################################################
+########################           Baseline                                 ##########################
+######################################################################################################
+
+# A stage regresses if its wall time or peak memory exceeds the baseline by more than 'tolerance'
+# (as fraction). Stages faster than 'min_time_s' are not compared, their timing is mostly noise.
+
+def compare_to_baseline(results, baseline, tolerance=0.25, min_time_s=0.05):
+    """Return a list of regressions (descriptions) of 'results' compared to 'baseline'."""
+
+    regressions = []
+
+    for case_name, stages in results.items():
+        for stage_name, measured in stages.items():
+
+            reference = baseline.get(case_name, {}).get(stage_name)
+
+            if reference is None:
+                continue
+
+            if reference['wall_time_s'] >= min_time_s and \
+               measured['wall_time_s'] > reference['wall_time_s'] * (1 + tolerance):
+                regressions.append(case_name + " / " + stage_name + ": wall time " + \
+                                   str(round(measured['wall_time_s'], 3)) + " s (baseline " + \
+                                   str(round(reference['wall_time_s'], 3)) + " s)")
+
+            if reference.get('peak_rss_mb') is not None and measured.get('peak_rss_mb') is not None and \
+               measured['peak_rss_mb'] > reference['peak_rss_mb'] * (1 + tolerance):
+                regressions.append(case_name + " / " + stage_name + ": peak RSS " + \
+                                   str(round(measured['peak_rss_mb'])) + " MB (baseline " + \
+                                   str(round(reference['peak_rss_mb'])) + " MB)")
+
+    return regressions
+
+
+def print_results(results):
+
+    for case_name, stages in results.items():
+        print("CASE: " + case_name)
+
+        for stage_name, measured in stages.items():
+            print("    " + stage_name.ljust(24) + str(round(measured['wall_time_s'], 3)).rjust(10) + " s" + \
+                  str(round(measured['peak_rss_mb'] or 0)).rjust(10) + " MB" + \
+                  str(round(measured['rows_per_s'] or 0)).rjust(14) + " rows/s")
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Benchmark the emissions calculation on synthetic inputs.")
+    parser.add_argument('--cases', nargs='+', default=['small', 'medium'], choices=list(benchmark_cases), help="benchmark cases")
+    parser.add_argument('--years', type=int, nargs=2, default=[2005, 2030], help="first and last year")
+    parser.add_argument('--baseline', default="benchmark_baseline.json", help="stored baseline (JSON)")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown as fraction of the baseline")
+
+    args = parser.parse_args(argv)
+
+    years = list(range(args.years[0], args.years[1] + 1))
+    results = {}
+    failures = []
+
+    for case_name in args.cases:
+        try:
+            results[case_name] = run_case_in_process(benchmark_cases[case_name], years)
+        except RuntimeError as error:
+            print("FAILED: " + case_name + ": " + str(error))
+            failures.append(case_name)
+
+    print_results(results)
+
+    # A failed case fails the run, also when saving a baseline (the baseline would miss the case)
+    if failures:
+        return 1
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=4)
+
+        print("BASELINE SAVED: " + args.baseline)
+
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print("NO BASELINE: " + args.baseline)
+
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+
+    for regression in regressions:
+        print("REGRESSION: " + regression)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
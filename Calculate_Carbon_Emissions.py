@@ -9,7 +9,14 @@ import pandas as pd
 import matplotlib
 import matplotlib.pyplot as plt
 import os 
-import numpy as np 
+
+from Merit_Order_Dispatch import load_merit_order, lookup_from_bundle
+from Emission_Pipeline import process_scenario, process_scenarios_parallel, scenario_average, scenario_names, pairwise_savings, \
+                              stream_scenario_statistics, stream_scenarios_parallel, comparison_columns
+from Result_Cache import ResultCache, bundle_fingerprint
+from NetLogo_Results import output_suffixes, read_netlogo_results
+from Stage_Instrumentation import StageRecorder
+from Monte_Carlo_Emissions import ensemble_annual_emissions, emission_bands
 
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)
@@ -40,14 +47,79 @@ os.chdir("Z:/Public/997 Collaboration/Marius Schwarz/03_VGI in California/00_Mar
 
 #%%
 
+# Read mode for the NetLogo results:
+# - 'full': read all (~977) columns, the '_pre_em.csv' output keeps all columns
+# - 'projected': read only the columns needed for the emissions calculation in row chunks (see 'NetLogo_Results.py')
+read_mode = 'full'
+chunksize = 100000
+
+# Output mode:
+# - 'csv': adjusted framework with all columns ('_pre_em.csv')
+# - 'parquet' / 'feather': only the calculated columns, keyed by run number and year, compressed ('_pre_em.parquet' / '_pre_em.feather')
+output_mode = 'csv'
+
+# Dispatch mode:
+# - 'whole': only powerplants whose cumulative capacity is below the demand run (original rule)
+# - 'partial': the marginal powerplant additionally covers the remaining demand (see 'Merit_Order_Dispatch.py')
+dispatch_mode = 'whole'
+
+# Dispatch kernel: 'auto' uses the compiled kernel (one loop over all runs and hours) if Numba is installed, otherwise
+# the NumPy dispatch; both give bit-identical results (see 'Dispatch_Kernel.py')
+dispatch_kernel = 'auto'
+
+# Time resolution:
+# - 'average_day': 24 hourly loads per run and year, emissions of the average day times 365 (original)
+# - 'full_year': 8760 hourly loads per run and year ('system-load-profile_0' to '_8759'), dispatched against the
+#   full-year merit order 'merit_order_lookup_8760' exported by 'Power_Plants_in_CA.py'
+time_resolution = 'average_day'
+
+settings = {'read_mode': read_mode, 'chunksize': chunksize, 'output_mode': output_mode, 'dispatch_mode': dispatch_mode, \
+            'time_resolution': time_resolution, 'dispatch_kernel': dispatch_kernel}
+
+# Aggregation mode:
+# - 'frame': every scenario is calculated as whole dataframe and saved with all rows (steps 3. - 6.)
+# - 'streaming': the NetLogo files are streamed in chunks ('chunksize') and only the statistics per year across runs
+#   (mean, standard deviation, quantiles) are kept and saved as '_statistics.csv' (see 'Online_Statistics.py')
+aggregation_mode = 'frame'
+
+# Baseline: position in 'csv_path_list' of the scenario whose average the savings are calculated against (0: reference)
+baseline = 0
+
+# Parallel mode: the reference is calculated first, then all other scenarios in a process pool (see 'Emission_Pipeline.py')
+# In 'frame' aggregation mode, every scenario is split into 'scenario_parts' row ranges, so that there are more tasks
+# than processes (None: twice as many tasks as processes)
+parallel_mode = False
+processes = os.cpu_count()
+scenario_parts = None
+
+# Result cache: scenarios with unchanged input file, powerplant fleet, reference, and settings are copied from the cache (see 'Result_Cache.py')
+use_cache = False
+cache_path = "../../04_Results/01_NetLogo Results/emission_cache/"
+cache_max_gb = 50
+
+# Monte Carlo mode: number of draws of capacity factors and emission rates (0: off), sampled from the spreads
+# within each plant type exported by 'Power_Plants_in_CA.py' (see 'Monte_Carlo_Emissions.py')
+monte_carlo_draws = 0
+monte_carlo_seed = 0
+
+# Run report: time, CPU time, peak memory, and rows of every stage and scenario (see 'Stage_Instrumentation.py'),
+# saved as json or csv after the run
+recorder = StageRecorder(run="Calculate_Carbon_Emissions")
+report_path = "../../04_Results/01_NetLogo Results/emission_run_report.json"
+
+#%%
+
 # 0) Read Reference Scenario, which we use to calculate emission savings
 
 df_list = []
+csv_path_list = []
+output_path_list = []
 
 file_path_ref = "../../04_Results/01_NetLogo Results/20190920/"
 csv_file_to_read = "20190911 - Reference - No Tech Adoption"
 
-df_list.append(pd.read_csv(file_path_ref + csv_file_to_read + "_pre.csv", sep=',', low_memory=False))
+csv_path_list.append(file_path_ref + csv_file_to_read + "_pre.csv")
+output_path_list.append(file_path_ref + csv_file_to_read + output_suffixes[output_mode])
 
 
 #%%
@@ -115,7 +187,8 @@ csv_file_to_read_list.append("20190916 - Hourly Pricing - sensitivity - work cha
 for csv in csv_file_to_read_list: 
     
     if csv != 0:
-        df_list.append(pd.read_csv(file_path + csv + "_pre.csv", sep=',', low_memory=False))
+        csv_path_list.append(file_path + csv + "_pre.csv")
+        output_path_list.append(file_path + csv + output_suffixes[output_mode])
 
 
 #%%
@@ -124,11 +197,24 @@ for csv in csv_file_to_read_list:
 years = list(range(2005,2031))
 hours = list(range(0,24)) 
 
-for y in years:
+path_powerplants = "../../06_CA Power Plants/"
 
-    path_powerplants = "../../06_CA Power Plants/"
-    
-    globals()["powerplants_average_day_" + str(y)] = pd.read_csv(path_powerplants + "powerplants_average_day_" + str(y) + ".csv") 
+# 'Power_Plants_in_CA.py' also exports the merit order of every year and hour as memory-mappable bundle.
+# If it exists, we open it directly and skip reading and sorting the csv files.
+recorder.start('merit_order')
+
+merit_order_bundle = load_merit_order(path_powerplants, years, hours, time_resolution)
+
+lookup = lookup_from_bundle(merit_order_bundle)
+
+recorder.stop()
+
+if use_cache:
+    cache = ResultCache(cache_path, max_bytes=cache_max_gb * 2**30)
+    bundle_id = bundle_fingerprint(merit_order_bundle)
+else:
+    cache = None
+    bundle_id = None
     
     
 #%%
@@ -139,222 +225,137 @@ for y in years:
 
 #%%
 
-# 3. Total emissions list that is filled during the calculation
-    
-# Add new columns to dataframe
+# 3. - 6. Calculate emissions and emission savings and save adjusted framework
 
-for df in df_list: 
-    
-    for x in hours:
-    
-        df['HOURLY_EMISSIONS_' + str(x)] = np.nan
-    
-    #%%
+# For every scenario (see 'Emission_Pipeline.py'):
+# - Hourly emissions: for every year and hour, the merit order is sorted once into cumulative capacity and emission arrays.
+#   All demands of that year are then dispatched with one binary search (see 'Merit_Order_Dispatch.py').
+# - Annual and cumulative emissions
+# - Annual and cumulative emission savings compared to the average of the reference scenario (with and without EVs)
+# - Save adjusted framework with the suffix '_pre_em.csv' (or only the calculated columns, see 'output_mode')
 
-# Sort dataframe according merit order
-#powerplants_ca_mo = powerplants_average_day.sort_values(by=[\
-#                                    'MO_' + str(x)], ascending=True)
+# Worker processes that are spawned (not forked) re-import this script, thus the calculation only runs in the main process
+if __name__ == '__main__' and aggregation_mode == 'frame':
 
-for df in df_list:
+    # The baseline comes first, as the savings of all scenarios are calculated against its average
+    df, reference = process_scenario(csv_path_list[baseline], output_path_list[baseline], lookup, years, hours, \
+                                     settings=settings, cache=cache, bundle_id=bundle_id, recorder=recorder)
+    df_list.append(df)
 
-    for y in years:
-    
-        print("NEW YEAR")
-        print(y)
-    
-        indexing_year = df[df.loc[:,'Year'] == y].index
-    
-        for x in hours:
-        
-            plants = globals()["powerplants_average_day_" + str(y)].sort_values(by=['MO_' + str(x)], ascending=True)
-            cum_capacity = []
-        
-        
-            for index, row in plants.iterrows():
-            
-                if len(cum_capacity) == 0:
-                    cum_capacity.append(row['CAPACITY_MO_[MW]_' + str(x)])
-                else:
-                    cum_capacity.append(cum_capacity[-1] + row['CAPACITY_MO_[MW]_' + str(x)])
-        
-            plants['capacity_cum'] = cum_capacity
-        
-        
-            Hourly_emissions_all_plants = []
+    scenarios = [(csv_path_list[i], output_path_list[i]) for i in range(len(csv_path_list)) if i != baseline]
+
+    if parallel_mode:
         
-            for index, row2 in df.loc[indexing_year,:].iterrows():
-            
-                demand = row2['system-load-profile_' + str(x)]
-    
-                #indexing
-            
-                indexing_demand = plants[plants.loc[:,'capacity_cum'] <= demand].index
-            
-                hourly_emissions_calc_list = plants.loc[indexing_demand, 'CAPACITY_MO_[MW]_' + str(x)] * plants.loc[indexing_demand, 'EMISSIONS_[tCO2/MWh]_' + str(y)]
-                hourly_emissions_calc = sum(hourly_emissions_calc_list)
-            
-                Hourly_emissions_all_plants.append(hourly_emissions_calc)
+        # Results are only saved to csv, df_list keeps the reference
+        process_scenarios_parallel(scenarios, merit_order_bundle, years, hours, reference, \
+                                   settings=settings, processes=processes, cache=cache, bundle_id=bundle_id, \
+                                   recorder=recorder, parts=scenario_parts)
+
+    else:
         
-            df.loc[indexing_year, 'HOURLY_EMISSIONS_' + str(x)] = Hourly_emissions_all_plants
+        for input_path, output_path in scenarios:
             
-    
-#%%
-    
-# Calculate Annual Emissions
-   
-for df in df_list: 
-    df['ANNUAL_EMISSIONS'] = np.nan
-   
-    annual_total_emissions = pd.DataFrame()
-    annual_total_emissions['ANNUAL_EMISSIONS'] = np.nan
-   
-    for x in hours: 
-        if x == 0:
-            annual_total_emissions['ANNUAL_EMISSIONS'] = df['HOURLY_EMISSIONS_' + str(x)]
-        else: 
-            annual_total_emissions['ANNUAL_EMISSIONS'] = annual_total_emissions['ANNUAL_EMISSIONS'] + df['HOURLY_EMISSIONS_' + str(x)]
-       
-        df['ANNUAL_EMISSIONS'] = annual_total_emissions['ANNUAL_EMISSIONS'] * 365
-        
-        
-#%%
-        
-# Calculate Cumulative Emissions
-        
-for df in df_list:
-    df['CUMULATIVE_EMISSIONS'] = np.nan
-    
-    
-    # for every year in the run
-    runs_number= len(df.drop_duplicates(subset='[run number]', keep='first'))
-    runs_list = list(range(1, runs_number + 1))
-    
-    for r in runs_list: 
-        
-        cumulative_emissions = 0
-    
-        for y in years:
-            indexing = df[(df.loc[:,'[run number]'] == r) & \
-                          (df.loc[:,'Year'] == y)].index
-    
-            cumulative_emissions = cumulative_emissions + df.loc[indexing, 'ANNUAL_EMISSIONS'].values[0]
-            df.loc[indexing, 'CUMULATIVE_EMISSIONS'] = cumulative_emissions
-    
+            df, reference = process_scenario(input_path, output_path, lookup, years, hours, reference, \
+                                             settings=settings, cache=cache, bundle_id=bundle_id, recorder=recorder)
+            df_list.append(df)
 
 #%%
-        
-## Calculate Annual Emission Savings
-number_df = list(range(0,len(df_list)))
-#
-## reference dataframe
-reference = pd.DataFrame()
-reference['Average'] = np.nan
-                      
-    
-for df, num in zip(df_list,number_df):
-    
-    df['ANNUAL_EMISSION_SAVINGS'] = np.nan
-           
-    for y in years:
-        
-        indexing =  df[df.loc[:, 'Year'] == y].index
-       
-        # reference
-        if num == 0:
-            reference.at[y - 2005, 'Average'] = df.loc[indexing,'ANNUAL_EMISSIONS'].mean()          
-        
-        #emission savings
-        df.loc[indexing, 'ANNUAL_EMISSION_SAVINGS'] = reference.at[y - 2005,'Average'] - df.loc[indexing, 'ANNUAL_EMISSIONS']
-      
-    
-    
-#%%
-        
-# Calculate Cumulative Emission Savings
 
-reference = pd.DataFrame()
-reference['Average'] = np.nan
-                      
-    
-for df, num in zip(df_list,number_df):
-    
-    df['CUMULATIVE_EMISSION_SAVINGS'] = np.nan
-           
-    for y in years:
-        
-        indexing =  df[df.loc[:, 'Year'] == y].index
-       
-        # reference
-        if num == 0:
-            reference.at[y - 2005, 'Average'] = df.loc[indexing,'CUMULATIVE_EMISSIONS'].mean()          
-        
-        #emission savings
-        df.loc[indexing, 'CUMULATIVE_EMISSION_SAVINGS'] = reference.at[y - 2005,'Average'] - df.loc[indexing, 'CUMULATIVE_EMISSIONS']
+# 3. - 6. (streaming) Statistics per year of the emissions and emission savings
+
+# Same calculation chunk by chunk, without holding the result frames (see 'Emission_Pipeline.py').
+# In parallel mode, the workers return their statistics, which are merged in the main process.
+if __name__ == '__main__' and aggregation_mode == 'streaming':
+
+    statistics_list = [None] * len(csv_path_list)
+
+    statistics_list[baseline], reference = stream_scenario_statistics(csv_path_list[baseline], lookup, years, hours, \
+                                                                      settings=settings, recorder=recorder)
+
+    others = [i for i in range(len(csv_path_list)) if i != baseline]
+
+    if parallel_mode:
+
+        for i, statistics in zip(others, stream_scenarios_parallel([csv_path_list[i] for i in others], merit_order_bundle, \
+                                                                   years, hours, reference, settings=settings, \
+                                                                   processes=processes, recorder=recorder)):
+            statistics_list[i] = statistics
+
+    else:
+
+        for i in others:
+            statistics_list[i], _ = stream_scenario_statistics(csv_path_list[i], lookup, years, hours, reference, \
+                                                               settings=settings, recorder=recorder)
+
+    for i, statistics in enumerate(statistics_list):
+        export_csv = statistics.summary().to_csv(output_path_list[i][:-len(output_suffixes[output_mode])] + "_statistics.csv")
 
-#%%
-        
-# Add EV emission savings to electricity emission savings
-        
-# Annual        
-for df in df_list: 
-    df['ANNUAL_EMISSION_SAVINGS_INCL_EV'] = np.nan
-   
-    annual_total_emissions_incl_ev = pd.DataFrame()
-    annual_total_emissions_incl_ev['ANNUAL_EMISSION_SAVINGS_INCL_EV'] = np.nan
-   
-    annual_total_emissions_incl_ev['ANNUAL_EMISSION_SAVINGS_INCL_EV'] = df['ANNUAL_EMISSION_SAVINGS'] + df['annual-CO2-emission-reductions-from-gasoline-displacement'] * 1000000
-
-    df['ANNUAL_EMISSION_SAVINGS_INCL_EV'] = annual_total_emissions_incl_ev['ANNUAL_EMISSION_SAVINGS_INCL_EV']
-
-#Cumulative
-for df in df_list:
-    df['CUMULATIVE_EMISSION_SAVINGS_INCL_EV'] = np.nan
-    
-    
-    # for every year in the run
-    runs_number= len(df.drop_duplicates(subset='[run number]', keep='first'))
-    runs_list = list(range(1, runs_number + 1))
-    
-    for r in runs_list: 
-        
-        cumulative_emissions_incl_ev = 0
-    
-        for y in years:
-            indexing = df[(df.loc[:,'[run number]'] == r) & \
-                          (df.loc[:,'Year'] == y)].index
-    
-            cumulative_emissions_incl_ev = cumulative_emissions_incl_ev + df.loc[indexing, 'ANNUAL_EMISSION_SAVINGS_INCL_EV'].values[0]
-            df.loc[indexing, 'CUMULATIVE_EMISSION_SAVINGS_INCL_EV'] = cumulative_emissions_incl_ev
 
-     
 #%%
 
-# 6. Save adjusted framework 
-df_list[0].to_csv(file_path_ref + csv_file_to_read + "_pre_em.csv", index=False)
+# 7. Pairwise comparison of all scenarios
 
-        
-for csv, num in zip(csv_file_to_read_list, number_df):
-    
-    if num != 0:
-        df_list[num].to_csv(file_path + csv + "_pre_em.csv", index=False)
+# Average emissions and savings per year of every scenario, read from the saved results (also in parallel mode)
+# or taken from the streamed statistics, and the savings of every scenario against every other one as baseline
+# (see 'Emission_Pipeline.py')
+if __name__ == '__main__':
+
+    recorder.start('comparison')
 
+    scenario_averages = {}
 
+    for i, (name, output_path) in enumerate(zip(scenario_names(output_path_list), output_path_list)):
 
+        if aggregation_mode == 'streaming':
+            scenario_averages[name] = statistics_list[i].means(comparison_columns)
+        else:
+            scenario_averages[name] = scenario_average(output_path, years)
 
+    savings_pairwise = pairwise_savings(scenario_averages, years)
 
+    export_csv = savings_pairwise.to_csv(file_path + "emission_savings_pairwise.csv")
 
+    recorder.stop(rows=len(savings_pairwise))
 
+    # Run report
+    recorder.print_summary()
+    recorder.report(report_path)
 
 
+#%%
 
+# 8. Monte Carlo: confidence bands of the emissions and emission savings per scenario and year
+
+# All draws of a year are dispatched at once; the reference and all scenarios use the same draws.
+# Only the load profiles are needed, thus the NetLogo files are read in 'projected' mode.
+if __name__ == '__main__' and monte_carlo_draws > 0:
+
+    recorder.start('monte_carlo')
+
+    plants_by_year = {}
+
+    for y in years:
+        plants_by_year[y] = pd.read_csv(path_powerplants + "powerplants_average_day_" + str(y) + ".csv", index_col=0)
 
+    parameter_spreads = pd.read_csv(path_powerplants + "parameter_spreads.csv", index_col=0)
 
+    reference_annual = None
 
+    for i in [baseline] + [i for i in range(len(csv_path_list)) if i != baseline]:
 
+        print("MONTE CARLO: " + os.path.basename(csv_path_list[i]))
 
+        df_loads = read_netlogo_results(csv_path_list[i], 'projected')
 
-     
+        annual = ensemble_annual_emissions(df_loads, plants_by_year, years, hours, parameter_spreads, \
+                                           monte_carlo_draws, monte_carlo_seed, dispatch_mode)
 
+        if reference_annual is None:
+            reference_annual = annual
 
+        bands = emission_bands(annual, years, reference_annual)
 
+        export_csv = bands.to_csv(output_path_list[i][:-len(output_suffixes[output_mode])] + "_emission_bands.csv")
 
+    recorder.stop()
+    recorder.report(report_path)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled merit order dispatch over all runs, years, and hours (optional, needs Numba).
+
+Helper functions used by 'Merit_Order_Dispatch.py'.
+"""
+
+import numpy as np
+import pandas as pd
+
+try:
+    import numba
+except ImportError:
+    # Without Numba, 'calculate_hourly_emissions' uses the NumPy dispatch
+    numba = None
+
+#%%
+
+######################################################################################################
+########################           Dispatch kernel                          ##########################
+######################################################################################################
+
+# The NumPy dispatch ('dispatch_emissions') runs one binary search per (year, hour) and allocates several
+# temporary arrays for it. The kernel below does the same in one loop over all rows and hours: binary search,
+# interpolation of the marginal powerplant ('partial' dispatch), and writing the result, without temporaries.
+# It follows 'dispatch_emissions' operation by operation, so that the results are bit-identical:
+# - the binary search counts the powerplants with 'capacity_cum <= demand' (like searchsorted with side='right';
+#   missing values only occur at the end of the prefix sums and are never below the demand)
+# - a NaN demand dispatches nothing
+# - the share of the marginal powerplant is clipped to [0, 1] and dropped if the partial emissions are not finite
+# The kernel works on flat prefix sums with start and end per (year, hour) segment, like the merit order bundle;
+# with a lookup of a bundle, the arrays of the bundle are used directly.
+# Rows run in parallel threads. In the workers of a process pool, every worker would start one thread per core,
+# thus the workers limit the kernel to one thread ('limit_kernel_threads').
+
+jit_available = numba is not None
+
+dispatch_kernels = ['auto', 'jit', 'numpy']
+
+prange = numba.prange if numba is not None else range
+
+
+def _dispatch_kernel(capacity_cum, emissions_cum, starts, ends, segments, demand, partial, hourly_emissions):
+
+    rows, hours = demand.shape
+
+    for i in prange(rows):
+        for x in range(hours):
+
+            segment = segments[i, x]
+
+            if segment < 0:
+                continue
+
+            d = demand[i, x]
+
+            if d != d:
+                hourly_emissions[i, x] = 0.0
+                continue
+
+            start = starts[segment]
+            n = ends[segment] - start
+
+            # Number of dispatched powerplants
+            low = 0
+            high = n
+
+            while low < high:
+                middle = (low + high) // 2
+
+                if capacity_cum[start + middle] <= d:
+                    low = middle + 1
+                else:
+                    high = middle
+
+            emissions = emissions_cum[start + low - 1] if low > 0 else 0.0
+
+            if partial and low < n:
+
+                capacity_below = capacity_cum[start + low - 1] if low > 0 else 0.0
+
+                share = (d - capacity_below) / (capacity_cum[start + low] - capacity_below)
+
+                if share < 0.0:
+                    share = 0.0
+                elif share > 1.0:
+                    share = 1.0
+
+                partial_emissions = share * (emissions_cum[start + low] - emissions)
+
+                if not np.isfinite(partial_emissions):
+                    partial_emissions = 0.0
+
+                emissions = emissions + partial_emissions
+
+            hourly_emissions[i, x] = emissions
+
+
+# Rows run in parallel threads when compiled
+if numba is not None:
+    _dispatch_kernel_jit = numba.njit(cache=True, parallel=True, error_model='numpy')(_dispatch_kernel)
+else:
+    _dispatch_kernel_jit = None
+
+
+def pack_lookup(lookup, years, hours):
+    """Return flat prefix sums, start and end of every segment, and the segment of every (year, hour) (years x hours).
+
+    A lookup of a merit order bundle (see 'merit_order_lookup_from_bundle') keeps the flat arrays of the bundle; they
+    are used as they are (memory map or shared memory), without copying. Other lookups are packed segment by segment.
+    """
+
+    bundle = getattr(lookup, 'bundle', None)
+
+    if bundle is not None:
+
+        year_position = pd.Index(bundle['YEARS']).get_indexer(years)
+        hour_position = pd.Index(bundle['HOURS']).get_indexer(hours)
+
+        if np.all(year_position >= 0) and np.all(hour_position >= 0):
+
+            offsets = np.asarray(bundle['OFFSETS'], dtype=np.int64)
+            segments = year_position[:, None] * len(bundle['HOURS']) + hour_position[None, :]
+
+            return np.asarray(bundle['CAPACITY_CUM']), np.asarray(bundle['EMISSIONS_CUM']), offsets[:-1], offsets[1:], \
+                   segments.astype(np.int64)
+
+    capacity_list = []
+    emissions_list = []
+
+    for y in years:
+        for x in hours:
+            capacity_cum, emissions_cum = lookup[(y, x)]
+
+            capacity_list.append(np.asarray(capacity_cum, dtype=float))
+            emissions_list.append(np.asarray(emissions_cum, dtype=float))
+
+    ends = np.cumsum([len(c) for c in capacity_list]).astype(np.int64)
+    starts = ends - np.array([len(c) for c in capacity_list], dtype=np.int64)
+    segments = np.arange(len(years) * len(hours), dtype=np.int64).reshape(len(years), len(hours))
+
+    return np.concatenate(capacity_list), np.concatenate(emissions_list), starts, ends, segments
+
+
+def limit_kernel_threads(threads=1):
+    """Limit the threads of the compiled kernel in this process (e.g., 1 in the workers of a process pool)."""
+
+    if numba is not None:
+        numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+
+
+def calculate_hourly_emissions_kernel(df, lookup, years, hours, dispatch_mode='whole', compiled=True, out=None):
+    """Return the same array as 'calculate_hourly_emissions' with the dispatch kernel (compiled, if Numba is available).
+
+    With 'compiled=False', the kernel runs as plain Python (slow, for checking the kernel without Numba).
+    With 'out' (rows x hours), the emissions are written into it instead of a new array.
+    """
+
+    if dispatch_mode not in ['whole', 'partial']:
+        raise ValueError("Unknown dispatch mode: " + str(dispatch_mode))
+
+    capacity_cum, emissions_cum, starts, ends, segment_of = pack_lookup(lookup, years, hours)
+
+    # Segment of every row and hour (-1: year not calculated, the row stays NaN)
+    year_position = pd.Index(years).get_indexer(df['Year'].values)
+
+    segments = np.where(year_position[:, None] >= 0, segment_of[np.maximum(year_position, 0)], -1)
+    demand = np.column_stack([df['system-load-profile_' + str(x)].values.astype(float) for x in hours])
+
+    if out is None:
+        hourly_emissions = np.full((len(df), len(hours)), np.nan)
+    else:
+        hourly_emissions = out
+        hourly_emissions[:] = np.nan
+
+    kernel = _dispatch_kernel_jit if compiled else _dispatch_kernel
+
+    if kernel is None:
+        raise ValueError("The compiled dispatch kernel needs Numba")
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        kernel(capacity_cum, emissions_cum, starts, ends, segments.astype(np.int64), np.ascontiguousarray(demand),
+               dispatch_mode == 'partial', hourly_emissions)
+
+    return hourly_emissions
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Emissions-versus-demand curves of the merit order per year and hour.
+
+Helper functions used by 'Power_Plants_in_CA.py' (export) and for evaluating load values without the fleet tables.
+"""
+
+import numpy as np
+import pandas as pd
+
+#%%
+
+######################################################################################################
+########################           Curve tables                             ##########################
+######################################################################################################
+
+# For a given year and hour, the emissions of meeting a demand are a fixed, monotone step function of the demand:
+# at every cumulative capacity of the merit order (breakpoint), the emissions jump by the emissions of that powerplant.
+# The curve table holds, per (year, hour), the breakpoints in increasing order with
+# - 'EMISSIONS_[tCO2/h]': emissions of all powerplants up to the breakpoint ('whole' dispatch)
+# - 'MARGINAL_EMISSION_FACTOR_[tCO2/MWh]': emission factor of the next powerplant, which covers demand above the
+#   breakpoint ('partial' dispatch: emissions + (demand - breakpoint) * marginal emission factor); 0 after the last one
+# The first breakpoint of every curve is 0 MW with 0 emissions. Powerplants without capacity do not add a breakpoint.
+# The table is a plain csv file, so that the NetLogo model can read it as well.
+
+curve_columns = ['YEAR', 'HOUR', 'BREAKPOINT_[MW]', 'EMISSIONS_[tCO2/h]', 'MARGINAL_EMISSION_FACTOR_[tCO2/MWh]']
+
+
+def emission_curve(capacity_cum, emissions_cum):
+    """Return breakpoints, emissions, and marginal emission factors of one merit order given by its prefix sums."""
+
+    capacity_cum = np.asarray(capacity_cum, dtype=float)
+    emissions_cum = np.asarray(emissions_cum, dtype=float)
+
+    # Powerplants after a missing capacity are never dispatched (see 'dispatch_emissions')
+    missing = np.flatnonzero(~np.isfinite(capacity_cum))
+    end = missing[0] if len(missing) > 0 else len(capacity_cum)
+
+    breakpoints = np.concatenate([[0.0], capacity_cum[:end]])
+    emissions = np.concatenate([[0.0], emissions_cum[:end]])
+
+    # Of equal breakpoints, the last one counts (all powerplants up to it are dispatched)
+    last = np.append(breakpoints[1:] != breakpoints[:-1], True)
+    breakpoints = breakpoints[last]
+    emissions = emissions[last]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        marginal = np.append(np.diff(emissions) / np.diff(breakpoints), 0.0)
+
+    marginal = np.where(np.isfinite(marginal), marginal, 0.0)
+
+    return breakpoints, emissions, marginal
+
+
+def emission_curves_from_lookup(lookup):
+    """Return the curve table of all (year, hour) of a merit order lookup (see 'merit_order_lookup_from_bundle')."""
+
+    tables = []
+
+    for (y, x), (capacity_cum, emissions_cum) in sorted(lookup.items()):
+
+        breakpoints, emissions, marginal = emission_curve(capacity_cum, emissions_cum)
+
+        tables.append(pd.DataFrame({'YEAR': y,
+                                    'HOUR': x,
+                                    'BREAKPOINT_[MW]': breakpoints,
+                                    'EMISSIONS_[tCO2/h]': emissions,
+                                    'MARGINAL_EMISSION_FACTOR_[tCO2/MWh]': marginal}, columns=curve_columns))
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def emission_curve_lookup(curves):
+    """Return a dictionary {(year, hour): (breakpoints, emissions, marginal emission factors)} of a curve table."""
+
+    lookup = {}
+
+    for (y, x), curve in curves.groupby(['YEAR', 'HOUR'], sort=False):
+        lookup[(int(y), int(x))] = (curve['BREAKPOINT_[MW]'].values,
+                                    curve['EMISSIONS_[tCO2/h]'].values,
+                                    curve['MARGINAL_EMISSION_FACTOR_[tCO2/MWh]'].values)
+
+    return lookup
+
+#%%
+
+######################################################################################################
+########################           Evaluating load values                   ##########################
+######################################################################################################
+
+# A load value is evaluated by finding the last breakpoint below (or at) it, either with a binary search or with a
+# bucket index: for a grid of demands with fixed bucket width, the index of the last breakpoint at the start of
+# every bucket. From there only the few breakpoints within the bucket have to be checked.
+
+def curve_segments(breakpoints, demand):
+    """Return the index of the last breakpoint <= demand (binary search), -1 for negative or missing demand."""
+
+    demand = np.asarray(demand, dtype=float)
+
+    segments = np.searchsorted(breakpoints, demand, side='right') - 1
+    segments[np.isnan(demand)] = -1
+
+    return segments
+
+
+def curve_bucket_index(breakpoints, bucket_width):
+    """Return the bucket index of a curve: last breakpoint at the start of every bucket of 'bucket_width' MW."""
+
+    starts = np.arange(0, breakpoints[-1] + bucket_width, bucket_width)
+
+    return np.searchsorted(breakpoints, starts, side='right') - 1
+
+
+def curve_segments_bucketed(breakpoints, bucket_index, bucket_width, demand):
+    """Return the same as 'curve_segments', using the bucket index of the curve."""
+
+    demand = np.asarray(demand, dtype=float)
+    valid = demand >= 0
+
+    bucket = np.where(valid, np.minimum(demand // bucket_width, len(bucket_index) - 1), 0).astype(np.int64)
+    segments = np.where(valid, bucket_index[bucket], -1)
+
+    # Move forward over the breakpoints within the bucket
+    while True:
+        following = np.minimum(segments + 1, len(breakpoints) - 1)
+        forward = valid & (segments + 1 < len(breakpoints)) & (breakpoints[following] <= demand)
+
+        if not np.any(forward):
+            return segments
+
+        segments = segments + forward
+
+
+def evaluate_emission_curve(breakpoints, emissions, marginal, demand, dispatch_mode='whole', segments=None):
+    """Return hourly emissions [tCO2/h] of 'demand' from an emission curve (same as 'dispatch_emissions')."""
+
+    demand = np.asarray(demand, dtype=float)
+
+    if segments is None:
+        segments = curve_segments(breakpoints, demand)
+
+    running = segments >= 0
+    index = np.maximum(segments, 0)
+
+    if dispatch_mode == 'whole':
+        return np.where(running, emissions[index], 0.0)
+
+    elif dispatch_mode == 'partial':
+        return np.where(running, emissions[index] + (demand - breakpoints[index]) * marginal[index], 0.0)
+
+    else:
+        raise ValueError("Unknown dispatch mode: " + str(dispatch_mode))
@@ -0,0 +1,804 @@
+# -*- coding: utf-8 -*-
+"""
+Emission calculation of one NetLogo scenario, serial or in a process pool.
+
+Helper functions used by 'Calculate_Carbon_Emissions.py'.
+"""
+
+import os
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from Merit_Order_Dispatch import calculate_hourly_emissions, lookup_from_bundle
+from Dispatch_Kernel import limit_kernel_threads
+from NetLogo_Results import read_netlogo_results, read_and_dispatch_netlogo_results, read_and_dispatch_full_year_results, \
+                            iter_dispatched_netlogo_results, iter_dispatched_full_year_results, write_emission_results, \
+                            read_emission_results, emission_result_columns, count_netlogo_rows
+from Online_Statistics import YearlyStatistics, RunningCumulative
+from Result_Cache import scenario_cache_key
+from Stage_Instrumentation import StageRecorder, recorded_stage
+
+#%%
+
+######################################################################################################
+########################           Emissions of one scenario                ##########################
+######################################################################################################
+
+# The steps below are the same for the reference and all sensitivity scenarios:
+# 1. Hourly emissions (merit order dispatch, see 'Merit_Order_Dispatch.py')
+# 2. Annual emissions
+# 3. Cumulative emissions
+# 4. Annual and cumulative emission savings compared to the average of the reference scenario
+# 5. Add EV emission savings to electricity emission savings
+
+def annual_emissions(hourly_emissions, out=None):
+    """Return the annual emissions (sum of the average day times 365) of the hourly emissions (rows x hours)."""
+
+    if out is None:
+        out = np.empty(len(hourly_emissions))
+
+    # Hour by hour, times 365
+    np.copyto(out, hourly_emissions[:, 0])
+
+    for i in range(1, hourly_emissions.shape[1]):
+        np.add(out, hourly_emissions[:, i], out=out)
+
+    np.multiply(out, 365, out=out)
+
+    return out
+
+
+def cumulative_by_run(df, values, years, out=None):
+    """Return the sum of 'values' (one per row of 'df') over the years of each run, NaN for rows of other years."""
+
+    years = np.sort(np.asarray(years))
+
+    # Rows of the considered years, coded by run number and year (run numbers do not need to be 1..N)
+    rows = np.flatnonzero(np.isin(df['Year'].values, years))
+    runs, run_codes = np.unique(df['[run number]'].values[rows], return_inverse=True)
+    year_codes = np.searchsorted(years, df['Year'].values[rows])
+
+    # Runs x years grid, sorted once. If a run has several rows in one year, its first row counts.
+    cell_codes = run_codes * len(years) + year_codes
+    cells, first_rows = np.unique(cell_codes, return_index=True)
+
+    grid = np.zeros((len(runs), len(years)))
+    grid.flat[cells] = np.asarray(values)[rows][first_rows]
+
+    # Cumulative sum over the years of each run (adding year by year, as before)
+    cumulative = np.cumsum(grid, axis=1)
+
+    if out is None:
+        out = np.empty(len(df))
+
+    out[:] = np.nan
+    out[rows] = cumulative[run_codes, year_codes]
+
+    return out
+
+
+reference_columns = ['ANNUAL_EMISSIONS', 'CUMULATIVE_EMISSIONS']
+
+
+def reference_average(df, years, columns=reference_columns):
+    """Return the average of 'columns' (by default annual and cumulative emissions) over all runs per year."""
+
+    rows = df['Year'].isin(years)
+
+    # One groupby pass over all columns instead of one selection per year
+    return df.loc[rows].groupby('Year')[columns].mean().reindex(years)
+
+
+def emission_savings(year, annual, cumulative, ev_emission_reductions, reference, years):
+    """Return annual savings, cumulative savings, and annual savings including EVs (arrays) of rows of 'year'.
+
+    The savings are the reference average of the year of every row (NaN for other years) minus the emissions of
+    the row. 'reference' can be the average of any baseline scenario (see 'reference_average').
+    """
+
+    year = pd.Series(year)
+    year = year.where(year.isin(years))
+
+    annual_savings = year.map(reference['ANNUAL_EMISSIONS']).values - annual
+    cumulative_savings = year.map(reference['CUMULATIVE_EMISSIONS']).values - cumulative
+
+    # Add EV emission savings to electricity emission savings
+    annual_savings_incl_ev = annual_savings + ev_emission_reductions * 1000000
+
+    return annual_savings, cumulative_savings, annual_savings_incl_ev
+
+
+#%%
+
+######################################################################################################
+########################           Preallocated result columns              ##########################
+######################################################################################################
+
+# Inserting the result columns one by one into the wide NetLogo frame (~977 columns) fragments it and copies
+# data again and again. Instead, all results of a scenario are calculated into one preallocated float array
+# (rows x result columns, column-major, so every column is contiguous) and attached to the frame once.
+
+def allocate_results(rows, columns):
+    """Return one array (rows x columns, column-major) for the result columns, filled with NaN."""
+
+    return np.full((rows, len(columns)), np.nan, order='F')
+
+
+def attach_results(df, results, columns):
+    """Return 'df' with the result columns attached at once (columns of the same name are replaced)."""
+
+    df = df.drop(columns=[c for c in columns if c in df.columns])
+
+    return pd.concat([df, pd.DataFrame(results, index=df.index, columns=columns, copy=False)], axis=1)
+
+
+def fill_emission_results(df, hourly_emissions, results, columns, years, reference=None):
+    """Calculate annual and cumulative emissions and savings of 'df' into the columns of 'results'.
+
+    'hourly_emissions' (rows x hours) are the hourly emissions of 'df', 'columns' the names of the columns
+    of 'results'. Without 'reference', its average is used. Returns the reference average.
+    """
+
+    def column(name):
+        return results[:, columns.index(name)]
+
+    annual = annual_emissions(hourly_emissions, out=column('ANNUAL_EMISSIONS'))
+
+    cumulative_by_run(df, annual, years, out=column('CUMULATIVE_EMISSIONS'))
+
+    if reference is None:
+        reference = reference_average(pd.DataFrame({'Year': df['Year'].values,
+                                                    'ANNUAL_EMISSIONS': annual,
+                                                    'CUMULATIVE_EMISSIONS': column('CUMULATIVE_EMISSIONS')}), years)
+
+    savings = emission_savings(df['Year'].values, annual, column('CUMULATIVE_EMISSIONS'),
+                               df['annual-CO2-emission-reductions-from-gasoline-displacement'].values, reference, years)
+
+    for name, values in zip(['ANNUAL_EMISSION_SAVINGS', 'CUMULATIVE_EMISSION_SAVINGS', 'ANNUAL_EMISSION_SAVINGS_INCL_EV'], savings):
+        np.copyto(column(name), values)
+
+    cumulative_by_run(df, column('ANNUAL_EMISSION_SAVINGS_INCL_EV'), years, out=column('CUMULATIVE_EMISSION_SAVINGS_INCL_EV'))
+
+    return reference
+
+#%%
+
+######################################################################################################
+########################           Pairwise scenario comparison             ##########################
+######################################################################################################
+
+# The savings above are calculated against one reference. To compare scenarios with each other
+# (e.g., Tiered vs. TOU vs. Hourly Pricing), we reduce every scenario once to its average per year and
+# calculate the savings of every scenario against every other scenario as baseline from these averages.
+# As the savings including EVs of all scenarios refer to the same reference, their difference is the saving
+# including EVs of one scenario against the other.
+
+comparison_columns = ['ANNUAL_EMISSIONS',
+                      'CUMULATIVE_EMISSIONS',
+                      'ANNUAL_EMISSION_SAVINGS_INCL_EV',
+                      'CUMULATIVE_EMISSION_SAVINGS_INCL_EV']
+
+
+def scenario_average(results, years):
+    """Return the averages per year needed for the pairwise comparison, from a dataframe or a result file."""
+
+    if isinstance(results, str):
+        results = read_emission_results(results, columns=['Year'] + comparison_columns)
+
+    return reference_average(results, years, comparison_columns)
+
+
+def scenario_names(paths):
+    """Return the names of the scenarios for the comparison: their file names, or their paths if file names repeat."""
+
+    names = [os.path.basename(path) for path in paths]
+
+    # Scenarios of the same file name in different folders must not overwrite each other
+    if len(set(names)) < len(names):
+        names = [os.path.normpath(path) for path in paths]
+
+    if len(set(names)) < len(names):
+        raise ValueError("Scenarios are listed more than once: " + str(sorted(set(n for n in names if names.count(n) > 1))))
+
+    return names
+
+
+def pairwise_savings(averages, years):
+    """Return the savings of every scenario against every baseline scenario per year.
+
+    'averages' is a dictionary {scenario name (see 'scenario_names'): 'scenario_average'}. The result is indexed by
+    year, baseline, and scenario, with the average annual and cumulative savings with and without EVs.
+    """
+
+    names = list(averages)
+
+    # Years x scenarios arrays
+    def stacked(column):
+        return np.column_stack([averages[name].reindex(years)[column].values for name in names])
+
+    annual = stacked('ANNUAL_EMISSIONS')
+    cumulative = stacked('CUMULATIVE_EMISSIONS')
+    annual_incl_ev = stacked('ANNUAL_EMISSION_SAVINGS_INCL_EV')
+    cumulative_incl_ev = stacked('CUMULATIVE_EMISSION_SAVINGS_INCL_EV')
+
+    # [year, baseline, scenario]: emissions of the baseline minus emissions of the scenario
+    index = pd.MultiIndex.from_product([years, names, names], names=['Year', 'BASELINE', 'SCENARIO'])
+
+    savings = pd.DataFrame(index=index)
+    savings['ANNUAL_EMISSION_SAVINGS'] = (annual[:, :, None] - annual[:, None, :]).ravel()
+    savings['CUMULATIVE_EMISSION_SAVINGS'] = (cumulative[:, :, None] - cumulative[:, None, :]).ravel()
+    savings['ANNUAL_EMISSION_SAVINGS_INCL_EV'] = (annual_incl_ev[:, None, :] - annual_incl_ev[:, :, None]).ravel()
+    savings['CUMULATIVE_EMISSION_SAVINGS_INCL_EV'] = (cumulative_incl_ev[:, None, :] - cumulative_incl_ev[:, :, None]).ravel()
+
+    return savings
+
+#%%
+
+# Settings of the calculation:
+# - 'read_mode': 'full' (all NetLogo columns) or 'projected' (only the needed columns, read in chunks), see 'NetLogo_Results.py'
+# - 'chunksize': rows per chunk in 'projected' read mode
+# - 'output_mode': 'csv' (adjusted framework with all columns) or 'parquet'/'feather' (only the result columns)
+# - 'dispatch_mode': 'whole' (only whole powerplants below the demand) or 'partial' (with the marginal powerplant), see 'Merit_Order_Dispatch.py'
+# - 'time_resolution': 'average_day' (24 hours times 365) or 'full_year' (8760-hour load profiles and full-year merit order)
+# - 'full_year_chunksize': rows per chunk in 'full_year' time resolution
+# - 'relative_accuracy': relative accuracy of the quantiles in streaming aggregation (see 'Online_Statistics.py')
+# - 'dispatch_kernel': 'auto' (compiled kernel if Numba is available), 'jit', or 'numpy', see 'Dispatch_Kernel.py'
+default_settings = {'read_mode': 'full',
+                    'chunksize': 100000,
+                    'output_mode': 'csv',
+                    'dispatch_mode': 'whole',
+                    'time_resolution': 'average_day',
+                    'full_year_chunksize': 2000,
+                    'relative_accuracy': 0.005,
+                    'dispatch_kernel': 'auto'}
+
+
+def process_scenario(input_path, output_path, lookup, years, hours, reference=None, settings=None, \
+                     cache=None, bundle_id=None, load_cached=True, recorder=None):
+    """Calculate emissions and emission savings of one NetLogo '_pre.csv' file.
+
+    Without 'reference', the scenario is the reference itself and its average is used for the savings.
+    'lookup' is the merit order lookup of the time resolution in 'settings' (see 'lookup_from_bundle').
+    The results are saved to 'output_path' (if given). Returns the dataframe and the reference average.
+    With a 'cache' (see 'Result_Cache.py'), unchanged scenarios are copied from the cache instead of recalculated;
+    'bundle_id' is the fingerprint of the merit order bundle. With 'load_cached=False', a cached dataframe is not read.
+    With a 'recorder' (see 'Stage_Instrumentation.py'), the time and memory of every stage are recorded.
+    """
+
+    settings = dict(default_settings, **(settings or {}))
+    scenario = os.path.basename(input_path)
+
+    if cache is not None and output_path is not None:
+
+        key = scenario_cache_key(cache, input_path, bundle_id, years, hours, reference, settings)
+        entry = cache.get(key)
+
+        if entry is not None:
+            try:
+                print("CACHED: " + scenario)
+
+                with recorded_stage(recorder, 'cache', scenario) as record:
+
+                    shutil.copyfile(cache.result_path(entry, output_path), output_path)
+
+                    if reference is None:
+                        reference = cache.load_reference(entry)
+
+                    df = read_emission_results(output_path) if load_cached else None
+                    record['rows'] = len(df) if df is not None else None
+
+                return df, reference
+
+            # The entry may have been evicted in the meantime
+            except OSError:
+                pass
+
+    # In 'projected' read mode and 'full_year' time resolution, reading and dispatch run together chunk by chunk
+    if settings['time_resolution'] == 'full_year':
+        with recorded_stage(recorder, 'ingest_and_dispatch', scenario) as record:
+            df = read_and_dispatch_full_year_results(input_path, lookup, years, settings['full_year_chunksize'], settings['dispatch_mode'])
+            record['rows'] = len(df)
+
+    elif settings['read_mode'] == 'projected':
+        with recorded_stage(recorder, 'ingest_and_dispatch', scenario) as record:
+            df = read_and_dispatch_netlogo_results(input_path, lookup, years, hours, settings['chunksize'], settings['dispatch_mode'], \
+                                                   settings['dispatch_kernel'])
+            record['rows'] = len(df)
+
+    else:
+        with recorded_stage(recorder, 'ingest', scenario) as record:
+            df = read_netlogo_results(input_path, settings['read_mode'])
+            record['rows'] = len(df)
+
+    # All result columns go into one array, which is attached once and replaces columns of the same name (e.g.,
+    # stale results in a re-read '_em' file)
+    columns = emission_result_columns(hours)
+    results = allocate_results(len(df), columns)
+
+    if settings['time_resolution'] == 'full_year' or settings['read_mode'] == 'projected':
+        hourly_emissions = results[:, :len(hours)]
+        np.copyto(hourly_emissions, df[columns[:len(hours)]].values)
+
+    else:
+        with recorded_stage(recorder, 'dispatch', scenario, len(df)):
+            hourly_emissions = calculate_hourly_emissions(df, lookup, years, hours, dispatch_mode=settings['dispatch_mode'], \
+                                                          dispatch_kernel=settings['dispatch_kernel'], out=results[:, :len(hours)])
+
+    with recorded_stage(recorder, 'aggregation', scenario, len(df)):
+        reference = fill_emission_results(df, hourly_emissions, results, columns, years, reference)
+
+        df = attach_results(df, results, columns)
+
+    if output_path is not None:
+        with recorded_stage(recorder, 'export', scenario, len(df)):
+            write_emission_results(df, output_path, hours, settings['output_mode'])
+
+            if cache is not None:
+                cache.put(key, output_path, reference)
+
+    return df, reference
+
+#%%
+
+######################################################################################################
+########################           Streaming aggregation                    ##########################
+######################################################################################################
+
+# Many outputs only need the statistics per year across runs (mean, standard deviation, quantiles) of the annual
+# and cumulative emissions and savings. In streaming mode, chunks of the NetLogo file go through the dispatch,
+# get their annual, cumulative, and savings columns, and are added to online statistics (see 'Online_Statistics.py').
+# Only one chunk and one cumulative value per run are held in memory, never the whole result frame.
+# The savings need the reference average. Without 'reference', the scenario is the reference itself: a first pass
+# yields its average emissions, a second pass its savings.
+
+statistics_columns = ['ANNUAL_EMISSIONS',
+                      'CUMULATIVE_EMISSIONS',
+                      'ANNUAL_EMISSION_SAVINGS',
+                      'CUMULATIVE_EMISSION_SAVINGS',
+                      'ANNUAL_EMISSION_SAVINGS_INCL_EV',
+                      'CUMULATIVE_EMISSION_SAVINGS_INCL_EV']
+
+
+def iter_dispatched_chunks(input_path, lookup, years, hours, settings):
+    """Yield the chunks of a NetLogo file with the 'HOURLY_EMISSIONS_<hour>' columns added."""
+
+    if settings['time_resolution'] == 'full_year':
+        return iter_dispatched_full_year_results(input_path, lookup, years, settings['full_year_chunksize'], settings['dispatch_mode'])
+
+    return iter_dispatched_netlogo_results(input_path, lookup, years, hours, settings['chunksize'], settings['dispatch_mode'], \
+                                           settings['dispatch_kernel'])
+
+
+def _stream_pass(input_path, lookup, years, hours, reference, settings, recorder, stage):
+
+    columns = statistics_columns if reference is not None else reference_columns
+
+    statistics = YearlyStatistics(columns, years, settings['relative_accuracy'])
+    cumulative_emissions = RunningCumulative(years)
+    cumulative_savings_incl_ev = RunningCumulative(years)
+
+    with recorded_stage(recorder, stage, os.path.basename(input_path)) as record:
+
+        rows = 0
+
+        for chunk in iter_dispatched_chunks(input_path, lookup, years, hours, settings):
+
+            chunk['ANNUAL_EMISSIONS'] = annual_emissions(chunk[['HOURLY_EMISSIONS_' + str(x) for x in hours]].values)
+            chunk['CUMULATIVE_EMISSIONS'] = cumulative_emissions.add(chunk, 'ANNUAL_EMISSIONS')
+
+            if reference is not None:
+
+                # Same savings as 'fill_emission_results', with the cumulative sum carried over the chunks
+                chunk['ANNUAL_EMISSION_SAVINGS'], chunk['CUMULATIVE_EMISSION_SAVINGS'], chunk['ANNUAL_EMISSION_SAVINGS_INCL_EV'] = \
+                    emission_savings(chunk['Year'].values, chunk['ANNUAL_EMISSIONS'].values, chunk['CUMULATIVE_EMISSIONS'].values,
+                                     chunk['annual-CO2-emission-reductions-from-gasoline-displacement'].values, reference, years)
+                chunk['CUMULATIVE_EMISSION_SAVINGS_INCL_EV'] = cumulative_savings_incl_ev.add(chunk, 'ANNUAL_EMISSION_SAVINGS_INCL_EV')
+
+            statistics.update(chunk)
+            rows += len(chunk)
+
+        record['rows'] = rows
+
+    return statistics
+
+
+def stream_scenario_statistics(input_path, lookup, years, hours, reference=None, settings=None, recorder=None):
+    """Return the statistics per year (see 'YearlyStatistics') of the emissions and savings of one NetLogo file.
+
+    Without 'reference', the scenario is the reference itself. Returns the statistics and the reference average.
+    """
+
+    settings = dict(default_settings, **(settings or {}))
+
+    if reference is None:
+        reference = _stream_pass(input_path, lookup, years, hours, None, settings, recorder, 'streaming_reference').means()
+
+    statistics = _stream_pass(input_path, lookup, years, hours, reference, settings, recorder, 'streaming_aggregation')
+
+    return statistics, reference
+
+#%%
+
+######################################################################################################
+########################           Scenarios in a process pool              ##########################
+######################################################################################################
+
+# Once the reference average is known, all scenarios are independent of each other. We process them in a
+# process pool. The merit order bundle is copied once into shared memory; the workers attach to it instead
+# of receiving a pickled copy of the powerplant tables.
+
+def share_merit_order_bundle(bundle):
+    """Copy the merit order bundle into shared memory. Returns the memory blocks and their description."""
+
+    blocks = []
+    description = {}
+
+    for name in bundle:
+
+        array = np.ascontiguousarray(bundle[name])
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+
+        blocks.append(block)
+        description[name] = (block.name, array.shape, array.dtype.str)
+
+    return blocks, description
+
+
+def attach_merit_order_bundle(description):
+    """Attach to a merit order bundle in shared memory. Returns the memory blocks and the (read-only) bundle."""
+
+    blocks = []
+    bundle = {}
+
+    for name, (block_name, shape, dtype) in description.items():
+
+        block = shared_memory.SharedMemory(name=block_name)
+
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+
+        blocks.append(block)
+        bundle[name] = array
+
+    return blocks, bundle
+
+
+# Merit order lookup of a worker process, set once when the worker starts
+_worker_blocks = []
+_worker_lookup = None
+
+
+def _init_worker(description):
+
+    global _worker_blocks, _worker_lookup
+
+    _worker_blocks, bundle = attach_merit_order_bundle(description)
+    _worker_lookup = lookup_from_bundle(bundle)
+
+    # The workers already use all cores; one kernel thread per worker
+    limit_kernel_threads(1)
+
+
+def _process_scenario_worker(input_path, output_path, years, hours, reference, settings, cache, bundle_id, record_stages):
+
+    print("SCENARIO: " + os.path.basename(input_path))
+
+    recorder = StageRecorder() if record_stages else None
+
+    process_scenario(input_path, output_path, _worker_lookup, years, hours, reference, settings, \
+                     cache, bundle_id, load_cached=False, recorder=recorder)
+
+    # Only the file name (and the stage records) go back to the main process, not the (large) dataframe
+    return output_path, (recorder.records if recorder is not None else [])
+
+
+def _merit_order_pool(description, processes):
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context('spawn')
+
+    return ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker, initargs=(description,))
+
+
+# A pool with one task per scenario keeps at most as many workers busy as there are scenarios (about 7). Thus every
+# scenario is split into row ranges ('parts'), so that there are more tasks than workers:
+# 1. Every part is read, dispatched, and aggregated on its own (the reference average is known). Cumulative sums
+#    over the years of a run can span parts, thus the part returns its run numbers, years, and annual values.
+# 2. The main process calculates the cumulative sums of the whole scenario from these few columns (with
+#    'cumulative_by_run', as for the whole frame), and every part gets its rows and is written.
+# 3. The written parts are joined into the output file, in the order of the rows.
+# The results are the same as with 'process_scenario'. In 'full' read mode, the types of the NetLogo columns are
+# inferred per part, so the csv output may format a column differently (e.g., '1.0' instead of '1') if it has
+# missing values only in some parts. Full-year scenarios are not split (one task per scenario).
+
+def _scenario_part_rows(rows, parts):
+    """Return the (start, stop) row ranges of a scenario split into 'parts'."""
+
+    bounds = np.unique(np.linspace(0, rows, max(1, min(parts, rows)) + 1).astype(np.int64))
+
+    if len(bounds) < 2:
+        return [(0, rows)]
+
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def _dispatch_part_worker(input_path, part_path, rows, years, hours, reference, settings, record_stages):
+
+    recorder = StageRecorder() if record_stages else None
+    scenario = os.path.basename(input_path) + " [" + str(rows[0]) + ":" + str(rows[1]) + "]"
+
+    with recorded_stage(recorder, 'ingest', scenario) as record:
+        df = read_netlogo_results(input_path, settings['read_mode'], rows=rows)
+        record['rows'] = len(df)
+
+    columns = emission_result_columns(hours)
+    results = allocate_results(len(df), columns)
+
+    with recorded_stage(recorder, 'dispatch', scenario, len(df)):
+        hourly_emissions = calculate_hourly_emissions(df, _worker_lookup, years, hours, verbose=False, \
+                                                      dispatch_mode=settings['dispatch_mode'], \
+                                                      dispatch_kernel=settings['dispatch_kernel'], out=results[:, :len(hours)])
+
+    # Cumulative columns of the part only; they are replaced in '_finish_part_worker'
+    with recorded_stage(recorder, 'aggregation', scenario, len(df)):
+        fill_emission_results(df, hourly_emissions, results, columns, years, reference)
+        df = attach_results(df, results, columns)
+
+    df.to_pickle(part_path)
+
+    return df[['[run number]', 'Year', 'ANNUAL_EMISSIONS', 'ANNUAL_EMISSION_SAVINGS_INCL_EV']], \
+           (recorder.records if recorder is not None else [])
+
+
+def _finish_part_worker(part_path, output_part_path, cumulative_emissions, cumulative_savings_incl_ev, years, hours, \
+                        reference, settings, record_stages):
+
+    recorder = StageRecorder() if record_stages else None
+    scenario = os.path.basename(output_part_path)
+
+    df = pd.read_pickle(part_path)
+    os.remove(part_path)
+
+    with recorded_stage(recorder, 'aggregation', scenario, len(df)):
+        df['CUMULATIVE_EMISSIONS'] = cumulative_emissions
+        df['CUMULATIVE_EMISSION_SAVINGS'] = emission_savings(df['Year'].values, df['ANNUAL_EMISSIONS'].values, cumulative_emissions,
+                                                             df['annual-CO2-emission-reductions-from-gasoline-displacement'].values,
+                                                             reference, years)[1]
+        df['CUMULATIVE_EMISSION_SAVINGS_INCL_EV'] = cumulative_savings_incl_ev
+
+    with recorded_stage(recorder, 'export', scenario, len(df)):
+        write_emission_results(df, output_part_path, hours, settings['output_mode'])
+
+    return recorder.records if recorder is not None else []
+
+
+def join_emission_parts(part_paths, output_path, hours, output_mode='csv'):
+    """Join the results written in parts (in the order of the rows) into one output file; the parts are removed."""
+
+    if output_mode == 'csv':
+
+        with open(output_path, 'wb') as output:
+            for i, part_path in enumerate(part_paths):
+                with open(part_path, 'rb') as f:
+
+                    # Header of the first part only
+                    if i > 0:
+                        f.readline()
+
+                    shutil.copyfileobj(f, output)
+
+    else:
+        write_emission_results(pd.concat([read_emission_results(p) for p in part_paths], ignore_index=True), output_path,
+                               hours, output_mode)
+
+    for part_path in part_paths:
+        os.remove(part_path)
+
+
+def process_scenarios_parallel(scenarios, bundle, years, hours, reference, settings=None, processes=None, \
+                               cache=None, bundle_id=None, recorder=None, parts=None):
+    """Process a list of (input_path, output_path) scenarios in a process pool. Returns the output paths.
+
+    Every scenario is split into 'parts' row ranges (by default, enough for twice as many tasks as workers).
+    On Linux, the workers are forked. Elsewhere they are spawned, which re-imports the calling script,
+    so the call has to be protected by "if __name__ == '__main__':".
+    With a 'recorder', the stages of all workers are added to it.
+    """
+
+    settings = dict(default_settings, **(settings or {}))
+
+    if processes is None:
+        processes = os.cpu_count()
+
+    # Cached scenarios are copied from the cache (see 'process_scenario')
+    keys = {}
+    pending = []
+
+    for input_path, output_path in scenarios:
+
+        if cache is not None:
+            keys[output_path] = scenario_cache_key(cache, input_path, bundle_id, years, hours, reference, settings)
+            entry = cache.get(keys[output_path])
+
+            if entry is not None:
+                try:
+                    print("CACHED: " + os.path.basename(input_path))
+                    shutil.copyfile(cache.result_path(entry, output_path), output_path)
+                    continue
+
+                # The entry may have been evicted in the meantime
+                except OSError:
+                    pass
+
+        pending.append((input_path, output_path))
+
+    if len(pending) == 0:
+        return [output_path for _, output_path in scenarios]
+
+    if parts is None:
+        parts = -(-2 * processes // len(pending))
+
+    if settings['time_resolution'] == 'full_year':
+        parts = 1
+
+    processes = max(1, min(processes, len(pending) * parts))
+
+    blocks, description = share_merit_order_bundle(bundle)
+    folders = []
+
+    def add_records(records):
+        if recorder is not None:
+            recorder.extend(records)
+
+    try:
+        with _merit_order_pool(description, processes) as pool:
+
+            if settings['time_resolution'] == 'full_year':
+
+                for future in [pool.submit(_process_scenario_worker, input_path, output_path, years, hours, reference,
+                                           settings, cache, bundle_id, recorder is not None) \
+                               for input_path, output_path in pending]:
+                    add_records(future.result()[1])
+
+                return [output_path for _, output_path in scenarios]
+
+            # 1. Read, dispatch, and aggregate every part
+            tasks = []
+
+            for input_path, output_path in pending:
+
+                print("SCENARIO: " + os.path.basename(input_path))
+
+                folder = tempfile.mkdtemp(prefix='emission_parts_', dir=os.path.dirname(os.path.abspath(output_path)))
+                folders.append(folder)
+
+                for k, rows in enumerate(_scenario_part_rows(count_netlogo_rows(input_path), parts)):
+                    part_path = os.path.join(folder, 'part_' + str(k) + '.pkl')
+
+                    tasks.append((output_path, folder, k, part_path,
+                                  pool.submit(_dispatch_part_worker, input_path, part_path, rows, years, hours, reference,
+                                              settings, recorder is not None)))
+
+            part_values = {}
+
+            for output_path, folder, k, part_path, future in tasks:
+                values, records = future.result()
+
+                part_values.setdefault(output_path, []).append(values)
+                add_records(records)
+
+            # 2. Cumulative sums over the years of every run, for the whole scenario
+            finishing = []
+
+            for output_path, folder, k, part_path, _ in tasks:
+
+                if k == 0:
+                    values = pd.concat(part_values[output_path], ignore_index=True)
+
+                    cumulative_emissions = cumulative_by_run(values, values['ANNUAL_EMISSIONS'].values, years)
+                    cumulative_savings_incl_ev = cumulative_by_run(values, values['ANNUAL_EMISSION_SAVINGS_INCL_EV'].values, years)
+
+                    part_starts = np.cumsum([0] + [len(v) for v in part_values[output_path]])
+
+                rows = slice(part_starts[k], part_starts[k + 1])
+                output_part_path = os.path.join(folder, 'part_' + str(k) + os.path.splitext(output_path)[1])
+
+                finishing.append((output_path, output_part_path,
+                                  pool.submit(_finish_part_worker, part_path, output_part_path, cumulative_emissions[rows],
+                                              cumulative_savings_incl_ev[rows], years, hours, reference, settings,
+                                              recorder is not None)))
+
+            output_parts = {}
+
+            for output_path, output_part_path, future in finishing:
+                add_records(future.result())
+
+                output_parts.setdefault(output_path, []).append(output_part_path)
+
+        # 3. Join the parts into the output files
+        for input_path, output_path in pending:
+            join_emission_parts(output_parts[output_path], output_path, hours, settings['output_mode'])
+
+            if cache is not None:
+                cache.put(keys[output_path], output_path, reference)
+
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+        for folder in folders:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return [output_path for _, output_path in scenarios]
+
+
+def _stream_scenario_worker(input_paths, years, hours, reference, settings, record_stages):
+
+    recorder = StageRecorder() if record_stages else None
+    statistics = None
+
+    for input_path in input_paths:
+
+        print("SCENARIO: " + os.path.basename(input_path))
+
+        part, _ = stream_scenario_statistics(input_path, _worker_lookup, years, hours, reference, settings, recorder)
+        statistics = part if statistics is None else statistics.merge(part)
+
+    # Only the statistics (a few arrays and sketches per column and year) go back to the main process
+    return statistics, (recorder.records if recorder is not None else [])
+
+
+def stream_scenarios_parallel(scenarios, bundle, years, hours, reference, settings=None, processes=None, recorder=None):
+    """Stream the statistics of a list of scenarios in a process pool. Returns one 'YearlyStatistics' per scenario.
+
+    A scenario is one NetLogo file or a list of files (e.g., runs split over several files), whose partial
+    statistics are merged. The run numbers of different files of one scenario must not overlap.
+    The reference average is needed, as every file is streamed on its own (see 'stream_scenario_statistics').
+    """
+
+    if reference is None:
+        raise ValueError("Streaming scenarios in parallel needs the reference average")
+
+    if processes is None:
+        processes = os.cpu_count()
+
+    # Every file is one task; the partial statistics of a scenario are merged in the main process
+    tasks = [(i, [path]) for i, paths in enumerate(scenarios) for path in ([paths] if isinstance(paths, str) else paths)]
+
+    processes = max(1, min(processes, len(tasks)))
+
+    blocks, description = share_merit_order_bundle(bundle)
+
+    try:
+        with _merit_order_pool(description, processes) as pool:
+
+            futures = [(i, pool.submit(_stream_scenario_worker, paths, years, hours, reference, settings, recorder is not None)) \
+                       for i, paths in tasks]
+
+            statistics = [None] * len(scenarios)
+
+            for i, future in futures:
+                part, records = future.result()
+
+                statistics[i] = part if statistics[i] is None else statistics[i].merge(part)
+
+                if recorder is not None:
+                    recorder.extend(records)
+
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return statistics
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Local query service for the emissions of 24-hour load profiles.
+
+Usage:
+    python Emission_Query_Service.py [--powerplants-path "../../06_CA Power Plants/"] [--port 8765]
+
+The service preloads the merit order prefix sums of all years (see 'Merit_Order_Dispatch.py') and answers
+queries on localhost, so that notebooks and the agent model do not need to run 'Calculate_Carbon_Emissions.py'.
+
+    POST /emissions  {"year": 2020, "profile": [24 loads in MW], "dispatch_mode": "whole"}
+                     {"years": [2020, 2021], "profiles": [[24 loads], [24 loads]]}
+    GET  /health
+
+Answers hold the hourly emissions [tCO2/h] of the profile(s) and the daily and annual (365 days) emissions.
+"""
+
+import sys
+import json
+import argparse
+import threading
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from Merit_Order_Dispatch import load_merit_order, lookup_from_bundle, dispatch_emissions, dispatch_modes
+
+#%%
+
+######################################################################################################
+########################           Emissions of load profiles               ##########################
+######################################################################################################
+
+hours = list(range(0,24))
+
+
+def profile_emissions(lookup, years, profiles, dispatch_mode='whole'):
+    """Return hourly emissions (profiles x 24) of 24-hour load profiles, each in its own year."""
+
+    years = np.asarray(years)
+    profiles = np.asarray(profiles, dtype=float)
+
+    if profiles.ndim != 2 or profiles.shape[1] != len(hours):
+        raise ValueError("Load profiles need " + str(len(hours)) + " hourly values")
+
+    if years.ndim != 1 or len(years) != len(profiles):
+        raise ValueError("One year per load profile needed: " + str(years.size) + " years for " +
+                         str(len(profiles)) + " profiles")
+
+    if dispatch_mode not in dispatch_modes:
+        raise ValueError("Unknown dispatch mode: " + str(dispatch_mode))
+
+    hourly_emissions = np.full(profiles.shape, np.nan)
+
+    # All profiles of one year are dispatched together, hour by hour
+    for y in np.unique(years):
+
+        rows = np.flatnonzero(years == y)
+
+        for x in hours:
+
+            if (int(y), x) not in lookup:
+                raise ValueError("No merit order for year " + str(y))
+
+            capacity_cum, emissions_cum = lookup[(int(y), x)]
+            hourly_emissions[rows, x] = dispatch_emissions(capacity_cum, emissions_cum, profiles[rows, x], dispatch_mode)
+
+    return hourly_emissions
+
+
+def answer_query(lookup, query):
+    """Return the answer (dictionary) to a single ('year', 'profile') or batched ('years', 'profiles') query."""
+
+    if not isinstance(query, dict):
+        raise ValueError("Query needs to be a JSON object")
+
+    dispatch_mode = query.get('dispatch_mode', 'whole')
+
+    if 'profile' in query:
+        hourly_emissions = profile_emissions(lookup, [query['year']], [query['profile']], dispatch_mode)[0]
+
+        return {'hourly_emissions': hourly_emissions.tolist(),
+                'daily_emissions': float(hourly_emissions.sum()),
+                'annual_emissions': float(hourly_emissions.sum() * 365)}
+
+    profiles = query['profiles']
+    years = query['years'] if isinstance(query['years'], list) else [query['years']] * len(profiles)
+
+    hourly_emissions = profile_emissions(lookup, years, profiles, dispatch_mode)
+    daily_emissions = hourly_emissions.sum(axis=1)
+
+    return {'hourly_emissions': hourly_emissions.tolist(),
+            'daily_emissions': daily_emissions.tolist(),
+            'annual_emissions': (daily_emissions * 365).tolist()}
+
+#%%
+
+######################################################################################################
+########################           HTTP service                             ##########################
+######################################################################################################
+
+# Connections are kept alive (HTTP/1.1) and Nagle's algorithm is off, so that one query costs a round trip on
+# localhost plus the dispatch (a binary search per hour), well below a millisecond.
+
+class EmissionQueryHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _send(self, status, answer):
+
+        body = json.dumps(answer).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+
+        if self.path != '/health':
+            self._send(404, {'error': "Unknown path: " + self.path})
+            return
+
+        self._send(200, {'status': 'ok', 'years': self.server.years})
+
+    def do_POST(self):
+
+        if self.path != '/emissions':
+            self._send(404, {'error': "Unknown path: " + self.path})
+            return
+
+        try:
+            query = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            self._send(200, answer_query(self.server.lookup, query))
+
+        except (ValueError, KeyError, TypeError) as error:
+            self._send(400, {'error': str(error)})
+
+    def log_message(self, format, *args):
+        # No log line per query
+        pass
+
+
+def create_server(lookup, host='127.0.0.1', port=8765):
+    """Return the (not yet started) query server for a merit order lookup. Port 0 picks a free port."""
+
+    server = ThreadingHTTPServer((host, port), EmissionQueryHandler)
+    server.daemon_threads = True
+    server.lookup = lookup
+    server.years = sorted(set(y for y, _ in lookup))
+
+    return server
+
+
+def serve_in_background(lookup, host='127.0.0.1', port=0):
+    """Start a query server in a background thread (e.g., for a notebook). Returns the server; stop it with 'shutdown()'."""
+
+    server = create_server(lookup, host, port)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+#%%
+
+######################################################################################################
+########################           Client                                   ##########################
+######################################################################################################
+
+class EmissionQueryClient:
+    """Client of the query service, with one kept-alive connection."""
+
+    def __init__(self, host='127.0.0.1', port=8765, timeout=10):
+
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _request(self, method, path, query=None):
+
+        body = json.dumps(query) if query is not None else None
+        headers = {'Content-Type': 'application/json'} if query is not None else {}
+
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        answer = json.loads(response.read())
+
+        if response.status != 200:
+            raise ValueError(answer.get('error', "Query failed: " + str(response.status)))
+
+        return answer
+
+    def health(self):
+
+        return self._request('GET', '/health')
+
+    def emissions(self, year, profile, dispatch_mode='whole'):
+        """Return the answer for one 24-hour load profile in 'year'."""
+
+        return self._request('POST', '/emissions', {'year': int(year), 'profile': [float(v) for v in profile],
+                                                    'dispatch_mode': dispatch_mode})
+
+    def emissions_batch(self, years, profiles, dispatch_mode='whole'):
+        """Return the answer for several load profiles ('years' is one year or one year per profile)."""
+
+        years = [int(y) for y in years] if np.ndim(years) > 0 else int(years)
+
+        return self._request('POST', '/emissions', {'years': years, 'profiles': np.asarray(profiles, dtype=float).tolist(),
+                                                    'dispatch_mode': dispatch_mode})
+
+    def close(self):
+
+        self.connection.close()
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Serve emissions of 24-hour load profiles on localhost.")
+    parser.add_argument('--powerplants-path', default="../../06_CA Power Plants/", help="folder with the merit order lookup")
+    parser.add_argument('--years', type=int, nargs=2, default=[2005, 2030], help="first and last year")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+
+    args = parser.parse_args(argv)
+
+    years = list(range(args.years[0], args.years[1] + 1))
+    lookup = lookup_from_bundle(load_merit_order(args.powerplants_path, years, hours))
+
+    server = create_server(lookup, args.host, args.port)
+
+    print("SERVING: http://" + args.host + ":" + str(server.server_address[1]) + "/emissions")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
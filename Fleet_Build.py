@@ -0,0 +1,563 @@
+# -*- coding: utf-8 -*-
+"""
+Stages of the build of the California power plant fleet, with checkpoints on disk.
+
+Helper functions used by 'Power_Plants_in_CA.py'.
+"""
+
+import os
+import copy
+import json
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from Result_Cache import file_fingerprint, cache_key
+from Stage_Instrumentation import recorded_stage
+from Merit_Order_Dispatch import build_merit_order_bundle, save_merit_order_bundle, full_year_availability, \
+                                 build_full_year_bundle, merit_order_lookup_from_bundle
+from Emission_Curves import emission_curves_from_lookup
+from Hourly_Signals import hourly_signal_table, reference_load_levels
+from Monte_Carlo_Emissions import emitting_parameter_spreads, non_emitting_parameter_spreads
+from Plant_Name_Matching import match_plant_names
+from Fleet_Panel import clean_emitting_tables, emitting_panel, panel_values, panel_from_wide, panel_to_wide, \
+                        select_types, fill_missing_from_year, carry_year_forward, type_year_means, assign_by_type, \
+                        average_day_frames, new_solar_capacity, synthetic_solar_plants
+
+#%%
+
+######################################################################################################
+########################           Staged build                             ##########################
+######################################################################################################
+
+# The fleet is built in named stages (PSE ingest, CEC ingest, solar uptake, nuclear phase-out, matching, ...). The result
+# of every stage is saved as checkpoint, named by a key of (i) the stage and its function, (ii) the content of the input
+# files it reads, (iii) its parameters, and (iv) the keys of the stages it uses. A changed input file or parameter thus
+# changes the key of its stage and of all stages downstream, while the stages upstream are loaded from their checkpoints.
+# Raise 'build_version' whenever a stage function changes, so that old checkpoints are not used anymore.
+# Stages get copies of the results they use, thus a stage (or a plot cell) cannot change the result of another stage.
+
+build_version = 5
+
+
+def _result_rows(result):
+
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+
+    if isinstance(result, dict) and 'PLANTS' in result:
+        return len(result['PLANTS'])
+
+    return None
+
+
+class StagedBuild:
+
+    def __init__(self, path, recorder=None, keep=3):
+
+        self.path = path
+        self.recorder = recorder
+        self.keep = keep
+
+        # Key and result of every stage of this build
+        self.keys = {}
+        self.results = {}
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def stage_key(self, stage, function, upstream=(), files=(), parameters=None):
+        """Return the key of a stage: function, fingerprints of the input files, parameters, and keys upstream."""
+
+        parameters = {} if parameters is None else parameters
+
+        return cache_key(build_version, stage, function.__module__ + '.' + function.__name__,
+                         [self.keys[u] for u in upstream],
+                         [file_fingerprint(f) for f in files],
+                         json.dumps(parameters, sort_keys=True, default=str))
+
+    def checkpoint_path(self, stage, key):
+
+        return os.path.join(self.path, stage, key + '.pkl')
+
+    def load(self, stage, key):
+        """Return the checkpoint of 'stage' with 'key' (and mark it as recently used), or None."""
+
+        path = self.checkpoint_path(stage, key)
+
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+
+        os.utime(path)
+
+        return result
+
+    def save(self, stage, key, result):
+        """Save the checkpoint of 'stage' with 'key' and keep only the 'keep' most recently used ones of the stage."""
+
+        path = self.checkpoint_path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Checkpoints appear complete or not at all
+        temporary_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+
+        checkpoints = []
+
+        for name in os.listdir(os.path.dirname(path)):
+            if name.endswith('.pkl'):
+                checkpoint = os.path.join(os.path.dirname(path), name)
+                checkpoints.append((os.path.getmtime(checkpoint), checkpoint))
+
+        for _, checkpoint in sorted(checkpoints, reverse=True)[self.keep:]:
+            if checkpoint != path:
+                os.remove(checkpoint)
+
+    def run(self, stage, function, upstream=(), files=(), parameters=None, outputs=False):
+        """Return the result of 'function(*results of upstream, **parameters)', from its checkpoint if it is up to date.
+
+        'files' are the input files the stage reads. With 'outputs=True', the stage writes files and returns their paths;
+        its checkpoint is then only used if all these files still exist.
+        """
+
+        parameters = {} if parameters is None else parameters
+        key = self.stage_key(stage, function, upstream, files, parameters)
+
+        # Same key as in the last run of this stage in this session
+        if self.keys.get(stage) == key and stage in self.results:
+            return self.results[stage]
+
+        result = None
+
+        if os.path.isfile(self.checkpoint_path(stage, key)):
+
+            with recorded_stage(self.recorder, stage + ' (checkpoint)') as record:
+                result = self.load(stage, key)
+                record['rows'] = _result_rows(result)
+
+        if result is not None and outputs and not all(os.path.exists(p) for p in result):
+            result = None
+
+        if result is not None:
+            print("CHECKPOINT: " + stage)
+
+        else:
+            print("STAGE: " + stage)
+
+            with recorded_stage(self.recorder, stage) as record:
+                result = function(*[copy.deepcopy(self.results[u]) for u in upstream], **parameters)
+                record['rows'] = _result_rows(result)
+
+            self.save(stage, key, result)
+
+        self.keys[stage] = key
+        self.results[stage] = result
+
+        return result
+
+    def clear(self):
+        """Remove all checkpoints."""
+
+        for stage in os.listdir(self.path):
+            for name in os.listdir(os.path.join(self.path, stage)):
+                os.remove(os.path.join(self.path, stage, name))
+
+        self.keys = {}
+        self.results = {}
+
+#%%
+
+######################################################################################################
+########################           PSE data: emitting powerplants           ##########################
+######################################################################################################
+
+# The PSE dataset lists the emitting powerplants 2010-2017 ('powerplants_ca_emitting_<year>.csv', read with
+# 'read_emitting_tables' in 'Fleet_Panel.py'). Types of emitting powerplants are grouped as in the CEC dataset.
+
+emitting_type_wording = {'Combined cycle': 'Combined_cycle',
+                         'Once-through cooling': 'Once_through_cooling',
+                         'Other': 'Once_through_cooling'}
+
+
+def process_emitting(tables, years, plant_types, max_emissions=2):
+    """Return 'powerplants_ca_emitting' (with year-suffixed columns) and the parameter spreads of the emitting powerplants.
+
+    Replaces the wording of the types, deletes outliers (emissions above 'max_emissions' [tCO2/MWh]), and replaces missing
+    values with the mean over the years of the annual means of each type.
+    """
+
+    panel = emitting_panel(clean_emitting_tables(tables), years)
+
+    panel['PLANTS']['PLANT_TYPE'] = panel['PLANTS']['PLANT_TYPE'].replace(emitting_type_wording)
+
+    panel['EMISSIONS'] = np.minimum(panel['EMISSIONS'], max_emissions)
+
+    # Spread of capacity factors and emission values within each plant type, before missing values are filled with means.
+    # 'Calculate_Carbon_Emissions.py' samples from these spreads in its Monte Carlo mode (see 'Monte_Carlo_Emissions.py')
+    parameter_spreads_emitting = emitting_parameter_spreads(panel_to_wide(panel), years)
+
+    means = pd.DataFrame(dict((v, type_year_means(panel, v, plant_types).mean(axis=1, skipna=False)) for v in panel_values))
+
+    for v in panel_values:
+        assign_by_type(panel, v, means[v])
+
+    return {'powerplants_ca_emitting': panel_to_wide(select_types(panel, plant_types)),
+            'parameter_spreads_emitting': parameter_spreads_emitting}
+
+#%%
+
+######################################################################################################
+########################           CEC data: all powerplants                ##########################
+######################################################################################################
+
+# The CEC dataset lists all powerplants operational in 2016 with type, capacity, and initial start date. It is extended
+# by the solar uptake (synthetic solar powerplants), the capacity of every year, and the nuclear phase-out.
+
+cec_columns = {'Plant Name': 'PLANT_NAME',
+               'General Fuel': 'PLANT_TYPE',
+               'MW': 'CAPACITY_[MW]',
+               'Initial Start Date': 'INITIAL_START_DATE'}
+
+cec_type_wording = {'Landfill Gas': 'Biomass',
+                    'MSW': 'Biomass',
+                    'Digester Gas': 'Gas_undefined',
+                    'Other': 'Gas_undefined'}
+
+
+def ingest_cec(file_name, years):
+    """Return the CEC powerplants with fewer types and empty capacity columns for 'years'."""
+
+    powerplants_ca = pd.read_csv(file_name, sep=';', encoding='unicode_escape')
+
+    powerplants_ca = powerplants_ca[list(cec_columns)].replace(cec_type_wording)
+
+    powerplants_ca = powerplants_ca.rename(columns=cec_columns).set_index('PLANT_NAME')
+
+    return powerplants_ca.reindex(columns=powerplants_ca.columns.tolist() + ['CAPACITY_[MW]_' + str(x) for x in years])
+
+
+def add_solar_uptake(powerplants_ca, file_name, years, size_distribution='average', unit_size=None, size_cv=1.0, seed=0):
+    """Return 'powerplants_ca' with synthetic solar powerplants for the solar capacity installations of 'years'.
+
+    2015 is the first year the CEC data is not comprehensive, thus its new capacity is the difference to the solar capacity
+    in 'powerplants_ca'. Without 'unit_size', the new powerplants have the average existing PV size on average.
+    """
+
+    installations = pd.read_csv(file_name, sep=';', encoding='unicode_escape').set_index('Unnamed: 0').rename_axis('')
+
+    existing_solar = powerplants_ca.loc[powerplants_ca['PLANT_TYPE'] == 'Solar', 'CAPACITY_[MW]']
+
+    new_capacity = new_solar_capacity(installations.loc['Solar Capacity', [str(x) for x in years]], existing_solar.sum(), years)
+
+    if unit_size is None:
+        unit_size = existing_solar.mean()
+
+    solar_plants = synthetic_solar_plants(new_capacity, unit_size, size_distribution, size_cv, sizes=existing_solar.values,
+                                          seed=seed)
+
+    # Columns sorted like 'DataFrame.append' did
+    return pd.concat([powerplants_ca, solar_plants], sort=True)
+
+
+def build_capacity(powerplants_ca, years):
+    """Return 'powerplants_ca' with the capacity of every year for the powerplants built before (all years at once)."""
+
+    powerplants_ca = powerplants_ca.copy()
+
+    powerplants_active = pd.to_numeric(powerplants_ca['INITIAL_START_DATE'], errors='coerce').values[:, None] <= \
+                                np.array(years)[None, :]
+
+    capacity_columns = ['CAPACITY_[MW]_' + str(x) for x in years]
+
+    powerplants_ca[capacity_columns] = np.where(powerplants_active,
+                                pd.to_numeric(powerplants_ca['CAPACITY_[MW]'], errors='coerce').values[:, None],
+                                powerplants_ca[capacity_columns].values.astype(float))
+
+    return powerplants_ca
+
+
+def phase_out_nuclear(powerplants_ca, years, diablo_canyon_phaseout=2026, san_onofre_phaseout=2012,
+                      san_onofre_capacity=2063):
+    """Return 'powerplants_ca' with the nuclear phase-out.
+
+    Diablo Canyon has no capacity from 'diablo_canyon_phaseout' on. San Onofre (not in the CEC data, which only lists
+    operational powerplants) is added with 'san_onofre_capacity' [MW] before 'san_onofre_phaseout'.
+    """
+
+    powerplants_ca = powerplants_ca.copy()
+
+    for x in years:
+        if x >= diablo_canyon_phaseout:
+            powerplants_ca.loc['Diablo Canyon', 'CAPACITY_[MW]_' + str(x)] = 0
+
+    # Create new power plant with index = name
+    powerplants_ca = pd.concat([powerplants_ca, pd.DataFrame(index=pd.Index(['San Onofre'], name=powerplants_ca.index.name))])
+
+    # Fill Capacity, Type, and initial start year
+    powerplants_ca.loc['San Onofre', 'CAPACITY_[MW]'] = san_onofre_capacity
+    powerplants_ca.loc['San Onofre', 'PLANT_TYPE'] = 'Nuclear'
+    powerplants_ca.loc['San Onofre', 'INITIAL_START_DATE'] = 1900
+
+    for x in years:
+
+        if x < san_onofre_phaseout:
+            powerplants_ca.loc['San Onofre', 'CAPACITY_[MW]_' + str(x)] = san_onofre_capacity
+
+        else:
+            powerplants_ca.loc['San Onofre', 'CAPACITY_[MW]_' + str(x)] = 0
+
+    return powerplants_ca
+
+#%%
+
+######################################################################################################
+########################           Matching and filling                     ##########################
+######################################################################################################
+
+# CEC types of powerplants that can be in the PSE data; only these are matched by similar names, all others only
+# by identical names
+cec_emitting_types = ['Gas', 'Biogas', 'Biomass', 'Coal', 'Gas_undefined']
+
+
+def allocate_by_capacity(capacity, capacity_needed):
+    """Return the type allocated to every powerplant (missing if none), in the order of 'capacity'.
+
+    The types are filled one after another, in the order of 'capacity_needed': every type takes the next powerplants
+    not yet allocated until its own capacity needed is covered (the last one may exceed it; the excess does not count
+    for the next type). Types with no capacity needed get no powerplants. If the powerplants run out, the remaining
+    types get less (or nothing); powerplants left over get no type.
+    """
+
+    capacity = pd.to_numeric(pd.Series(capacity), errors='coerce').fillna(0).clip(lower=0)
+    capacity_needed = capacity_needed.fillna(0)
+
+    capacity_cum = np.cumsum(capacity.values)
+    types = np.full(len(capacity), None, dtype=object)
+
+    # Index of the next powerplant not yet allocated
+    start = 0
+
+    for t, needed in capacity_needed.items():
+
+        if needed <= 0:
+            continue
+
+        if start >= len(capacity_cum):
+            break
+
+        capacity_before = capacity_cum[start - 1] if start > 0 else 0.0
+
+        # Last powerplant of the type: the first one at which the cumulated capacity covers the capacity needed
+        end = np.searchsorted(capacity_cum, capacity_before + needed, side='left') + 1
+
+        types[start:end] = t
+        start = end
+
+    return pd.Series(types, index=capacity.index)
+
+
+def match_emitting(powerplants_ca, emitting, years, plant_types, match_types=cec_emitting_types, min_score=0.7,
+                   capacity_weight=0.2):
+    """Return 'powerplants_ca' with the capacity factors, emissions, and detailed types of the emitting powerplants,
+    the name matches, and the matching rates.
+
+    Powerplants are matched by identical or similar names and capacity (see 'match_plant_names' in
+    'Plant_Name_Matching.py'); 'MATCHED_NAME' and 'MATCH_CONFIDENCE' are kept as columns. Unmatched gas powerplants
+    are assigned to the types with unmatched capacity, the remaining ones become 'Gas_undefined'.
+    """
+
+    powerplants_ca_emitting = emitting['powerplants_ca_emitting']
+
+    # 1. Add columns for 2005 - 2030
+    add_columns = ['PLANT_TYPE_DETAILED'] + ['CAPACITY_FACTOR_' + str(x) for x in years] + \
+                  ['EMISSIONS_[tCO2/MWh]_' + str(x) for x in years]
+
+    powerplants_ca_emitting_2015_2030 = powerplants_ca_emitting.rename(columns={"PLANT_TYPE": "PLANT_TYPE_DETAILED"})
+    powerplants_ca_emitting_2015_2030 = powerplants_ca_emitting_2015_2030.reindex(columns=add_columns)
+
+    # 2. Matching
+    name_matches = match_plant_names(powerplants_ca.index, powerplants_ca['CAPACITY_[MW]'], powerplants_ca_emitting.index,
+                                     powerplants_ca_emitting['CAPACITY_[MW]_2010'],
+                                     candidate_rows=powerplants_ca['PLANT_TYPE'].isin(match_types).values,
+                                     min_score=min_score, capacity_weight=capacity_weight)
+    name_matches.index = powerplants_ca.index
+
+    powerplants_ca['MATCHED_NAME'] = name_matches['MATCHED_NAME'].values
+    powerplants_ca['MATCH_CONFIDENCE'] = name_matches['CONFIDENCE'].values
+
+    powerplants_ca = powerplants_ca.join(powerplants_ca_emitting_2015_2030, on='MATCHED_NAME')
+
+    # 3. Matching rate
+    index_gas = powerplants_ca.loc[powerplants_ca['PLANT_TYPE'] == 'Gas'].index
+    index_match = powerplants_ca.loc[powerplants_ca['PLANT_TYPE_DETAILED'].isnull() == False].index
+
+    matching_rates = {'capacity_gas': powerplants_ca.loc[index_gas, 'CAPACITY_[MW]'].sum(),
+                      'number_gas': powerplants_ca.loc[index_gas, 'CAPACITY_[MW]'].count(),
+                      'number_gas_emitting': len(powerplants_ca_emitting_2015_2030['PLANT_TYPE_DETAILED']),
+                      'capacity_match': powerplants_ca.loc[index_match, 'CAPACITY_[MW]'].sum(),
+                      'number_match': powerplants_ca.loc[index_match, 'CAPACITY_[MW]'].count(),
+                      'number_match_similar': int((name_matches['METHOD'] == 'similar').sum()),
+                      'confidence_similar': name_matches.loc[name_matches['METHOD'] == 'similar', 'CONFIDENCE'].mean()}
+
+    # 4. Adding powerplant type details to 'PLANT_TYPE'
+    powerplants_ca_gas = powerplants_ca.loc[((powerplants_ca.loc[:, 'PLANT_TYPE'] == 'Gas') |
+                                             (powerplants_ca.loc[:, 'PLANT_TYPE'] == 'Biogas')) &
+                                            (powerplants_ca.loc[:, 'PLANT_TYPE_DETAILED'].isnull() == False)].index
+
+    powerplants_ca.loc[powerplants_ca_gas, 'PLANT_TYPE'] = powerplants_ca.loc[powerplants_ca_gas, 'PLANT_TYPE_DETAILED']
+
+    # 5a. Calculate capacity difference for all plant_types
+    capacity_unmatched = {}
+
+    for y in plant_types:
+
+        capacity_matched = powerplants_ca[powerplants_ca.loc[:, 'PLANT_TYPE'] == y]['CAPACITY_[MW]'].sum()
+
+        capacity_total = powerplants_ca_emitting[powerplants_ca_emitting.loc[:, 'PLANT_TYPE'] == y]['CAPACITY_[MW]_2010'].sum()
+
+        capacity_unmatched[y] = max(0, capacity_total - capacity_matched)
+
+    # 5b. Assign unmatched gas powerplants to types according the unmatched capacity (in the order of the powerplants)
+    unmatched = (powerplants_ca['PLANT_TYPE'] == 'Gas').values
+    capacity_unmatched = pd.Series(capacity_unmatched)
+
+    allocated_types = allocate_by_capacity(powerplants_ca.loc[unmatched, 'CAPACITY_[MW]'], capacity_unmatched)
+
+    powerplants_ca.loc[unmatched, 'PLANT_TYPE'] = allocated_types.fillna('Gas').values
+
+    # Capacity that could not be allocated, because the unmatched gas powerplants ran out
+    capacity_allocated = powerplants_ca.loc[unmatched, 'CAPACITY_[MW]'].groupby(allocated_types.values).sum()
+    matching_rates['capacity_unallocated'] = (capacity_unmatched -
+                                              capacity_allocated.reindex(capacity_unmatched.index, fill_value=0)).clip(lower=0)
+
+    # 5c. Replace all remaining unmatched gas powerplants to gas_undefined
+    powerplants_ca = powerplants_ca.replace('Gas', 'Gas_undefined')
+
+    return {'powerplants_ca': powerplants_ca, 'name_matches': name_matches, 'matching_rates': matching_rates}
+
+
+def fill_emitting_gaps(matching, years, plant_types, first_year=2010, last_year=2016, biogas_capacity_factor=0.51333):
+    """Return the fleet panel with capacity factors and emission values for all emitting powerplants.
+
+    Years before 'first_year' get the values of 'first_year', years after 'last_year' the values of 'last_year'. Remaining
+    missing values are the annual means of the type. 'Biogas' is emitting, but has no matched powerplants; its capacity
+    factor is based on the 2010 PSE data.
+    """
+
+    panel = panel_from_wide(matching['powerplants_ca'], years)
+
+    fill_missing_from_year(panel, ['CAPACITY_FACTOR', 'EMISSIONS'], first_year, [y for y in years if y < first_year])
+
+    carry_year_forward(panel, ['CAPACITY_FACTOR', 'EMISSIONS'], last_year, [y for y in years if y > last_year])
+
+    mean_capacity_factor = type_year_means(panel, 'CAPACITY_FACTOR', plant_types)
+    mean_emissions = type_year_means(panel, 'EMISSIONS', plant_types)
+
+    mean_capacity_factor.loc['Biogas'] = biogas_capacity_factor
+    mean_emissions.loc['Biogas'] = 0
+
+    assign_by_type(panel, 'CAPACITY_FACTOR', mean_capacity_factor)
+    assign_by_type(panel, 'EMISSIONS', mean_emissions)
+
+    return panel
+
+
+def add_non_emitting(panel, emitting, file_name, years, plant_types, years_data=range(2013, 2020)):
+    """Return the fleet panel with the EIA capacity factors by type (and no emissions) of non-emitting powerplants,
+    the capacity factors by type ('Capacity Factors_2005-2030.csv'), and the parameter spreads of all powerplants.
+    """
+
+    capacity_factors = pd.read_csv(file_name, sep=';', encoding='unicode_escape').set_index('PLANT_TYPE')
+
+    ## Capacity factors of the types by year (types x years) and no emissions, for all built powerplants of these types
+    non_emitting_capacity_factors = capacity_factors.loc[plant_types, [str(x) for x in years]].set_axis(years, axis=1)
+
+    assign_by_type(panel, 'CAPACITY_FACTOR', non_emitting_capacity_factors, missing_only=False)
+    assign_by_type(panel, 'EMISSIONS', pd.Series(0.0, index=plant_types), missing_only=False)
+
+    # Spread of the annual EIA capacity factors (2013-2019) of non-emitting powerplants
+    parameter_spreads = pd.concat([emitting['parameter_spreads_emitting'],
+                                   non_emitting_parameter_spreads(capacity_factors, plant_types, years_data)])
+
+    return {'panel': panel, 'capacity_factors': capacity_factors, 'parameter_spreads': parameter_spreads}
+
+#%%
+
+######################################################################################################
+########################           Average day and export                   ##########################
+######################################################################################################
+
+def build_average_day(non_emitting, file_name, years, hours, colors, default_color):
+    """Return the average day table of every year (dictionary year: dataframe) and the PV generation profile.
+
+    The hourly solar capacity factors are based on the annual capacity factor and the PV generation profile
+    ('pv_generation_profile.csv'). 'colors' are the plot colors of the plant types (others: 'default_color').
+    """
+
+    panel = non_emitting['panel']
+
+    hourly_capacity_factor_solar = pd.read_csv(file_name, sep=';', encoding='unicode_escape').set_index('Unnamed: 0').rename_axis('')
+
+    pv_generation_profile = hourly_capacity_factor_solar.loc['PV_GENERATION_PROFILE', [str(x) for x in hours]].values.astype(float)
+
+    solar_capacity_factors = non_emitting['capacity_factors'].loc['Solar', [str(y) for y in years]].values.astype(float)
+
+    panel['PLANTS']['COLORS'] = [tuple(colors.get(x, default_color)) for x in panel['PLANTS']['PLANT_TYPE']]
+
+    return {'plants_by_year': average_day_frames(panel, years, solar_capacity_factors, pv_generation_profile, hours),
+            'pv_generation_profile': pv_generation_profile}
+
+
+def export_fleet(average_day, non_emitting, path_results, hourly_profiles_file, years, hours):
+    """Export the average day tables, the merit order lookups, emission curves, hourly signals, and parameter spreads.
+
+    Returns the paths of the exported files and folders.
+    """
+
+    plants_by_year = average_day['plants_by_year']
+    exported = []
+
+    for y in years:
+
+        # Remove commas and semicolons in index
+        powerplants_average_day = plants_by_year[y].replace(r',', '', regex=True)
+        powerplants_average_day = powerplants_average_day.replace(r';', '', regex=True)
+
+        powerplants_average_day.to_csv(path_results + "powerplants_average_day_" + str(y) + ".csv")
+        exported.append(path_results + "powerplants_average_day_" + str(y) + ".csv")
+
+    # Merit order lookup (see 'Merit_Order_Dispatch.py'), emission curves, and hourly signals
+    merit_order_bundle = build_merit_order_bundle(plants_by_year, years, hours)
+    save_merit_order_bundle(merit_order_bundle, path_results + "merit_order_lookup")
+
+    emission_curves = emission_curves_from_lookup(merit_order_lookup_from_bundle(merit_order_bundle))
+    emission_curves.to_csv(path_results + "emission_curves.csv", index=False)
+
+    hourly_signals = hourly_signal_table(plants_by_year, years, hours, reference_load_levels)
+    hourly_signals.to_csv(path_results + "hourly_signals.csv", index=False)
+
+    # Full-year merit order lookup, with the hour-of-year profiles of 'hourly_profiles_file' if there is one
+    if hourly_profiles_file is not None:
+        hourly_profiles = pd.read_csv(hourly_profiles_file)
+    else:
+        hourly_profiles = None
+
+    availability_by_year = {}
+
+    for y in years:
+        availability_by_year[y] = full_year_availability(non_emitting['capacity_factors'].loc['Solar', str(y)],
+                                                         average_day['pv_generation_profile'], hourly_profiles)
+
+    full_year_bundle = build_full_year_bundle(plants_by_year, years, availability_by_year)
+    save_merit_order_bundle(full_year_bundle, path_results + "merit_order_lookup_8760")
+
+    # Parameter spreads for the Monte Carlo mode
+    non_emitting['parameter_spreads'].to_csv(path_results + "parameter_spreads.csv")
+
+    return exported + [path_results + name for name in ["merit_order_lookup", "emission_curves.csv", "hourly_signals.csv",
+                                                        "merit_order_lookup_8760", "parameter_spreads.csv"]]
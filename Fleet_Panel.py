@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+"""
+Plant x year panel of the California power plant fleet.
+
+Helper functions used by 'Power_Plants_in_CA.py'.
+"""
+
+import numpy as np
+import pandas as pd
+
+from Merit_Order_Dispatch import intermittent_types
+
+#%%
+
+######################################################################################################
+########################           Fleet panel                              ##########################
+######################################################################################################
+
+# A fleet panel stores the yearly values of all powerplants as dense blocks (plants x years) instead of one column
+# or one dataframe per year. Like the merit order bundle, it is a dictionary:
+# - 'YEARS': the years of the columns of the blocks
+# - 'PLANTS': plant metadata (index 'PLANT_NAME'; 'PLANT_TYPE', 'INITIAL_START_DATE', ...), one row per block row
+# - 'CAPACITY', 'CAPACITY_FACTOR', 'EMISSIONS': blocks of capacity [MW], capacity factor, and emissions [tCO2/MWh]
+# Cleaning and filling steps then work on all years at once. The year-suffixed column names ('CAPACITY_[MW]_<year>',
+# ...) are only used at the boundaries: for joining with other dataframes and for the csv files.
+
+panel_values = ['CAPACITY', 'CAPACITY_FACTOR', 'EMISSIONS']
+
+wide_prefixes = {'CAPACITY': 'CAPACITY_[MW]_',
+                 'CAPACITY_FACTOR': 'CAPACITY_FACTOR_',
+                 'EMISSIONS': 'EMISSIONS_[tCO2/MWh]_'}
+
+
+def _year_positions(panel, years):
+
+    positions = pd.Index(panel['YEARS']).get_indexer(list(years))
+
+    if np.any(positions < 0):
+        raise ValueError("Years not in the fleet panel: " + str(list(np.asarray(years)[positions < 0])))
+
+    return positions
+
+
+def panel_from_wide(df, years):
+    """Return the fleet panel of a dataframe with year-suffixed columns; all other columns become plant metadata."""
+
+    wide_columns = [wide_prefixes[v] + str(y) for v in panel_values for y in years]
+
+    panel = {}
+    panel['YEARS'] = np.array(years, dtype=np.int64)
+    panel['PLANTS'] = df[[c for c in df.columns if c not in wide_columns]].copy()
+
+    # Missing columns are missing values
+    for v in panel_values:
+        panel[v] = df.reindex(columns=[wide_prefixes[v] + str(y) for y in years]).values.astype(float)
+
+    return panel
+
+
+def panel_to_wide(panel):
+    """Return the plant metadata with capacity, capacity factor, and emissions of every year as columns (year by year)."""
+
+    years = panel['YEARS']
+
+    values = np.stack([panel[v] for v in panel_values], axis=2).reshape(len(panel['PLANTS']), len(years) * len(panel_values))
+    columns = [wide_prefixes[v] + str(y) for y in years for v in panel_values]
+
+    wide = pd.DataFrame(values, index=panel['PLANTS'].index, columns=columns)
+
+    return pd.concat([panel['PLANTS'], wide], axis=1)
+
+
+def panel_year_frame(panel, year):
+    """Return the plant metadata with the capacity, capacity factor, and emissions of one year."""
+
+    position = _year_positions(panel, [year])[0]
+
+    frame = panel['PLANTS'].copy()
+
+    for v in panel_values:
+        frame[wide_prefixes[v] + str(year)] = panel[v][:, position]
+
+    return frame
+
+
+def panel_active(panel):
+    """Return whether every powerplant has been built in every year (plants x years); all, without start dates."""
+
+    if 'INITIAL_START_DATE' not in panel['PLANTS']:
+        return np.ones((len(panel['PLANTS']), len(panel['YEARS'])), dtype=bool)
+
+    start = pd.to_numeric(panel['PLANTS']['INITIAL_START_DATE'], errors='coerce').values.astype(float)
+
+    return start[:, None] <= panel['YEARS'][None, :]
+
+
+def select_types(panel, types):
+    """Return the panel of the powerplants of 'types', grouped by type in the order of 'types'."""
+
+    plant_type = panel['PLANTS']['PLANT_TYPE'].values
+
+    rows = np.concatenate([np.flatnonzero(plant_type == t) for t in types]).astype(np.int64)
+
+    selected = {'YEARS': panel['YEARS'], 'PLANTS': panel['PLANTS'].iloc[rows].copy()}
+
+    for v in panel_values:
+        selected[v] = panel[v][rows]
+
+    return selected
+
+#%%
+
+######################################################################################################
+########################           Emitting powerplants 2010-2017           ##########################
+######################################################################################################
+
+# The emitting powerplants come as one table per year. We stack them into one long table (one row per plant and
+# year), clean it in one go, and spread it into a panel. Like the former join of the yearly tables on the 2010 table,
+# the panel holds the powerplants of the first year and their type.
+
+emitting_columns = {'Plant name': 'PLANT_NAME',
+                    'Plant type general': 'PLANT_TYPE',
+                    'Min. MW': 'CAPACITY_[MW]',
+                    'Capacity factor': 'CAPACITY_FACTOR',
+                    'AverageCO2EmissionRate': 'EMISSIONS_[tCO2/MWh]'}
+
+
+def read_emitting_tables(file_path, years):
+    """Return the yearly tables 'powerplants_ca_emitting_<year>.csv' as one long table with column 'YEAR'."""
+
+    tables = []
+
+    for y in years:
+        table = pd.read_csv(file_path + "powerplants_ca_emitting_" + str(y) + ".csv", sep=';')
+        table['YEAR'] = y
+        tables.append(table)
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def clean_emitting_tables(tables):
+    """Keep and rename the relevant columns, sort by plant name, and drop duplicate plants within each year."""
+
+    tables = tables.reindex(columns=list(emitting_columns) + ['YEAR']).rename(columns=emitting_columns)
+
+    tables = tables.sort_values(by=['YEAR', 'PLANT_NAME'], kind='mergesort')
+
+    return tables.drop_duplicates(subset=['YEAR', 'PLANT_NAME']).reset_index(drop=True)
+
+
+def emitting_panel(tables, years):
+    """Return the fleet panel of the cleaned long table of emitting powerplants."""
+
+    plants = tables.loc[tables['YEAR'] == years[0], ['PLANT_NAME', 'PLANT_TYPE']].set_index('PLANT_NAME')
+
+    rows = plants.index.get_indexer(tables['PLANT_NAME'].values)
+    columns = pd.Index(years).get_indexer(tables['YEAR'].values)
+    keep = (rows >= 0) & (columns >= 0)
+
+    panel = {}
+    panel['YEARS'] = np.array(years, dtype=np.int64)
+    panel['PLANTS'] = plants
+
+    for v, column in zip(panel_values, ['CAPACITY_[MW]', 'CAPACITY_FACTOR', 'EMISSIONS_[tCO2/MWh]']):
+        block = np.full((len(plants), len(years)), np.nan)
+        block[rows[keep], columns[keep]] = tables[column].values[keep].astype(float)
+        panel[v] = block
+
+    return panel
+
+#%%
+
+######################################################################################################
+########################           Filling missing values                   ##########################
+######################################################################################################
+
+# All fill steps change the blocks of the panel in place (and return the panel). Only powerplants that have been
+# built in a year (start date <= year) get values in that year.
+
+def fill_missing_from_year(panel, values, source_year, target_years):
+    """Fill missing values of built powerplants in 'target_years' with their values in 'source_year'."""
+
+    source = _year_positions(panel, [source_year])[0]
+    targets = _year_positions(panel, target_years)
+
+    active = panel_active(panel)[:, targets]
+
+    for v in values:
+        block = panel[v][:, targets]
+        panel[v][:, targets] = np.where(active & np.isnan(block), panel[v][:, [source]], block)
+
+    return panel
+
+
+def carry_year_forward(panel, values, source_year, target_years):
+    """Set the values of all powerplants in 'target_years' to their values in 'source_year'."""
+
+    source = _year_positions(panel, [source_year])[0]
+    targets = _year_positions(panel, target_years)
+
+    for v in values:
+        panel[v][:, targets] = panel[v][:, [source]]
+
+    return panel
+
+
+def type_year_means(panel, value, types):
+    """Return the mean of 'value' per plant type and year (types x years; NaN for types without values)."""
+
+    plant_type = panel['PLANTS']['PLANT_TYPE'].values
+
+    means = pd.DataFrame(panel[value], columns=panel['YEARS']).groupby(plant_type).mean()
+
+    return means.reindex(list(types))
+
+
+def assign_by_type(panel, value, table, missing_only=True):
+    """Set 'value' of built powerplants to the value of their type in 'table'.
+
+    'table' holds one value per type and year (types x years) or one value per type for all years. With
+    'missing_only', only missing values are set. Powerplants of other types keep their values.
+    """
+
+    years = panel['YEARS']
+
+    if isinstance(table, pd.Series):
+        table = pd.DataFrame(np.repeat(table.values.astype(float)[:, None], len(years), axis=1), index=table.index, columns=years)
+
+    table_values = table.reindex(columns=years).values.astype(float)
+
+    codes = pd.Index(table.index).get_indexer(panel['PLANTS']['PLANT_TYPE'].values)
+
+    mask = panel_active(panel) & (codes >= 0)[:, None]
+
+    if missing_only:
+        mask &= np.isnan(panel[value])
+
+    panel[value] = np.where(mask, table_values[np.maximum(codes, 0)], panel[value])
+
+    return panel
+
+#%%
+
+######################################################################################################
+########################           Average day                              ##########################
+######################################################################################################
+
+# Merit order factor and merit order capacity of the average day (see 'Power_Plants_in_CA.py'):
+# - controllable powerplants: merit order factor 1 - capacity factor, full capacity
+# - intermittent powerplants (hydro, solar thermal, wind): merit order factor 0.05, capacity times capacity factor
+# - solar: merit order factor 0.025, capacity times the hourly solar capacity factor (annual capacity factor
+#   x 24 x PV generation profile)
+# Powerplants of other types get no merit order factor and capacity. Factors and capacities are derived for all
+# powerplants and years at once; each year's table then holds the powerplants built in that year.
+
+controllable_types = ['Cogen', 'Combined_cycle', 'Gas_undefined', 'Peaker', 'Biomass', 'Geothermal', 'Nuclear',
+                      'Coal', 'Biogas', 'Once_through_cooling']
+
+merit_order_intermittent = 0.05
+merit_order_solar = 0.025
+
+
+def average_day_frames(panel, years, solar_capacity_factors, pv_generation_profile, hours):
+    """Return the average day table of every year (dictionary year: dataframe).
+
+    'solar_capacity_factors' holds the annual solar capacity factor of every year in 'years', 'pv_generation_profile'
+    the share of the daily PV generation in every hour of 'hours'.
+    """
+
+    positions = _year_positions(panel, years)
+    plants = panel['PLANTS']
+
+    plant_type = plants['PLANT_TYPE'].values
+    controllable = np.isin(plant_type, controllable_types)
+    intermittent = np.isin(plant_type, intermittent_types)
+    solar = plant_type == 'Solar'
+
+    capacity = panel['CAPACITY'][:, positions]
+    capacity_factor = panel['CAPACITY_FACTOR'][:, positions]
+    emissions = panel['EMISSIONS'][:, positions]
+
+    # Merit order factor and merit order capacity (solar at an hourly capacity factor of 1), plants x years
+    merit_order = np.full(capacity.shape, np.nan)
+    merit_order[intermittent] = merit_order_intermittent
+    merit_order[solar] = merit_order_solar
+    merit_order[controllable] = 1 - capacity_factor[controllable]
+
+    merit_order_capacity = np.full(capacity.shape, np.nan)
+    merit_order_capacity[controllable] = capacity[controllable]
+    merit_order_capacity[intermittent] = capacity_factor[intermittent] * capacity[intermittent]
+    merit_order_capacity[solar] = capacity[solar]
+
+    # Hourly solar capacity factors, years x hours
+    hourly_capacity_factor_solar = np.asarray(solar_capacity_factors, dtype=float)[:, None] * 24 * \
+                                   np.asarray(pv_generation_profile, dtype=float)[None, :]
+
+    active = panel_active(panel)[:, positions]
+
+    capacity_columns = ['CAPACITY_MO_[MW]_' + str(x) for x in hours]
+    merit_order_columns = ['MO_' + str(x) for x in hours]
+    cumulative_columns = ['MO_CAPACITY_CUM_' + str(x) for x in hours]
+
+    frames = {}
+
+    for j, y in enumerate(years):
+
+        rows = np.flatnonzero(active[:, j])
+
+        hourly_factor = np.where(solar[rows, None], hourly_capacity_factor_solar[j][None, :], 1.0)
+        hourly_capacity = merit_order_capacity[rows, j, None] * hourly_factor
+
+        frame = pd.DataFrame({'PLANT_TYPE': plant_type[rows],
+                              'INITIAL_START_DATE': plants['INITIAL_START_DATE'].values[rows],
+                              'CAPACITY_[MW]_' + str(y): capacity[rows, j],
+                              'CAPACITY_FACTOR_' + str(y): capacity_factor[rows, j],
+                              'EMISSIONS_[tCO2/MWh]_' + str(y): emissions[rows, j]})
+
+        if 'COLORS' in plants:
+            frame['COLORS'] = plants['COLORS'].values[rows]
+
+        # Cumulative merit order capacity in the order of the table (not in merit order)
+        hourly = pd.DataFrame(np.hstack([hourly_capacity,
+                                         np.repeat(merit_order[rows, j, None], len(hours), axis=1),
+                                         np.cumsum(hourly_capacity, axis=0)]),
+                              columns=capacity_columns + merit_order_columns + cumulative_columns)
+
+        frame = pd.concat([frame, hourly], axis=1)
+        frame.index = plants.index[rows]
+
+        frames[y] = frame
+
+    return frames
+
+#%%
+
+######################################################################################################
+########################           Synthetic solar powerplants              ##########################
+######################################################################################################
+
+# New solar capacity (historical installations and projected diffusion) is added as synthetic powerplants. Every year,
+# powerplants are added as long as the capacity not yet added exceeds the size of the next powerplant, i.e., the
+# powerplants whose cumulative capacity is below the new capacity of the year. All powerplants of a year are created
+# at once; the sizes follow one of 'solar_size_distributions':
+# - 'average': all powerplants have the average size (number of powerplants in closed form)
+# - 'lognormal': sizes with the average size as mean and coefficient of variation 'size_cv'
+# - 'empirical': sizes drawn from 'sizes' (e.g., the capacities of the existing solar powerplants)
+# With a small average size, this also creates fleets of distributed PV units (100k+ units).
+
+solar_size_distributions = ['average', 'lognormal', 'empirical']
+
+
+def new_solar_capacity(installations, existing_capacity, years):
+    """Return the new solar capacity [MW] of every year: installed capacity minus that of the year before.
+
+    'installations' holds the installed capacity per year (index: years); in the first year, the capacity of the
+    existing powerplants is the capacity of the year before.
+    """
+
+    installed = pd.Series(np.asarray(installations, dtype=float), index=list(years))
+
+    return installed - installed.shift(1, fill_value=existing_capacity)
+
+
+def _draw_sizes(size_distribution, average_size, size_cv, sizes, count, rng):
+
+    if size_distribution == 'lognormal':
+        sigma = np.sqrt(np.log(1 + size_cv ** 2))
+        return rng.lognormal(np.log(average_size) - sigma ** 2 / 2, sigma, count)
+
+    return rng.choice(np.asarray(sizes, dtype=float), count)
+
+
+def synthetic_solar_plants(new_capacity, average_size, size_distribution='average', size_cv=1.0, sizes=None, seed=0, \
+                           first_number=1, prefix='solar_new_'):
+    """Return synthetic solar powerplants ('CAPACITY_[MW]', 'PLANT_TYPE', 'INITIAL_START_DATE') for the new capacity.
+
+    'new_capacity' holds the new capacity [MW] per year (index: years, see 'new_solar_capacity'). Powerplants are
+    named '<prefix><number>', numbered from 'first_number' in the order of the years.
+    """
+
+    if size_distribution not in solar_size_distributions:
+        raise ValueError("Unknown size distribution: " + str(size_distribution))
+
+    if size_distribution == 'empirical':
+
+        # Only positive sizes, otherwise the draws would never add up to the new capacity
+        sizes = np.asarray(sizes if sizes is not None else [], dtype=float)
+        sizes = sizes[np.isfinite(sizes) & (sizes > 0)]
+
+        if len(sizes) == 0:
+            raise ValueError("The empirical size distribution needs positive 'sizes'")
+
+    elif not average_size > 0:
+        raise ValueError("The average size of new solar powerplants needs to be positive: " + str(average_size))
+
+    years = np.asarray(new_capacity.index)
+    capacity = np.nan_to_num(np.asarray(new_capacity, dtype=float), nan=0.0)
+
+    if size_distribution == 'average':
+
+        # Number of powerplants with cumulative capacity below the new capacity
+        counts = np.maximum(np.ceil(capacity / average_size) - 1, 0).astype(np.int64)
+        plant_sizes = np.full(counts.sum(), float(average_size))
+
+    else:
+
+        rng = np.random.default_rng(seed)
+
+        if size_distribution == 'empirical':
+            average_size = float(np.mean(sizes))
+
+        size_list = []
+
+        for c in capacity:
+
+            # Draw more sizes than needed on average, and more if they do not add up to the new capacity
+            drawn = np.empty(0)
+            batch = int(np.ceil(max(c, 0) / average_size * 1.2)) + 16
+
+            while drawn.sum() < c:
+                drawn = np.concatenate([drawn, _draw_sizes(size_distribution, average_size, size_cv, sizes, batch, rng)])
+
+            size_list.append(drawn[:np.searchsorted(np.cumsum(drawn), c, side='left')])
+
+        counts = np.array([len(s) for s in size_list], dtype=np.int64)
+        plant_sizes = np.concatenate(size_list) if len(size_list) > 0 else np.empty(0)
+
+    numbers = np.arange(first_number, first_number + counts.sum())
+
+    return pd.DataFrame({'CAPACITY_[MW]': plant_sizes,
+                         'PLANT_TYPE': 'Solar',
+                         'INITIAL_START_DATE': np.repeat(years, counts)},
+                        index=pd.Index(np.char.add(prefix, numbers.astype(str)).astype(object), name='PLANT_NAME'),
+                        columns=['CAPACITY_[MW]', 'PLANT_TYPE', 'INITIAL_START_DATE'])
+
+#%%
+
+######################################################################################################
+########################           Plot helpers                             ##########################
+######################################################################################################
+
+def bar_positions(capacity):
+    """Return the x positions (centres) of bars of width 'capacity' placed side by side."""
+
+    capacity = np.asarray(capacity, dtype=float)
+
+    return np.cumsum(capacity) - capacity / 2
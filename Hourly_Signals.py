@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Hourly emission intensity and price signals of the merit order for the NetLogo tariff scenarios.
+
+Helper functions used by 'Power_Plants_in_CA.py'.
+"""
+
+import numpy as np
+import pandas as pd
+
+from Merit_Order_Dispatch import merit_order_prefix_sums, dispatch_emissions
+
+#%%
+
+######################################################################################################
+########################           Hourly signals                           ##########################
+######################################################################################################
+
+# For every year, hour, and reference load level, we derive from the merit order:
+# - 'AVERAGE_INTENSITY_[tCO2/MWh]': emissions of meeting the load divided by the load
+# - 'MARGINAL_INTENSITY_[tCO2/MWh]': emission factor of the marginal powerplant (the first one not fully dispatched)
+# - 'PRICE_PROXY': merit order factor 'MO_<hour>' of the marginal powerplant. The merit order factor orders the
+#   powerplants by their marginal costs (solar 0.025, intermittent 0.05, controllable 1 - capacity factor),
+#   thus it serves as relative price signal between 0 and 1.
+# - 'LOAD_SHARE': load divided by the merit order capacity of the hour
+# Loads above the merit order capacity have no marginal powerplant; their marginal intensity and price proxy are NaN.
+# The agent model loads the table once at startup (one row per year, hour, and load level).
+
+reference_load_levels = list(range(5000, 60001, 5000))
+
+signal_columns = ['YEAR', 'HOUR', 'LOAD_[MW]', 'LOAD_SHARE', 'AVERAGE_INTENSITY_[tCO2/MWh]',
+                  'MARGINAL_INTENSITY_[tCO2/MWh]', 'PRICE_PROXY']
+
+
+def hourly_signals(plants, year, hour, load_levels, dispatch_mode='whole'):
+    """Return the signals of one year and hour for all 'load_levels' [MW]."""
+
+    capacity_cum, emissions_cum = merit_order_prefix_sums(plants, year, hour)
+    # Same order as the prefix sums (missing merit order factors last)
+    merit_order = np.sort(plants['MO_' + str(hour)].values.astype(float))
+
+    # Powerplants after a missing capacity are never dispatched (see 'emission_curve')
+    missing = np.flatnonzero(~np.isfinite(capacity_cum))
+    end = missing[0] if len(missing) > 0 else len(capacity_cum)
+
+    capacity_cum = capacity_cum[:end]
+    emissions_cum = emissions_cum[:end]
+    merit_order = merit_order[:end]
+
+    load = np.asarray(load_levels, dtype=float)
+
+    emissions = dispatch_emissions(capacity_cum, emissions_cum, load, dispatch_mode)
+
+    # Marginal powerplant: the first one whose cumulative capacity exceeds the load (thus with capacity > 0); its
+    # emission factor follows from the prefix sums
+    marginal = np.searchsorted(capacity_cum, load, side='right')
+    has_marginal = marginal < end
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        emission_factor = np.diff(emissions_cum, prepend=0.0) / np.diff(capacity_cum, prepend=0.0)
+
+    marginal_intensity = np.full(len(load), np.nan)
+    marginal_intensity[has_marginal] = emission_factor[marginal[has_marginal]]
+
+    price_proxy = np.full(len(load), np.nan)
+    price_proxy[has_marginal] = merit_order[marginal[has_marginal]]
+
+    capacity_total = capacity_cum[-1] if end > 0 else np.nan
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average_intensity = np.where(load > 0, emissions / load, np.nan)
+
+    return pd.DataFrame({'YEAR': year,
+                         'HOUR': hour,
+                         'LOAD_[MW]': load,
+                         'LOAD_SHARE': load / capacity_total,
+                         'AVERAGE_INTENSITY_[tCO2/MWh]': average_intensity,
+                         'MARGINAL_INTENSITY_[tCO2/MWh]': marginal_intensity,
+                         'PRICE_PROXY': price_proxy},
+                        columns=signal_columns)
+
+
+def hourly_signal_table(plants_by_year, years, hours, load_levels=reference_load_levels, dispatch_mode='whole'):
+    """Return the signals of all years, hours, and load levels as one table."""
+
+    tables = []
+
+    for y in years:
+        for x in hours:
+            tables.append(hourly_signals(plants_by_year[y], y, x, load_levels, dispatch_mode))
+
+    return pd.concat(tables, ignore_index=True)
@@ -0,0 +1,515 @@
+# -*- coding: utf-8 -*-
+"""
+Merit order dispatch of the California power plant fleet.
+
+Helper functions shared by 'Power_Plants_in_CA.py' and 'Calculate_Carbon_Emissions.py'.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from Dispatch_Kernel import calculate_hourly_emissions_kernel, jit_available, dispatch_kernels
+
+#%%
+
+######################################################################################################
+########################           Merit order prefix sums                  ##########################
+######################################################################################################
+
+# For a given year and hour, the emissions of meeting a demand are the emissions of all powerplants whose
+# cumulative merit order capacity is below that demand. Instead of masking the whole fleet for every demand,
+# we sort the fleet once, build cumulative capacity and cumulative emission arrays (prefix sums), and look up
+# the number of dispatched powerplants with a binary search.
+
+def merit_order_arrays(plants, year, hour):
+    """Return capacity [MW] and emission factor [tCO2/MWh] of 'plants' sorted in merit order."""
+
+    # Same sort as the original loop, so ties in the merit order keep the same plant order
+    plants = plants.sort_values(by=['MO_' + str(hour)], ascending=True)
+
+    capacity = plants['CAPACITY_MO_[MW]_' + str(hour)].values.astype(float)
+    emission_factor = plants['EMISSIONS_[tCO2/MWh]_' + str(year)].values.astype(float)
+
+    return capacity, emission_factor
+
+
+def merit_order_prefix_sums(plants, year, hour):
+    """Return cumulative capacity and cumulative emissions [tCO2/h] of 'plants' in merit order."""
+
+    capacity, emission_factor = merit_order_arrays(plants, year, hour)
+
+    capacity_cum = np.cumsum(capacity)
+    emissions_cum = np.cumsum(capacity * emission_factor)
+
+    return capacity_cum, emissions_cum
+
+
+# Dispatch modes:
+# - 'whole': only powerplants whose cumulative capacity is below the demand run (original rule 'capacity_cum <= demand').
+#   The output of the marginal powerplant is dropped, which makes emissions a step function of the demand.
+# - 'partial': the marginal powerplant additionally covers the remaining demand. Its emissions follow from
+#   interpolating linearly between the prefix sums below and above the demand, so it is also O(log n) per demand.
+
+dispatch_modes = ['whole', 'partial']
+
+
+def dispatch_emissions(capacity_cum, emissions_cum, demand, dispatch_mode='whole'):
+    """Return hourly emissions [tCO2/h] of meeting 'demand' with the merit order given by its prefix sums."""
+
+    demand = np.asarray(demand, dtype=float)
+
+    # Number of dispatched powerplants, equivalent to the mask 'capacity_cum <= demand'
+    dispatched = np.searchsorted(capacity_cum, demand, side='right')
+    dispatched[np.isnan(demand)] = 0
+
+    # Emissions of the first n powerplants, with 0 for no dispatched powerplant
+    emissions = np.zeros(len(demand))
+    running = dispatched > 0
+    emissions[running] = emissions_cum[dispatched[running] - 1]
+
+    if dispatch_mode == 'partial':
+
+        # Marginal powerplant: the next one in the merit order, if demand is left
+        marginal = (dispatched < len(capacity_cum)) & ~np.isnan(demand)
+        k = dispatched[marginal]
+
+        capacity_below = np.where(k > 0, capacity_cum[np.maximum(k - 1, 0)], 0.0)
+        emissions_below = emissions[marginal]
+
+        # capacity_cum[k] > demand >= capacity_below, thus the capacity step is > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = (demand[marginal] - capacity_below) / (capacity_cum[k] - capacity_below)
+            partial_emissions = np.clip(share, 0, 1) * (emissions_cum[k] - emissions_below)
+
+        # No partial output from powerplants without capacity or emission values
+        emissions[marginal] = emissions_below + np.where(np.isfinite(partial_emissions), partial_emissions, 0.0)
+
+    elif dispatch_mode != 'whole':
+        raise ValueError("Unknown dispatch mode: " + str(dispatch_mode))
+
+    return emissions
+
+
+def dispatch_emissions_stacked(capacity_cum, emissions_cum, demand, dispatch_mode='whole'):
+    """Return emissions [tCO2/h] (draws x demands) of 'demand' for a stack of merit orders (draws x powerplants).
+
+    Same rule as 'dispatch_emissions', with one binary search vectorized over all merit orders and demands.
+    """
+
+    demand = np.broadcast_to(np.asarray(demand, dtype=float), (capacity_cum.shape[0], np.size(demand)))
+    n = capacity_cum.shape[1]
+
+    def prefix_at(prefix, count):
+        return np.where(count > 0, np.take_along_axis(prefix, np.maximum(count - 1, 0), axis=1), 0.0)
+
+    # Number of dispatched powerplants (cumulative capacity <= demand). NaN demands never fit.
+    low = np.zeros(demand.shape, dtype=np.int64)
+    high = np.full(demand.shape, n, dtype=np.int64)
+
+    while np.any(low < high):
+        middle = (low + high + 1) // 2
+        fits = prefix_at(capacity_cum, middle) <= demand
+        low = np.where(fits & (low < high), middle, low)
+        high = np.where(~fits & (low < high), middle - 1, high)
+
+    dispatched = low
+    emissions = prefix_at(emissions_cum, dispatched)
+
+    if dispatch_mode == 'partial':
+
+        # Marginal powerplant, interpolated between the prefix sums below and above the demand
+        above = np.minimum(dispatched + 1, n)
+
+        capacity_below = prefix_at(capacity_cum, dispatched)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = (demand - capacity_below) / (prefix_at(capacity_cum, above) - capacity_below)
+            partial_emissions = np.clip(share, 0, 1) * (prefix_at(emissions_cum, above) - emissions)
+
+        marginal = (dispatched < n) & ~np.isnan(demand) & np.isfinite(partial_emissions)
+        emissions = emissions + np.where(marginal, partial_emissions, 0.0)
+
+    elif dispatch_mode != 'whole':
+        raise ValueError("Unknown dispatch mode: " + str(dispatch_mode))
+
+    return emissions
+
+
+def calculate_hourly_emissions(df, lookup, years, hours, verbose=True, dispatch_mode='whole', dispatch_kernel='auto', out=None):
+    """Return an array (rows of 'df' x hours) of hourly emissions for the load profiles in 'df'.
+
+    'dispatch_kernel': 'jit' (compiled kernel, see 'Dispatch_Kernel.py'), 'numpy', or 'auto' (compiled kernel if
+    Numba is available). Both give bit-identical results.
+    With 'out' (rows x hours), the emissions are written into it instead of a new array.
+    """
+
+    if dispatch_kernel not in dispatch_kernels:
+        raise ValueError("Unknown dispatch kernel: " + str(dispatch_kernel))
+
+    if dispatch_kernel == 'jit' or (dispatch_kernel == 'auto' and jit_available):
+
+        if verbose:
+            print("DISPATCH KERNEL: all years")
+
+        return calculate_hourly_emissions_kernel(df, lookup, years, hours, dispatch_mode, out=out)
+
+    if out is None:
+        hourly_emissions = np.full((len(df), len(hours)), np.nan)
+    else:
+        hourly_emissions = out
+        hourly_emissions[:] = np.nan
+    year_column = df['Year'].values
+
+    for y in years:
+
+        if verbose:
+            print("NEW YEAR")
+            print(y)
+
+        rows_year = np.flatnonzero(year_column == y)
+
+        if len(rows_year) == 0:
+            continue
+
+        for i, x in enumerate(hours):
+
+            capacity_cum, emissions_cum = lookup[(y, x)]
+
+            demand = df['system-load-profile_' + str(x)].values[rows_year]
+
+            hourly_emissions[rows_year, i] = dispatch_emissions(capacity_cum, emissions_cum, demand, dispatch_mode)
+
+    return hourly_emissions
+
+
+#%%
+
+######################################################################################################
+########################           Merit order lookup bundle                ##########################
+######################################################################################################
+
+# 'Power_Plants_in_CA.py' exports the sorted merit order of every year and hour as one bundle of .npy files.
+# All (year, hour) segments are concatenated into flat arrays; 'OFFSETS' marks where each segment starts.
+# 'Calculate_Carbon_Emissions.py' opens the bundle as memory map, so that no csv parsing and sorting is needed.
+
+def build_merit_order_bundle(plants_by_year, years, hours):
+    """Return the flat merit order arrays of all years and hours as dictionary."""
+
+    capacity_list = []
+    emission_factor_list = []
+    offsets = [0]
+
+    for y in years:
+        for x in hours:
+            capacity, emission_factor = merit_order_arrays(plants_by_year[y], y, x)
+
+            capacity_list.append(capacity)
+            emission_factor_list.append(emission_factor)
+            offsets.append(offsets[-1] + len(capacity))
+
+    bundle = {}
+    bundle['YEARS'] = np.array(years, dtype=np.int64)
+    bundle['HOURS'] = np.array(hours, dtype=np.int64)
+    bundle['OFFSETS'] = np.array(offsets, dtype=np.int64)
+    bundle['CAPACITY'] = np.concatenate(capacity_list)
+    bundle['EMISSION_FACTOR'] = np.concatenate(emission_factor_list)
+
+    # Prefix sums per (year, hour) segment
+    bundle['CAPACITY_CUM'] = np.concatenate([np.cumsum(c) for c in capacity_list])
+    bundle['EMISSIONS_CUM'] = np.concatenate([np.cumsum(c * e) for c, e in zip(capacity_list, emission_factor_list)])
+
+    return bundle
+
+
+def save_merit_order_bundle(bundle, path):
+    """Save the merit order bundle as one .npy file per array in the folder 'path'."""
+
+    os.makedirs(path, exist_ok=True)
+
+    for name, array in bundle.items():
+        np.save(os.path.join(path, name + '.npy'), array)
+
+
+def load_merit_order_bundle(path, mmap_mode='r'):
+    """Open the merit order bundle in the folder 'path' (read-only memory map by default)."""
+
+    bundle = {}
+
+    for file_name in sorted(os.listdir(path)):
+        if file_name.endswith('.npy'):
+            bundle[file_name[:-len('.npy')]] = np.load(os.path.join(path, file_name), mmap_mode=mmap_mode)
+
+    return bundle
+
+
+def _bundle_covers(bundle, years, hours):
+    """Return True if the bundle holds all 'years' and 'hours'."""
+
+    return set(int(y) for y in years) <= set(int(y) for y in bundle['YEARS']) and \
+           set(int(x) for x in hours) <= set(int(x) for x in bundle['HOURS'])
+
+
+def load_merit_order(path_powerplants, years, hours, time_resolution='average_day'):
+    """Return the merit order bundle from 'path_powerplants'.
+
+    Opens the exported bundle 'merit_order_lookup' if it exists and holds all 'years' and 'hours', otherwise builds
+    it from the 'powerplants_average_day_<year>.csv' files. The 'full_year' bundle ('merit_order_lookup_8760')
+    has to be exported by 'Power_Plants_in_CA.py'; it raises ValueError if it misses years.
+    """
+
+    if time_resolution == 'full_year':
+        bundle = load_merit_order_bundle(os.path.join(path_powerplants, "merit_order_lookup_8760"))
+
+        missing = sorted(set(int(y) for y in years) - set(int(y) for y in bundle['YEARS']))
+
+        if missing:
+            raise ValueError("The full-year merit order bundle misses the years " + str(missing) +
+                             "; export it again with 'Power_Plants_in_CA.py'")
+
+        return bundle
+
+    if os.path.isdir(os.path.join(path_powerplants, "merit_order_lookup")):
+        bundle = load_merit_order_bundle(os.path.join(path_powerplants, "merit_order_lookup"))
+
+        if _bundle_covers(bundle, years, hours):
+            return bundle
+
+        # A stale bundle (e.g., exported for other years) is rebuilt from the csv files
+        print("MERIT ORDER BUNDLE: years or hours missing, rebuilt from the csv files")
+
+    plants_by_year = {}
+
+    for y in years:
+        plants_by_year[y] = pd.read_csv(os.path.join(path_powerplants, "powerplants_average_day_" + str(y) + ".csv"))
+
+    return build_merit_order_bundle(plants_by_year, years, hours)
+
+
+class MeritOrderLookup(dict):
+    """Dictionary {(year, hour): (capacity_cum, emissions_cum)} that keeps its bundle (for the dispatch kernel)."""
+
+    def __init__(self, bundle):
+
+        super().__init__()
+        self.bundle = bundle
+
+
+def merit_order_lookup_from_bundle(bundle):
+    """Return a dictionary {(year, hour): (capacity_cum, emissions_cum)} of views into the bundle."""
+
+    lookup = MeritOrderLookup(bundle)
+    segment = 0
+    offsets = bundle['OFFSETS']
+
+    for y in bundle['YEARS']:
+        for x in bundle['HOURS']:
+            start, end = offsets[segment], offsets[segment + 1]
+
+            lookup[(int(y), int(x))] = (bundle['CAPACITY_CUM'][start:end], bundle['EMISSIONS_CUM'][start:end])
+            segment = segment + 1
+
+    return lookup
+
+
+def lookup_from_bundle(bundle):
+    """Return the lookup of an average day or a full-year merit order bundle."""
+
+    if 'AVAILABILITY' in bundle:
+        return full_year_lookup_from_bundle(bundle)
+
+    return merit_order_lookup_from_bundle(bundle)
+
+#%%
+
+######################################################################################################
+########################           Full-year (8760 h) merit order           ##########################
+######################################################################################################
+
+# The average day hides seasonal variation in solar output and demand. In the full-year mode, every hour of the
+# year has its own available capacity. The merit order factors ('MO_<hour>') do not change over the hours, only
+# the available capacity does, and it only depends on the class of the powerplant:
+# - 'Solar': installed capacity times the hourly solar capacity factor
+# - 'Intermittent' (hydro, wind, solar thermal): capacity times capacity factor, optionally with an hour-of-year profile
+# - 'Controllable': full capacity
+# Thus we store, per year, the powerplants in merit order with prefix sums per class (n plants x 3 classes) and the
+# hour-of-year availability of each class (8760 x 3). The cumulative capacity in hour h is the sum over the classes
+# of availability[h, class] * capacity_cum[:, class]; it is evaluated during the binary search instead of being stored
+# for all 8760 hours.
+
+hours_of_the_year = 8760
+
+availability_classes = ['Solar', 'Intermittent', 'Controllable']
+
+intermittent_types = ['Hydro', 'Solar Thermal', 'Wind']
+
+
+def full_year_availability(solar_capacity_factor, pv_generation_profile, hourly_profiles=None):
+    """Return the hour-of-year availability (8760 x classes) of one year.
+
+    'pv_generation_profile' is the average day profile (24 values, sum 1). Without 'hourly_profiles', every day of
+    the year repeats the average day. 'hourly_profiles' may hold 8760 values for 'Solar' (generation profile) and
+    'Intermittent' (relative profile); they are scaled to the annual solar capacity factor and a mean of 1.
+    """
+
+    availability = np.ones((hours_of_the_year, len(availability_classes)))
+
+    hour_of_day = np.arange(hours_of_the_year) % 24
+
+    if hourly_profiles is not None and 'Solar' in hourly_profiles:
+        profile = np.asarray(hourly_profiles['Solar'], dtype=float)
+        availability[:, 0] = solar_capacity_factor * hours_of_the_year * profile / profile.sum()
+    else:
+        availability[:, 0] = solar_capacity_factor * 24 * np.asarray(pv_generation_profile, dtype=float)[hour_of_day]
+
+    if hourly_profiles is not None and 'Intermittent' in hourly_profiles:
+        profile = np.asarray(hourly_profiles['Intermittent'], dtype=float)
+        availability[:, 1] = profile / profile.mean()
+
+    return availability
+
+
+def build_full_year_bundle(plants_by_year, years, availability_by_year):
+    """Return the full-year merit order arrays of all years as dictionary."""
+
+    capacity_cum_list = []
+    emissions_cum_list = []
+    availability_list = []
+    offsets = [0]
+
+    for y in years:
+
+        # The merit order is the same in all hours
+        plants = plants_by_year[y].sort_values(by=['MO_0'], ascending=True)
+
+        plant_class = np.full(len(plants), availability_classes.index('Controllable'))
+        plant_class[plants['PLANT_TYPE'].isin(intermittent_types).values] = availability_classes.index('Intermittent')
+        plant_class[(plants['PLANT_TYPE'] == 'Solar').values] = availability_classes.index('Solar')
+
+        # Capacity at availability 1: installed capacity for solar, merit order capacity for all others
+        capacity = plants['CAPACITY_MO_[MW]_0'].values.astype(float)
+        capacity[plant_class == 0] = plants['CAPACITY_[MW]_' + str(y)].values.astype(float)[plant_class == 0]
+        emission_factor = plants['EMISSIONS_[tCO2/MWh]_' + str(y)].values.astype(float)
+
+        capacity_by_class = np.zeros((len(plants), len(availability_classes)))
+        capacity_by_class[np.arange(len(plants)), plant_class] = capacity
+
+        capacity_cum_list.append(np.cumsum(capacity_by_class, axis=0))
+        emissions_cum_list.append(np.cumsum(capacity_by_class * emission_factor[:, None], axis=0))
+        availability_list.append(availability_by_year[y])
+        offsets.append(offsets[-1] + len(plants))
+
+    bundle = {}
+    bundle['YEARS'] = np.array(years, dtype=np.int64)
+    bundle['OFFSETS'] = np.array(offsets, dtype=np.int64)
+    bundle['CAPACITY_CUM_CLASS'] = np.concatenate(capacity_cum_list)
+    bundle['EMISSIONS_CUM_CLASS'] = np.concatenate(emissions_cum_list)
+    bundle['AVAILABILITY'] = np.stack(availability_list)
+
+    return bundle
+
+
+def full_year_lookup_from_bundle(bundle):
+    """Return a dictionary {year: (capacity_cum, emissions_cum, availability)} of views into the full-year bundle."""
+
+    lookup = {}
+    offsets = bundle['OFFSETS']
+
+    for i, y in enumerate(bundle['YEARS']):
+        start, end = offsets[i], offsets[i + 1]
+
+        lookup[int(y)] = (bundle['CAPACITY_CUM_CLASS'][start:end], bundle['EMISSIONS_CUM_CLASS'][start:end],
+                          bundle['AVAILABILITY'][i])
+
+    return lookup
+
+
+def _prefix_at(prefix_by_class, availability, count):
+    """Prefix sum of the first 'count' powerplants, weighted with the availability of the hour (0 for count 0)."""
+
+    total = np.zeros(count.shape)
+    index = np.maximum(count - 1, 0)
+
+    for c in range(prefix_by_class.shape[1]):
+        total = total + prefix_by_class[index, c] * availability[:, c]
+
+    return np.where(count > 0, total, 0.0)
+
+
+def dispatch_full_year(capacity_cum, emissions_cum, availability, demand, dispatch_mode='whole'):
+    """Return emissions [tCO2/h] of a (runs x 8760) demand array for one year of the full-year merit order."""
+
+    demand = np.asarray(demand, dtype=float)
+    n = len(capacity_cum)
+
+    # Availability of every element of 'demand', broadcast over the runs
+    availability = np.broadcast_to(availability[None, :, :], demand.shape + (availability.shape[1],)).reshape(-1, availability.shape[1])
+    demand = demand.reshape(-1)
+
+    # Binary search for the number of dispatched powerplants (cumulative capacity <= demand), vectorized over all
+    # runs and hours. NaN capacities or demands never compare as <= and thus dispatch nothing.
+    low = np.zeros(len(demand), dtype=np.int64)
+    high = np.full(len(demand), n, dtype=np.int64)
+
+    while np.any(low < high):
+        middle = (low + high + 1) // 2
+        fits = _prefix_at(capacity_cum, availability, middle) <= demand
+        low = np.where(fits & (low < high), middle, low)
+        high = np.where(~fits & (low < high), middle - 1, high)
+
+    dispatched = low
+    emissions = _prefix_at(emissions_cum, availability, dispatched)
+
+    if dispatch_mode == 'partial':
+
+        # Marginal powerplant, interpolated between the prefix sums below and above the demand
+        marginal = (dispatched < n) & ~np.isnan(demand)
+        k = dispatched[marginal]
+        availability_marginal = availability[marginal]
+
+        capacity_below = _prefix_at(capacity_cum, availability_marginal, k)
+        capacity_above = _prefix_at(capacity_cum, availability_marginal, k + 1)
+        emissions_below = emissions[marginal]
+        emissions_above = _prefix_at(emissions_cum, availability_marginal, k + 1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = (demand[marginal] - capacity_below) / (capacity_above - capacity_below)
+            partial_emissions = np.clip(share, 0, 1) * (emissions_above - emissions_below)
+
+        emissions[marginal] = emissions_below + np.where(np.isfinite(partial_emissions), partial_emissions, 0.0)
+
+    elif dispatch_mode != 'whole':
+        raise ValueError("Unknown dispatch mode: " + str(dispatch_mode))
+
+    return emissions.reshape(-1, hours_of_the_year)
+
+
+def calculate_full_year_emissions(df, lookup, years, dispatch_mode='whole', rows_per_block=200):
+    """Return an array (rows of 'df' x 24) of average day emissions from 8760-hour load profiles in 'df'.
+
+    Hour x of the average day is the mean over all days of hour x, so that 365 times the daily sum is the
+    sum over all 8760 hours. Rows are dispatched in blocks of 'rows_per_block' to bound the memory.
+    """
+
+    load_columns = ['system-load-profile_' + str(h) for h in range(hours_of_the_year)]
+    loads = df[load_columns].to_numpy(dtype=float)
+
+    hourly_emissions = np.full((len(df), 24), np.nan)
+    year_column = df['Year'].values
+
+    for y in years:
+
+        rows_year = np.flatnonzero(year_column == y)
+
+        capacity_cum, emissions_cum, availability = lookup[y]
+
+        for start in range(0, len(rows_year), rows_per_block):
+
+            rows = rows_year[start:start + rows_per_block]
+
+            emissions = dispatch_full_year(capacity_cum, emissions_cum, availability, loads[rows], dispatch_mode)
+
+            hourly_emissions[rows, :] = emissions.reshape(len(rows), -1, 24).mean(axis=1)
+
+    return hourly_emissions
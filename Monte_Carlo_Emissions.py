@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo uncertainty of the emissions over capacity factors and emission rates of the powerplant fleet.
+
+Helper functions used by 'Power_Plants_in_CA.py' (parameter spreads) and 'Calculate_Carbon_Emissions.py' (ensemble).
+"""
+
+import numpy as np
+import pandas as pd
+
+from Merit_Order_Dispatch import dispatch_emissions_stacked, intermittent_types
+
+#%%
+
+######################################################################################################
+########################           Parameter spreads                        ##########################
+######################################################################################################
+
+# Many capacity factors and emission rates of the fleet are type means or carried forward from 2010/2016.
+# We describe their uncertainty by the spread (coefficient of variation) within each plant type:
+# - Emitting powerplants: spread of the capacity factors and emission rates of all powerplants and years 2010-2017
+#   of that type in the PSE data. 'Gas_undefined' (unmatched gas powerplants) gets the spread of all emitting powerplants.
+# - Non-emitting powerplants: spread of the annual EIA capacity factors of that type (2013-2019); their emissions are 0.
+
+spread_columns = ['CAPACITY_FACTOR_CV', 'EMISSIONS_CV']
+
+
+def _coefficient_of_variation(values):
+
+    values = values[np.isfinite(values)]
+
+    if len(values) < 2 or values.mean() == 0:
+        return 0.0
+
+    return float(values.std(ddof=1) / values.mean())
+
+
+def emitting_parameter_spreads(powerplants_ca_emitting, years_short):
+    """Return the spreads per plant type of the emitting powerplants ('powerplants_ca_emitting', 2010-2017 columns)."""
+
+    capacity_factor_columns = ['CAPACITY_FACTOR_' + str(x) for x in years_short]
+    emission_columns = ['EMISSIONS_[tCO2/MWh]_' + str(x) for x in years_short]
+
+    spreads = pd.DataFrame(columns=spread_columns, dtype=float)
+
+    groups = list(powerplants_ca_emitting.groupby('PLANT_TYPE')) + [('Gas_undefined', powerplants_ca_emitting)]
+
+    for plant_type, plants in groups:
+        spreads.loc[plant_type, 'CAPACITY_FACTOR_CV'] = \
+                _coefficient_of_variation(plants[capacity_factor_columns].values.astype(float).ravel())
+        spreads.loc[plant_type, 'EMISSIONS_CV'] = \
+                _coefficient_of_variation(plants[emission_columns].values.astype(float).ravel())
+
+    spreads.index.name = 'PLANT_TYPE'
+
+    return spreads
+
+
+def non_emitting_parameter_spreads(capacity_factors, plant_types, years_data):
+    """Return the spreads per plant type of the non-emitting powerplants (annual capacity factors by type)."""
+
+    spreads = pd.DataFrame(columns=spread_columns, dtype=float)
+
+    for plant_type in plant_types:
+        spreads.loc[plant_type, 'CAPACITY_FACTOR_CV'] = \
+                _coefficient_of_variation(capacity_factors.loc[plant_type, [str(x) for x in years_data]].values.astype(float))
+        spreads.loc[plant_type, 'EMISSIONS_CV'] = 0.0
+
+    spreads.index.name = 'PLANT_TYPE'
+
+    return spreads
+
+#%%
+
+######################################################################################################
+########################           Ensemble of merit orders                 ##########################
+######################################################################################################
+
+# Every draw scales the capacity factor and the emission rate of each plant type (or, with 'per_plant', of each
+# powerplant) with a factor 1 + spread * z, z standard normal, cut at 0 (capacity factors also at 1).
+# A changed capacity factor changes the merit order like in 'Power_Plants_in_CA.py':
+# - controllable powerplants: merit order factor 1 - capacity factor, full capacity
+# - solar and intermittent powerplants: same merit order factor, capacity proportional to the capacity factor
+# All draws of a year are dispatched at once as stacked (draws x powerplants) prefix sums.
+# Draws only depend on the seed and the year, so the reference and all scenarios see the same draws
+# and their savings per draw are consistent.
+
+def sample_parameter_factors(plant_types, spreads, draws, rng, per_plant=False):
+    """Return factors (draws x powerplants) for the capacity factors and the emission rates."""
+
+    plant_types = np.asarray(plant_types)
+    spreads = spreads.reindex(np.unique(plant_types)).fillna(0.0)
+
+    capacity_factor_cv = spreads.loc[plant_types, 'CAPACITY_FACTOR_CV'].values
+    emissions_cv = spreads.loc[plant_types, 'EMISSIONS_CV'].values
+
+    if per_plant:
+        z_capacity_factor = rng.standard_normal((draws, len(plant_types)))
+        z_emissions = rng.standard_normal((draws, len(plant_types)))
+
+    else:
+        # One draw per plant type, shared by all powerplants of that type
+        types, type_codes = np.unique(plant_types, return_inverse=True)
+        z_capacity_factor = rng.standard_normal((draws, len(types)))[:, type_codes]
+        z_emissions = rng.standard_normal((draws, len(types)))[:, type_codes]
+
+    capacity_factor_factor = np.maximum(0.0, 1 + capacity_factor_cv * z_capacity_factor)
+    emissions_factor = np.maximum(0.0, 1 + emissions_cv * z_emissions)
+
+    return capacity_factor_factor, emissions_factor
+
+
+def ensemble_merit_orders(plants, year, spreads, draws, seed=0, per_plant=False):
+    """Return the sampled merit orders of one year: sort order, capacity ratio, and emission factors (draws x powerplants)."""
+
+    rng = np.random.default_rng([seed, year])
+
+    capacity_factor_factor, emissions_factor = sample_parameter_factors(plants['PLANT_TYPE'].values, spreads, draws, rng, per_plant)
+
+    controllable = ~(plants['PLANT_TYPE'].isin(intermittent_types) | (plants['PLANT_TYPE'] == 'Solar')).values
+
+    capacity_factor = plants['CAPACITY_FACTOR_' + str(year)].values.astype(float)
+    capacity_factor_draws = np.clip(capacity_factor * capacity_factor_factor, 0, 1)
+
+    # Controllable powerplants move in the merit order, all others scale their merit order capacity
+    merit_order = np.where(controllable, 1 - capacity_factor_draws, plants['MO_0'].values.astype(float))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        capacity_ratio = np.where(controllable | (capacity_factor == 0), 1.0, capacity_factor_draws / capacity_factor)
+
+    emission_factor_draws = plants['EMISSIONS_[tCO2/MWh]_' + str(year)].values.astype(float) * emissions_factor
+
+    order = np.argsort(merit_order, axis=1)
+
+    return order, capacity_ratio, emission_factor_draws
+
+
+def ensemble_annual_emissions(df, plants_by_year, years, hours, spreads, draws=1000, seed=0, dispatch_mode='whole', \
+                              draws_per_block=100, per_plant=False):
+    """Return the average annual emissions over all runs per draw and year (draws x years) of the load profiles in 'df'."""
+
+    annual = np.full((draws, len(years)), np.nan)
+    year_column = df['Year'].values
+
+    for j, y in enumerate(years):
+
+        rows_year = np.flatnonzero(year_column == y)
+
+        if len(rows_year) == 0:
+            continue
+
+        plants = plants_by_year[y]
+        order, capacity_ratio, emission_factor_draws = ensemble_merit_orders(plants, y, spreads, draws, seed, per_plant)
+
+        total = np.zeros(draws)
+
+        for x in hours:
+
+            capacity = plants['CAPACITY_MO_[MW]_' + str(x)].values.astype(float)
+            demand = df['system-load-profile_' + str(x)].values[rows_year]
+
+            # Draws in blocks, to bound the (draws x runs) arrays
+            for start in range(0, draws, draws_per_block):
+
+                block = slice(start, start + draws_per_block)
+
+                capacity_draws = np.take_along_axis(capacity * capacity_ratio[block], order[block], axis=1)
+                emission_factors = np.take_along_axis(emission_factor_draws[block], order[block], axis=1)
+
+                emissions = dispatch_emissions_stacked(np.cumsum(capacity_draws, axis=1),
+                                                       np.cumsum(capacity_draws * emission_factors, axis=1),
+                                                       demand, dispatch_mode)
+
+                total[block] = total[block] + emissions.sum(axis=1)
+
+        annual[:, j] = total * 365 / len(rows_year)
+
+    return annual
+
+#%%
+
+######################################################################################################
+########################           Confidence bands                         ##########################
+######################################################################################################
+
+band_quantiles = [0.05, 0.5, 0.95]
+
+
+def emission_bands(annual, years, reference_annual=None, quantiles=band_quantiles):
+    """Return mean and quantiles over the draws of the average annual and cumulative emissions per year.
+
+    With the ensemble of the reference ('reference_annual', same draws), also of the emission savings.
+    """
+
+    quantities = {'ANNUAL_EMISSIONS': annual,
+                  'CUMULATIVE_EMISSIONS': np.cumsum(annual, axis=1)}
+
+    if reference_annual is not None:
+        quantities['ANNUAL_EMISSION_SAVINGS'] = reference_annual - annual
+        quantities['CUMULATIVE_EMISSION_SAVINGS'] = np.cumsum(reference_annual - annual, axis=1)
+
+    bands = pd.DataFrame(index=pd.Index(years, name='Year'))
+
+    for name, values in quantities.items():
+
+        bands[name + '_MEAN'] = values.mean(axis=0)
+
+        for q in quantiles:
+            bands[name + '_P' + str(int(round(q * 100)))] = np.quantile(values, q, axis=0)
+
+    return bands
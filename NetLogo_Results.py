@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Reading NetLogo results for the emissions calculation and writing its results.
+
+Helper functions used by 'Calculate_Carbon_Emissions.py'.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from Merit_Order_Dispatch import calculate_hourly_emissions, calculate_full_year_emissions, hours_of_the_year
+
+#%%
+
+######################################################################################################
+########################           Column-projected reader                  ##########################
+######################################################################################################
+
+# A NetLogo '_pre.csv' export has around 977 columns, but the emissions calculation only needs the run number,
+# the year, the hourly system load profile, and the emission reductions from gasoline displacement.
+# In 'projected' mode we read only these columns with declared dtypes and stream the file in row chunks.
+# The load profiles stay float64, so that the dispatch gives the same emissions as with the full file.
+
+hours_of_the_day = list(range(0,24))
+
+netlogo_columns = ['[run number]', 'Year'] + \
+                  ['system-load-profile_' + str(x) for x in hours_of_the_day] + \
+                  ['annual-CO2-emission-reductions-from-gasoline-displacement']
+
+netlogo_dtypes = {'[run number]': np.int32,
+                  'Year': np.int16,
+                  'annual-CO2-emission-reductions-from-gasoline-displacement': np.float64}
+
+for x in hours_of_the_day:
+    netlogo_dtypes['system-load-profile_' + str(x)] = np.float64
+
+
+def read_netlogo_results(path, read_mode='full', chunksize=None, rows=None):
+    """Read a NetLogo '_pre.csv' file, either with all columns ('full') or only the needed ones ('projected').
+
+    With 'rows' (start, stop), only these rows are read (the lines before are skipped without parsing them).
+    """
+
+    skip = {}
+
+    if rows is not None:
+        skip = {'skiprows': range(1, rows[0] + 1), 'nrows': rows[1] - rows[0]}
+
+    if read_mode == 'full':
+        return pd.read_csv(path, sep=',', low_memory=False, **skip)
+
+    elif read_mode == 'projected':
+        return pd.read_csv(path, sep=',', usecols=netlogo_columns, dtype=netlogo_dtypes, chunksize=chunksize, **skip)
+
+    else:
+        raise ValueError("Unknown read mode: " + str(read_mode))
+
+
+def count_netlogo_rows(path, block_size=2**24):
+    """Return the number of rows of a NetLogo file (lines without the header)."""
+
+    lines = 0
+    last = b'\n'
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+
+    # The last line may have no line break
+    if last != b'\n':
+        lines += 1
+
+    return max(lines - 1, 0)
+
+
+def iter_dispatched_netlogo_results(path, lookup, years, hours, chunksize=100000, dispatch_mode='whole', dispatch_kernel='auto'):
+    """Yield the chunks of the projected columns of a NetLogo file with the 'HOURLY_EMISSIONS_<hour>' columns added."""
+
+    for chunk in read_netlogo_results(path, read_mode='projected', chunksize=chunksize):
+
+        hourly_emissions = calculate_hourly_emissions(chunk, lookup, years, hours, verbose=False, dispatch_mode=dispatch_mode, \
+                                                      dispatch_kernel=dispatch_kernel)
+
+        # All hours attached at once, as one block
+        yield pd.concat([chunk, pd.DataFrame(hourly_emissions, index=chunk.index, copy=False,
+                                             columns=['HOURLY_EMISSIONS_' + str(x) for x in hours])], axis=1)
+
+
+def read_and_dispatch_netlogo_results(path, lookup, years, hours, chunksize=100000, dispatch_mode='whole', dispatch_kernel='auto'):
+    """Stream the projected columns of a NetLogo file in chunks through the dispatch.
+
+    Returns the projected dataframe with the 'HOURLY_EMISSIONS_<hour>' columns added.
+    """
+
+    chunks = list(iter_dispatched_netlogo_results(path, lookup, years, hours, chunksize, dispatch_mode, dispatch_kernel))
+
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=netlogo_columns + ['HOURLY_EMISSIONS_' + str(x) for x in hours])
+
+    return pd.concat(chunks)
+
+
+# Full-year mode: the NetLogo file holds 8760-hour load profiles ('system-load-profile_0' to '_8759') per run and year.
+# One row is 70 kB, so the file is streamed in small chunks. The 8760 load columns are dropped after the dispatch;
+# the chunks only keep the average day emissions (see 'calculate_full_year_emissions' in 'Merit_Order_Dispatch.py').
+
+netlogo_full_year_columns = ['[run number]', 'Year'] + \
+                            ['system-load-profile_' + str(h) for h in range(hours_of_the_year)] + \
+                            ['annual-CO2-emission-reductions-from-gasoline-displacement']
+
+netlogo_full_year_dtypes = dict((c, np.float64) for c in netlogo_full_year_columns)
+netlogo_full_year_dtypes['[run number]'] = np.int32
+netlogo_full_year_dtypes['Year'] = np.int16
+
+
+def iter_dispatched_full_year_results(path, lookup, years, chunksize=2000, dispatch_mode='whole'):
+    """Yield the chunks of a NetLogo file with 8760-hour load profiles after the full-year dispatch.
+
+    Every chunk holds the run number, year, and gasoline columns with the 'HOURLY_EMISSIONS_<hour>' columns (average day).
+    """
+
+    for chunk in pd.read_csv(path, sep=',', usecols=netlogo_full_year_columns, dtype=netlogo_full_year_dtypes, chunksize=chunksize):
+
+        hourly_emissions = calculate_full_year_emissions(chunk, lookup, years, dispatch_mode)
+
+        chunk = chunk[['[run number]', 'Year', 'annual-CO2-emission-reductions-from-gasoline-displacement']]
+
+        yield pd.concat([chunk, pd.DataFrame(hourly_emissions, index=chunk.index, copy=False,
+                                             columns=['HOURLY_EMISSIONS_' + str(x) for x in hours_of_the_day])], axis=1)
+
+
+def read_and_dispatch_full_year_results(path, lookup, years, chunksize=2000, dispatch_mode='whole'):
+    """Stream a NetLogo file with 8760-hour load profiles in chunks through the full-year dispatch.
+
+    Returns the run number, year, and gasoline columns with the 'HOURLY_EMISSIONS_<hour>' columns (average day) added.
+    """
+
+    chunks = list(iter_dispatched_full_year_results(path, lookup, years, chunksize, dispatch_mode))
+    hours = list(range(0,24))
+
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=['[run number]', 'Year', 'annual-CO2-emission-reductions-from-gasoline-displacement'] + \
+                                    ['HOURLY_EMISSIONS_' + str(x) for x in hours])
+
+    return pd.concat(chunks)
+
+#%%
+
+######################################################################################################
+########################           Writing the results                      ##########################
+######################################################################################################
+
+# Writing the adjusted framework as '_pre_em.csv' re-serializes all ~977 NetLogo columns, so each output is as
+# large as its input. In the 'parquet' and 'feather' output modes we only write the columns calculated here,
+# keyed by run number and year, as compressed columnar file (needs pyarrow). The NetLogo columns stay in the
+# original '_pre.csv' file; 'EmissionResultsView' joins them back on demand.
+
+output_suffixes = {'csv': '_pre_em.csv',
+                   'parquet': '_pre_em.parquet',
+                   'feather': '_pre_em.feather'}
+
+key_columns = ['[run number]', 'Year']
+
+
+def emission_result_columns(hours):
+    """Return the names of all columns the emissions calculation adds."""
+
+    return ['HOURLY_EMISSIONS_' + str(x) for x in hours] + \
+           ['ANNUAL_EMISSIONS',
+            'CUMULATIVE_EMISSIONS',
+            'ANNUAL_EMISSION_SAVINGS',
+            'CUMULATIVE_EMISSION_SAVINGS',
+            'ANNUAL_EMISSION_SAVINGS_INCL_EV',
+            'CUMULATIVE_EMISSION_SAVINGS_INCL_EV']
+
+
+def write_emission_results(df, output_path, hours, output_mode='csv'):
+    """Save the results, either the adjusted framework ('csv') or only the result columns ('parquet', 'feather')."""
+
+    if output_mode == 'csv':
+        df.to_csv(output_path, index=False)
+
+        return
+
+    results = df[key_columns + emission_result_columns(hours)].reset_index(drop=True)
+
+    if output_mode == 'parquet':
+        results.to_parquet(output_path, compression='zstd', index=False)
+
+    elif output_mode == 'feather':
+        results.to_feather(output_path, compression='zstd')
+
+    else:
+        raise ValueError("Unknown output mode: " + str(output_mode))
+
+
+def read_emission_results(path, columns=None):
+    """Read results written by 'write_emission_results' (the format follows from the file extension)."""
+
+    extension = os.path.splitext(path)[1]
+
+    if extension == '.parquet':
+        return pd.read_parquet(path, columns=columns)
+
+    elif extension == '.feather':
+        return pd.read_feather(path, columns=columns)
+
+    else:
+        return pd.read_csv(path, sep=',', usecols=columns, low_memory=False)
+
+
+class EmissionResultsView:
+    """Results of one scenario together with the original NetLogo file, which is only read when needed."""
+
+    def __init__(self, results_path, netlogo_path=None):
+
+        self.results_path = results_path
+        self.netlogo_path = netlogo_path
+        self._results = None
+
+    @property
+    def results(self):
+        """Result columns, keyed by run number and year."""
+
+        if self._results is None:
+            self._results = read_emission_results(self.results_path)
+
+        return self._results
+
+    def join(self, netlogo_columns):
+        """Return the results joined with the given columns of the original NetLogo '_pre.csv' file."""
+
+        if self.netlogo_path is None:
+            raise ValueError("No NetLogo file to join: " + str(self.results_path))
+
+        usecols = key_columns + [c for c in netlogo_columns if c not in key_columns]
+
+        netlogo = pd.read_csv(self.netlogo_path, sep=',', usecols=usecols, low_memory=False)
+
+        return self.results.merge(netlogo, on=key_columns, how='left')
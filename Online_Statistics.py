@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Online statistics per year across runs (mean, standard deviation, quantiles), updated chunk by chunk.
+
+Helper functions used by 'Emission_Pipeline.py' (streaming aggregation) and 'Calculate_Carbon_Emissions.py'.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+#%%
+
+######################################################################################################
+########################           Quantile sketch                          ##########################
+######################################################################################################
+
+# Quantiles are estimated with a logarithmic bucket sketch (DDSketch): a value x is counted in the bucket
+# ceil(log(|x|) / log(gamma)), separately for positive and negative values, with gamma = (1 + a) / (1 - a).
+# Every quantile is then within a relative error 'a' of a true value of the data. Merging two sketches adds
+# their bucket counts, thus the result does not depend on the order of the chunks or on how they were split
+# between workers. Emissions between 1 tCO2 and 1e9 tCO2 need about 2000 buckets at a = 0.005.
+
+class QuantileSketch:
+    """Mergeable quantile sketch with relative accuracy 'relative_accuracy'."""
+
+    def __init__(self, relative_accuracy=0.005, min_value=1e-9):
+
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def _add_buckets(self, buckets, values):
+
+        indices, counts = np.unique(np.ceil(np.log(values) / self.log_gamma).astype(np.int64), return_counts=True)
+
+        for i, n in zip(indices.tolist(), counts.tolist()):
+            buckets[i] = buckets.get(i, 0) + n
+
+    def add(self, values):
+        """Add the finite ones of 'values'."""
+
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+
+        small = np.abs(values) < self.min_value
+
+        self._add_buckets(self.positive, values[~small & (values > 0)])
+        self._add_buckets(self.negative, -values[~small & (values < 0)])
+
+        self.zeros += int(small.sum())
+        self.count += len(values)
+
+    def merge(self, other):
+        """Add the counts of another sketch with the same accuracy."""
+
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Sketches with different accuracy cannot be merged")
+
+        for buckets, other_buckets in [(self.positive, other.positive), (self.negative, other.negative)]:
+            for i, n in other_buckets.items():
+                buckets[i] = buckets.get(i, 0) + n
+
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantiles(self, quantiles):
+        """Return the estimates of 'quantiles' (NaN without values)."""
+
+        if self.count == 0:
+            return np.full(len(quantiles), np.nan)
+
+        negative = sorted(self.negative, reverse=True)
+        positive = sorted(self.positive)
+
+        # Bucket values in increasing order: negative buckets from the largest magnitude, zero, positive buckets
+        values = np.concatenate([-2 * self.gamma ** np.array(negative, dtype=float) / (self.gamma + 1),
+                                 [0.0],
+                                 2 * self.gamma ** np.array(positive, dtype=float) / (self.gamma + 1)])
+        counts = np.array([self.negative[i] for i in negative] + [self.zeros] + [self.positive[i] for i in positive])
+
+        ranks = np.asarray(quantiles, dtype=float) * (self.count - 1)
+
+        return values[np.searchsorted(np.cumsum(counts), ranks, side='right')]
+
+#%%
+
+######################################################################################################
+########################           Statistics per year                      ##########################
+######################################################################################################
+
+# Mean and variance are updated with Welford's algorithm, chunk-wise in the form of Chan et al.: the count, mean,
+# and sum of squared deviations (M2) of a chunk are combined with the running ones. Partial statistics of
+# parallel workers are combined the same way. Missing values (NaN) are not counted.
+
+summary_quantiles = [0.05, 0.5, 0.95]
+
+
+def _combine_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+
+    count = count_a + count_b
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = mean_b - mean_a
+        mean = np.where(count > 0, mean_a + delta * count_b / count, 0.0)
+        m2 = np.where(count > 0, m2_a + m2_b + delta ** 2 * count_a * count_b / count, 0.0)
+
+    return count, mean, m2
+
+
+class YearlyStatistics:
+    """Count, mean, variance, and quantile sketch of 'columns' per year, across all rows (runs) of that year."""
+
+    def __init__(self, columns, years, relative_accuracy=0.005):
+
+        self.columns = list(columns)
+        self.years = list(years)
+        self.relative_accuracy = relative_accuracy
+
+        self.count = np.zeros((len(self.columns), len(self.years)))
+        self.mean = np.zeros((len(self.columns), len(self.years)))
+        self.m2 = np.zeros((len(self.columns), len(self.years)))
+
+        self.sketches = dict(((c, y), QuantileSketch(relative_accuracy)) for c in self.columns for y in self.years)
+
+    def update(self, df):
+        """Add the rows of a chunk ('Year' and 'columns'); rows of other years are ignored."""
+
+        year_position = pd.Index(self.years).get_indexer(df['Year'].values)
+        rows = np.flatnonzero(year_position >= 0)
+        year_codes = year_position[rows]
+
+        for i, c in enumerate(self.columns):
+
+            values = df[c].values[rows].astype(float)
+            finite = np.isfinite(values)
+
+            codes = year_codes[finite]
+            values = values[finite]
+
+            count = np.bincount(codes, minlength=len(self.years)).astype(float)
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.where(count > 0, np.bincount(codes, values, len(self.years)) / count, 0.0)
+
+            m2 = np.bincount(codes, (values - mean[codes]) ** 2, len(self.years))
+
+            self.count[i], self.mean[i], self.m2[i] = _combine_moments(self.count[i], self.mean[i], self.m2[i], count, mean, m2)
+
+            # One sketch per year: sort once by year, then add the slices
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(self.years) + 1))
+
+            for j, y in enumerate(self.years):
+                if bounds[j + 1] > bounds[j]:
+                    self.sketches[(c, y)].add(values[order[bounds[j]:bounds[j + 1]]])
+
+    def merge(self, other):
+        """Add the statistics of another instance over the same columns and years (e.g., of a parallel worker)."""
+
+        if other.columns != self.columns or other.years != self.years:
+            raise ValueError("Statistics over different columns or years cannot be merged")
+
+        self.count, self.mean, self.m2 = _combine_moments(self.count, self.mean, self.m2, other.count, other.mean, other.m2)
+
+        for key, sketch in other.sketches.items():
+            self.sketches[key].merge(sketch)
+
+        return self
+
+    def means(self, columns=None):
+        """Return the means per year (index 'Year'), like 'reference_average' in 'Emission_Pipeline.py'."""
+
+        columns = self.columns if columns is None else list(columns)
+        positions = [self.columns.index(c) for c in columns]
+
+        means = np.where(self.count[positions] > 0, self.mean[positions], np.nan)
+
+        return pd.DataFrame(means.T, index=pd.Index(self.years, name='Year'), columns=columns)
+
+    def summary(self, quantiles=summary_quantiles):
+        """Return count, mean, standard deviation, and quantiles of every column per year."""
+
+        summary = pd.DataFrame(index=pd.Index(self.years, name='Year'))
+
+        for i, c in enumerate(self.columns):
+
+            count = self.count[i]
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                summary[c + '_COUNT'] = count.astype(np.int64)
+                summary[c + '_MEAN'] = np.where(count > 0, self.mean[i], np.nan)
+                summary[c + '_STD'] = np.where(count > 1, np.sqrt(self.m2[i] / (count - 1)), np.nan)
+
+            estimates = np.array([self.sketches[(c, y)].quantiles(quantiles) for y in self.years]).reshape(len(self.years), len(quantiles))
+
+            for k, q in enumerate(quantiles):
+                summary[c + '_P' + str(int(round(q * 100)))] = estimates[:, k]
+
+        return summary
+
+#%%
+
+######################################################################################################
+########################           Cumulative sums by run                   ##########################
+######################################################################################################
+
+# Cumulative emissions are sums over the years of a run, thus a run can span several chunks. We carry the
+# cumulative value of every run from chunk to chunk (one value per run, not per row). Within a chunk, the runs x
+# years grid is summed up like in 'cumulative_by_run', so the results are the same as for the whole frame,
+# provided that the rows of a run are read in increasing year order (as NetLogo writes them).
+
+class RunningCumulative:
+    """Cumulative sum of a column over the years of each run, for chunks read one after another."""
+
+    def __init__(self, years):
+
+        self.years = np.sort(np.asarray(years))
+        self.totals = pd.Series(dtype=float)
+        self.last_year_codes = pd.Series(dtype=np.int64)
+
+    def add(self, df, column):
+        """Return the cumulative values of 'column' for the rows of a chunk (NaN for rows of other years)."""
+
+        cumulative_values = np.full(len(df), np.nan)
+
+        rows = np.flatnonzero(np.isin(df['Year'].values, self.years))
+
+        if len(rows) == 0:
+            return cumulative_values
+
+        runs, run_codes = np.unique(df['[run number]'].values[rows], return_inverse=True)
+        year_codes = np.searchsorted(self.years, df['Year'].values[rows])
+
+        first_year_codes = np.full(len(runs), len(self.years))
+        np.minimum.at(first_year_codes, run_codes, year_codes)
+
+        if np.any(first_year_codes <= self.last_year_codes.reindex(runs, fill_value=-1).values):
+            raise ValueError("Rows of a run are not in increasing year order across chunks")
+
+        # If a run has several rows in one year, its first row counts
+        cell_codes = run_codes * len(self.years) + year_codes
+        cells, first_rows = np.unique(cell_codes, return_index=True)
+
+        grid = np.zeros((len(runs), len(self.years) + 1))
+        grid[:, 0] = self.totals.reindex(runs, fill_value=0.0).values
+        grid[:, 1:].flat[cells] = df[column].values[rows][first_rows]
+
+        # Carried value of the run plus its years in this chunk
+        cumulative = np.cumsum(grid, axis=1)[:, 1:]
+
+        cumulative_values[rows] = cumulative[run_codes, year_codes]
+
+        last_year_codes = np.full(len(runs), -1)
+        np.maximum.at(last_year_codes, run_codes, year_codes)
+
+        carried = ~self.totals.index.isin(runs)
+
+        self.totals = pd.concat([self.totals[carried], pd.Series(cumulative[np.arange(len(runs)), last_year_codes], index=runs)])
+        self.last_year_codes = pd.concat([self.last_year_codes[carried], pd.Series(last_year_codes, index=runs)])
+
+        return cumulative_values
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Matching of powerplant names between the CEC and PSE datasets (normalized names, n-gram index, capacity agreement).
+
+Helper functions used by 'Fleet_Build.py'.
+"""
+
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+#%%
+
+######################################################################################################
+########################           Name normalization                       ##########################
+######################################################################################################
+
+# The same powerplant is often written differently in both datasets ('Harbor Generating Station' vs. 'Harbor',
+# 'AES Alamitos, LLC' vs. 'Alamitos'). Names are compared after normalization: lower case, without accents and
+# punctuation, '&' as 'and', and without generic words (legal forms and words like 'power', 'plant', 'station').
+
+generic_words = ['llc', 'inc', 'co', 'corp', 'corporation', 'company', 'lp', 'ltd', 'the', 'of', 'power', 'plant',
+                 'station', 'generating', 'generation', 'facility', 'project', 'energy', 'center', 'unit', 'units']
+
+
+def normalize_plant_names(names):
+    """Return the normalized names (array of strings)."""
+
+    names = [unicodedata.normalize('NFKD', str(x)).encode('ascii', 'ignore').decode('ascii') for x in names]
+
+    normalized = pd.Series(names, dtype=object).str.lower().str.replace('&', ' and ', regex=False)
+    normalized = normalized.str.replace(r'[^a-z0-9]+', ' ', regex=True)
+    normalized = normalized.str.replace(r'\b(?:' + '|'.join(generic_words) + r')\b', ' ', regex=True)
+
+    return normalized.str.split().str.join(' ').values.astype(str)
+
+#%%
+
+######################################################################################################
+########################           N-gram index                             ##########################
+######################################################################################################
+
+# Candidates are found with an index of the character n-grams of the normalized names instead of comparing all pairs:
+# two names are candidates if they share n-grams (a join on the n-grams). Common n-grams carry little information and
+# would produce most of the pairs, thus only the rarest n-grams of every name are joined (blocking). The n-grams joined
+# for a name occur in at most 'max_block_size' names in total (plus the rarest n-gram), so the number of candidate pairs
+# grows linearly with the number of names. The name similarity of every candidate pair is the Dice coefficient of all
+# n-grams of both names, 2 * shared / (n-grams of a + n-grams of b), counted for 'chunksize' pairs at a time.
+
+def name_grams(normalized, n=3):
+    """Return the n-grams of every name as long table (columns 'ROW' and 'GRAM'); names are padded with a space."""
+
+    rows = []
+    grams = []
+
+    for i, name in enumerate(normalized):
+
+        padded = ' ' + name + ' '
+        grams_of_name = set(padded[k:k + n] for k in range(max(len(padded) - n + 1, 1)))
+
+        rows.extend([i] * len(grams_of_name))
+        grams.extend(sorted(grams_of_name))
+
+    return pd.DataFrame({'ROW': np.array(rows, dtype=np.int64), 'GRAM': np.array(grams, dtype=object)})
+
+
+def candidate_pairs(grams_a, grams_b, blocking_grams=8, max_block_size=200, chunksize=500000):
+    """Return the candidate pairs ('ROW_A', 'ROW_B') with their name similarity ('NAME_SIMILARITY').
+
+    'grams_a' and 'grams_b' are sorted by row (as returned by 'name_grams').
+    """
+
+    # Blocking: the rarest n-grams of every name of a (by their frequency in the names of b), at most 'blocking_grams'
+    # and, after the rarest one, only as long as they add up to at most 'max_block_size' names of b
+    frequency = grams_b['GRAM'].value_counts()
+
+    blocking = grams_a.assign(FREQUENCY=frequency.reindex(grams_a['GRAM'].values, fill_value=0).values)
+    blocking = blocking[blocking['FREQUENCY'] > 0].sort_values(by=['ROW', 'FREQUENCY', 'GRAM'], kind='mergesort')
+
+    rank = blocking.groupby('ROW').cumcount().values
+    block_size = blocking.groupby('ROW')['FREQUENCY'].cumsum().values
+
+    blocking = blocking[(rank == 0) | ((rank < blocking_grams) & (block_size <= max_block_size))]
+
+    pairs = blocking[['ROW', 'GRAM']].merge(grams_b, on='GRAM', suffixes=('_A', '_B'))[['ROW_A', 'ROW_B']]
+    # Sorted by the row of b, so that the lookups below go through the keys of b in order
+    pairs = pairs.drop_duplicates().sort_values(by=['ROW_B', 'ROW_A']).reset_index(drop=True)
+
+    # Shared n-grams of every pair: the n-grams of a are looked up in the sorted (row, n-gram) keys of b
+    codes, _ = pd.factorize(pd.concat([grams_a['GRAM'], grams_b['GRAM']], ignore_index=True))
+    codes_a = codes[:len(grams_a)].astype(np.int64)
+    codes_b = codes[len(grams_a):].astype(np.int64)
+    code_count = int(codes.max()) + 1 if len(codes) else 1
+
+    keys_b = np.sort(grams_b['ROW'].values * code_count + codes_b)
+
+    grams_per_row_a = np.bincount(grams_a['ROW'].values)
+    grams_per_row_b = np.bincount(grams_b['ROW'].values)
+    first_gram_a = np.cumsum(grams_per_row_a) - grams_per_row_a
+
+    row_a = pairs['ROW_A'].values
+    row_b = pairs['ROW_B'].values
+    shared = np.zeros(len(pairs))
+
+    for start in range(0, len(pairs), chunksize):
+
+        chunk = slice(start, start + chunksize)
+        counts = grams_per_row_a[row_a[chunk]]
+
+        pair = np.repeat(np.arange(len(counts)), counts)
+        position = np.repeat(first_gram_a[row_a[chunk]], counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        keys = row_b[chunk][pair] * code_count + codes_a[position]
+        found = keys_b[np.minimum(np.searchsorted(keys_b, keys), len(keys_b) - 1)] == keys
+
+        shared[chunk] = np.bincount(pair, weights=found, minlength=len(counts))
+
+    pairs['NAME_SIMILARITY'] = 2 * shared / (grams_per_row_a[row_a] + grams_per_row_b[row_b])
+
+    return pairs.sort_values(by=['ROW_A', 'ROW_B']).reset_index(drop=True)
+
+#%%
+
+######################################################################################################
+########################           Matching                                 ##########################
+######################################################################################################
+
+# Every powerplant of dataset a gets the candidate of dataset b with the highest score, if the score is at least
+# 'min_score'. The score weighs the name similarity and the capacity agreement (smaller over larger capacity; 0.5 if
+# a capacity is missing): score = (1 - capacity_weight) * name similarity + capacity_weight * capacity agreement.
+# Identical names (before normalization) are always matched, as in a join on the names. Several powerplants of a
+# can match the same powerplant of b (e.g., units listed separately), like in a join.
+# The confidence of a match is its score (1 for identical names); the margin is the difference to the score of the
+# second best candidate (small margins are ambiguous matches).
+
+match_columns = ['MATCHED_NAME', 'METHOD', 'NAME_SIMILARITY', 'CAPACITY_AGREEMENT', 'CONFIDENCE', 'MARGIN']
+
+
+def capacity_agreement(capacity_a, capacity_b):
+    """Return smaller over larger capacity (0.5 if a capacity is missing or not positive)."""
+
+    capacity_a = np.asarray(capacity_a, dtype=float)
+    capacity_b = np.asarray(capacity_b, dtype=float)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        agreement = np.minimum(capacity_a, capacity_b) / np.maximum(capacity_a, capacity_b)
+
+    return np.where((capacity_a > 0) & (capacity_b > 0), agreement, 0.5)
+
+
+def match_plant_names(names_a, capacity_a, names_b, capacity_b, candidate_rows=None, min_score=0.7, capacity_weight=0.2,
+                      blocking_grams=8, max_block_size=200, n=3):
+    """Return the match of every powerplant of a (one row per powerplant, in the order of 'names_a', 'match_columns').
+
+    'candidate_rows' (boolean, per powerplant of a) limits the matching by similarity to some powerplants of a
+    (e.g., of emitting types); the others, and names without letters after normalization, are only matched by
+    identical names. Powerplants of b that match a name exactly are not candidates for other powerplants.
+    """
+
+    names_a = np.asarray(names_a, dtype=object)
+    names_b = np.asarray(names_b, dtype=object)
+    capacity_a = pd.to_numeric(pd.Series(capacity_a), errors='coerce').values
+    capacity_b = pd.to_numeric(pd.Series(capacity_b), errors='coerce').values
+
+    matches = pd.DataFrame({'MATCHED_NAME': np.full(len(names_a), None, dtype=object),
+                            'METHOD': np.full(len(names_a), None, dtype=object),
+                            'NAME_SIMILARITY': np.nan,
+                            'CAPACITY_AGREEMENT': np.nan,
+                            'CONFIDENCE': np.nan,
+                            'MARGIN': np.nan}, index=pd.RangeIndex(len(names_a)))
+
+    # 1. Identical names
+    exact_b = pd.Index(names_b).get_indexer(names_a)
+    exact = exact_b >= 0
+
+    matches.loc[exact, 'MATCHED_NAME'] = names_b[exact_b[exact]]
+    matches.loc[exact, 'METHOD'] = 'exact'
+    matches.loc[exact, 'NAME_SIMILARITY'] = 1.0
+    matches.loc[exact, 'CAPACITY_AGREEMENT'] = capacity_agreement(capacity_a[exact], capacity_b[exact_b[exact]])
+    matches.loc[exact, 'CONFIDENCE'] = 1.0
+
+    # 2. Similar names, for the remaining powerplants of a and of b
+    if candidate_rows is None:
+        candidate_rows = np.ones(len(names_a), dtype=bool)
+
+    # Names without letters after normalization (only generic words and numbers, e.g., 'Power Plant', 'Unit 1') say
+    # nothing about the powerplant and are only matched by identical names
+    normalized_a = normalize_plant_names(names_a)
+    normalized_b = normalize_plant_names(names_b)
+    named_a = pd.Series(normalized_a).str.contains('[a-z]', regex=True).values
+    named_b = pd.Series(normalized_b).str.contains('[a-z]', regex=True).values
+
+    rows_a = np.flatnonzero(~exact & np.asarray(candidate_rows, dtype=bool) & named_a)
+    rows_b = np.setdiff1d(np.flatnonzero(named_b), exact_b[exact])
+
+    if len(rows_a) == 0 or len(rows_b) == 0:
+        return matches
+
+    pairs = candidate_pairs(name_grams(normalized_a[rows_a], n), name_grams(normalized_b[rows_b], n), blocking_grams,
+                            max_block_size)
+
+    pairs['ROW_A'] = rows_a[pairs['ROW_A'].values]
+    pairs['ROW_B'] = rows_b[pairs['ROW_B'].values]
+    pairs['CAPACITY_AGREEMENT'] = capacity_agreement(capacity_a[pairs['ROW_A'].values], capacity_b[pairs['ROW_B'].values])
+    pairs['SCORE'] = (1 - capacity_weight) * pairs['NAME_SIMILARITY'] + capacity_weight * pairs['CAPACITY_AGREEMENT']
+
+    # Best and second best candidate of every powerplant of a (ties: first powerplant of b)
+    pairs = pairs.sort_values(by=['ROW_A', 'SCORE', 'ROW_B'], ascending=[True, False, True], kind='mergesort')
+    rank = pairs.groupby('ROW_A').cumcount().values
+
+    best = pairs[rank == 0].set_index('ROW_A')
+    second_score = pairs[rank == 1].set_index('ROW_A')['SCORE'].reindex(best.index, fill_value=0.0)
+
+    best = best[best['SCORE'] >= min_score]
+    rows = best.index.values
+
+    matches.loc[rows, 'MATCHED_NAME'] = names_b[best['ROW_B'].values]
+    matches.loc[rows, 'METHOD'] = 'similar'
+    matches.loc[rows, 'NAME_SIMILARITY'] = best['NAME_SIMILARITY'].values
+    matches.loc[rows, 'CAPACITY_AGREEMENT'] = best['CAPACITY_AGREEMENT'].values
+    matches.loc[rows, 'CONFIDENCE'] = best['SCORE'].values
+    matches.loc[rows, 'MARGIN'] = best['SCORE'].values - second_score.loc[rows].values
+
+    return matches
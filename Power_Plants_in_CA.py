@@ -25,12 +25,16 @@
 #%%
 
 import pandas as pd
-import statistics 
 import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
 import os 
 
+from Stage_Instrumentation import StageRecorder
+from Fleet_Panel import read_emitting_tables, panel_year_frame, bar_positions
+from Fleet_Build import StagedBuild, process_emitting, ingest_cec, add_solar_uptake, build_capacity, phase_out_nuclear, \
+                        match_emitting, fill_emitting_gaps, add_non_emitting, build_average_day, export_fleet
+
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)
 
@@ -44,6 +48,18 @@ plt.rcParams["figure.figsize"] = (20,10)
 #Set working directory
 os.chdir("Z:/Public/997 Collaboration/Marius Schwarz/03_VGI in California/00_Marius Schwarz/99_Python Code/01_CA_Powerplants")  
 
+# Run report: time, CPU time, peak memory, and rows of every stage (ingest, clean, match, fill, average day, export),
+# saved at the end of the script (see 'Stage_Instrumentation.py')
+recorder = StageRecorder(run="Power_Plants_in_CA")
+
+# The fleet is built in named stages with checkpoints (see 'Fleet_Build.py'): pse_ingest, emitting, cec_ingest, solar_uptake,
+# capacity_build, nuclear_phaseout, matching, gap_fill, non_emitting, average_day, export. Only the stages downstream of
+# a changed input file or parameter (e.g., the Diablo Canyon phase-out year) run again; all others are loaded from
+# their checkpoints. The plots are not stages.
+path_checkpoints = "../../06_CA Power Plants/02_Checkpoints/"
+
+build = StagedBuild(path_checkpoints, recorder)
+
 
 #%%
 
@@ -85,197 +101,38 @@ years_short = [2010, 2011, 2012, 2013, 2014, 2015, 2016, 2017]
 
 #%%
 
-for x in years_short:
-    globals()["powerplants_ca_emitting_" + str(x)] = pd.read_csv(file_path_data + "powerplants_ca_emitting_" + str(x) + ".csv", sep=';')
-
-#%%
-    
-# 2. Keep only relevant columns
-
-# For 2010 we also need the plant name and plant type general
-years_short_2010 = [2011, 2012, 2013, 2014, 2015, 2016, 2017]
-
-powerplants_ca_emitting_2010 = powerplants_ca_emitting_2010[['Plant name',\
-                                     'Plant type general',\
-                                     'Min. MW',\
-                                     'Capacity factor',\
-                                     'AverageCO2EmissionRate']]
-
-for x in years_short_2010:
-    globals()["powerplants_ca_emitting_" + str(x)] = \
-                                     globals()["powerplants_ca_emitting_" + str(x)][[\
-                                     'Plant name',
-                                     'Min. MW',\
-                                     'Capacity factor',
-                                     'AverageCO2EmissionRate']]
-    
-    
-#%%
-    
-# 3. Sort alphabetically according plant names
-
-for x in years_short:
-    globals()["powerplants_ca_emitting_" + str(x)] = \
-                globals()["powerplants_ca_emitting_" + str(x)].sort_values(by=['Plant name'])
-
-#%%
-                
-# 4. Drop duplicates
-
-for x in years_short:
-    globals()["powerplants_ca_emitting_" + str(x)] = \
-            globals()["powerplants_ca_emitting_" + str(x)].drop_duplicates(subset='Plant name')
-            
-#%%
-            
-# 5. Rename Columns
-
-powerplants_ca_emitting_2010 = powerplants_ca_emitting_2010.rename(columns={\
-                                "Plant name": "PLANT_NAME",\
-                                "AverageCO2EmissionRate": "EMISSIONS_[tCO2/MWh]",\
-                                "Plant type general": "PLANT_TYPE",\
-                                "Min. MW": "CAPACITY_[MW]",\
-                                "Capacity factor": "CAPACITY_FACTOR"})
-
-for x in years_short_2010:
-    globals()["powerplants_ca_emitting_" + str(x)] = \
-                        globals()["powerplants_ca_emitting_" + str(x)].rename(columns={\
-                                "Plant name": "PLANT_NAME",\
-                                "AverageCO2EmissionRate": "EMISSIONS_[tCO2/MWh]",\
-                                "Min. MW": "CAPACITY_[MW]",\
-                                "Capacity factor": "CAPACITY_FACTOR"})
-    
-#%%
+# One long table of all years (one row per plant and year, column 'YEAR'), see 'Fleet_Panel.py'
+powerplants_ca_emitting_tables = build.run('pse_ingest', read_emitting_tables, \
+                                           files=[file_path_data + "powerplants_ca_emitting_" + str(y) + ".csv" for y in years_short], \
+                                           parameters={'file_path': file_path_data, 'years': years_short})
 
-# 6. Set Plant names as index
-
-for x in years_short:
-    globals()["powerplants_ca_emitting_" + str(x)].set_index('PLANT_NAME', inplace=True)
-    
 #%%
    
 ################################   Combine and process 2010-2017 dataframes ####################################
     
-#In a second step, we combine the annual 2010-2017 dataframes and do some further data processing: 
-#1. Join dataframes
-#2. Replace wording in the dataset
-#3. Delete outliers in the dataset
-#4. Create plant-typ-specific dataframes for further dataprocessing
-#5. Calculate mean capacities, capacity factors, and emission values 
-#6. Replace missing values in dataframe with mean values
-#7. Combine plant-type-specific dataframes to 'powerplants_ca_emitting'
-
-#%%
-   
-# 1. join dataframes
-
-## Create list 'years_short_2010_2017'
-years_short_2010_2016_2017 = [2011, 2012, 2013, 2014, 2015,]
-
-## 2010
-powerplants_ca_emitting = powerplants_ca_emitting_2010.join(\
-                 powerplants_ca_emitting_2011, lsuffix='_2010')
-
-## 2011-2016
-for x in years_short_2010_2016_2017:
-    powerplants_ca_emitting = powerplants_ca_emitting.join(\
-                 globals()["powerplants_ca_emitting_" + str(x + 1)], lsuffix='_' + str(x))
-
-## 2017
-powerplants_ca_emitting = powerplants_ca_emitting.join(\
-                 powerplants_ca_emitting_2017, lsuffix='_2016', rsuffix='_2017')
+#In a second step, we process the 2010-2017 panel further: 
+#1. Replace wording in the dataset
+#2. Delete outliers in the dataset
+#3. Calculate mean capacities, capacity factors, and emission values for each plant type
+#4. Replace missing values with mean values
+#5. Keep plant types for further dataprocessing and create 'powerplants_ca_emitting'
 
 #%%
 
-# 2. Replace wording in the dataset
+# Steps 2.-6. of the first step and 1.-5. of the second step, for all years at once on a panel of the plants in 2010 with
+# capacity, capacity factor, and emissions of every year (plants x years), see 'process_emitting' in 'Fleet_Build.py'
 
-powerplants_ca_emitting.replace('Combined cycle', 'Combined_cycle', inplace = True)
-powerplants_ca_emitting.replace('Once-through cooling', 'Once_through_cooling', inplace = True)
-powerplants_ca_emitting.replace('Other', 'Once_through_cooling', inplace = True)
-
-#%%
-
-# (iii) Delete outliers in the dataset
-
-for x in years_short:
-    powerplants_ca_emitting.loc[powerplants_ca_emitting[\
-                    'EMISSIONS_[tCO2/MWh]_' + str(x)] > 2, \
-                    'EMISSIONS_[tCO2/MWh]_' + str(x)] = 2
-    
-#%%
-    
-# (iv) Create plant-typ-specific dataframes for further dataprocessing
-
-## The usual way of creating an index list of powerplants that share one powerplant type ...
-## ... is not working here, as fillna, inplace doesn't work with lists in .loc[]
-
-## Create list with all powerplant types for iterating over this list
+## Create list with all powerplant types
 powerplants_ca_emitting_types = ['Biogas', 'Biomass', 'Cogen', 'Combined_cycle', 'Once_through_cooling', \
                     'Other', 'Peaker']
 
-## Create new datasets for each plant type. After processing we combine these datasets
-for y in powerplants_ca_emitting_types :
-    globals()["powerplants_ca_emitting_" + y] = powerplants_ca_emitting.loc[\
-                                powerplants_ca_emitting['PLANT_TYPE'] == y]
-
-
-#%%
-    
-# (v) Calculate mean capacities, capacity factors, and emission values 
-
-for y in powerplants_ca_emitting_types:
-    
-    capacities = []
-    capacity_factors = []
-    emissions = []
-    
-    for x in years_short:
-        
-        #capacities
-        mean_capacity_in_year = globals()["powerplants_ca_emitting_" + y]['CAPACITY_[MW]_' + str(x)].mean()
-        #capacity factors
-        mean_capacity_factor_in_year = globals()["powerplants_ca_emitting_" + y]['CAPACITY_FACTOR_' + str(x)].mean()
-        #emissions
-        mean_emission_in_year = globals()["powerplants_ca_emitting_" + y]['EMISSIONS_[tCO2/MWh]_' + str(x)].mean()
-                
-        capacities.append(mean_capacity_in_year)
-        capacity_factors.append(mean_capacity_factor_in_year)
-        emissions.append(mean_emission_in_year)
-        
-    globals()[y + "_capacity"] = statistics.mean(capacities)
-    globals()[y + "_capacity_factor"] = statistics.mean(capacity_factors)
-    globals()[y + "_emissions"] = statistics.mean(emissions)
-
-#%%
-    
-# (vi) Replace missing values in dataframe with mean values
-
-for x in years_short:
-    for y in powerplants_ca_emitting_types:
-        
-        # Capacity
-        globals()["powerplants_ca_emitting_" + y].fillna({'CAPACITY_[MW]_' + str(x): \
-                            globals()[y + '_capacity']}, inplace = True)
-        
-        # Capacity factor
-        globals()["powerplants_ca_emitting_" + y].fillna({'CAPACITY_FACTOR_' + str(x): \
-                            globals()[y + '_capacity_factor']}, inplace = True)
-        
-        # Emission
-        globals()["powerplants_ca_emitting_" + y].fillna({'EMISSIONS_[tCO2/MWh]_' + str(x): \
-                            globals()[y + '_emissions']}, inplace = True)
-
-        
-#%%
-
-# (vii) Combine plant-type-specific dataframes to 'powerplants_ca_emitting'
-
-## Create empty dataframe
-powerplants_ca_emitting = pd.DataFrame()
+## See 'process_emitting' in 'Fleet_Build.py'. The spread of capacity factors and emission values within each plant type
+## ('parameter_spreads_emitting') is calculated before missing values are filled with means.
+emitting = build.run('emitting', process_emitting, upstream=['pse_ingest'], \
+                     parameters={'years': years_short, 'plant_types': powerplants_ca_emitting_types})
 
-### Fill empty datafram
-for y in powerplants_ca_emitting_types:
-    powerplants_ca_emitting = powerplants_ca_emitting.append(globals()['powerplants_ca_emitting_' + y])
+## Powerplants grouped by type, with year-suffixed columns for matching
+powerplants_ca_emitting = emitting['powerplants_ca_emitting']
 
 
 #%%
@@ -323,45 +180,39 @@ powerplants_ca_emitting['COLORS'] = colors
 
 # (ii) Prepare annual Plot data
 
+## Plot data per year (dictionaries year: data)
+powerplants_plot = {}
+capacity_plot = {}
+capacity_factor_plot = {}
+emissions_plot = {}
+colors_plot = {}
+x_pos_plot = {}
+
 for x in years_short:
-    globals()['powerplants_plot_' + str(x)] = powerplants_ca_emitting.sort_values(by=[\
+    powerplants_plot[x] = powerplants_ca_emitting.sort_values(by=[\
                                     'CAPACITY_FACTOR_' + str(x)], ascending=False)
     
-    globals()['capacity_plot_' + str(x)] = globals()['powerplants_plot_' + str(x)][\
-                                    'CAPACITY_[MW]_' + str(x)]
-
-    globals()['capacity_factor_plot_' + str(x)] = globals()['powerplants_plot_' + str(x)][\
-                                    'CAPACITY_FACTOR_' + str(x)]
-    
-    globals()['emissions_plot_' + str(x)] = globals()['powerplants_plot_' + str(x)][\
-                                    'EMISSIONS_[tCO2/MWh]_' + str(x)]
-
-    globals()['colors_plot_' + str(x)] = globals()['powerplants_plot_' + str(x)]['COLORS']
+    capacity_plot[x] = powerplants_plot[x]['CAPACITY_[MW]_' + str(x)]
+    capacity_factor_plot[x] = powerplants_plot[x]['CAPACITY_FACTOR_' + str(x)]
+    emissions_plot[x] = powerplants_plot[x]['EMISSIONS_[tCO2/MWh]_' + str(x)]
+    colors_plot[x] = powerplants_plot[x]['COLORS']
 
     ## Create x_axis distance of bars for design
-    globals()['x_pos_plot_' + str(x)] = []
-    total = 0
-    i = 0
-    j = 0
-    for num in globals()['capacity_plot_' + str(x)]:
-        i = num / 2
-        total = total + i + j
-        j = num / 2
-        globals()['x_pos_plot_' + str(x)].append(total)
+    x_pos_plot[x] = bar_positions(capacity_plot[x])
 
 #%%
         
 # Plot I: Capacity factors over capacity
 fig, axes = plt.subplots(4, 2, sharex=True, sharey=True, gridspec_kw={'hspace': 0.2, 'wspace': 0.1}, figsize=(12,8))
 
-axes[0,0].bar(x_pos_plot_2010, capacity_factor_plot_2010, width=capacity_plot_2010, linewidth=1, color=colors_plot_2010)
-axes[1,0].bar(x_pos_plot_2011, capacity_factor_plot_2011, width=capacity_plot_2011, linewidth=0, color=colors_plot_2011)
-axes[2,0].bar(x_pos_plot_2012, capacity_factor_plot_2012, width=capacity_plot_2012, linewidth=0, color=colors_plot_2012)
-axes[3,0].bar(x_pos_plot_2013, capacity_factor_plot_2013, width=capacity_plot_2013, linewidth=0, color=colors_plot_2013)
-axes[0,1].bar(x_pos_plot_2014, capacity_factor_plot_2014, width=capacity_plot_2014, linewidth=0, color=colors_plot_2014)
-axes[1,1].bar(x_pos_plot_2015, capacity_factor_plot_2015, width=capacity_plot_2015, linewidth=0, color=colors_plot_2015)
-axes[2,1].bar(x_pos_plot_2016, capacity_factor_plot_2016, width=capacity_plot_2016, linewidth=0, color=colors_plot_2016)
-axes[3,1].bar(x_pos_plot_2017, capacity_factor_plot_2017, width=capacity_plot_2017, linewidth=0, color=colors_plot_2017)
+axes[0,0].bar(x_pos_plot[2010], capacity_factor_plot[2010], width=capacity_plot[2010], linewidth=1, color=colors_plot[2010])
+axes[1,0].bar(x_pos_plot[2011], capacity_factor_plot[2011], width=capacity_plot[2011], linewidth=0, color=colors_plot[2011])
+axes[2,0].bar(x_pos_plot[2012], capacity_factor_plot[2012], width=capacity_plot[2012], linewidth=0, color=colors_plot[2012])
+axes[3,0].bar(x_pos_plot[2013], capacity_factor_plot[2013], width=capacity_plot[2013], linewidth=0, color=colors_plot[2013])
+axes[0,1].bar(x_pos_plot[2014], capacity_factor_plot[2014], width=capacity_plot[2014], linewidth=0, color=colors_plot[2014])
+axes[1,1].bar(x_pos_plot[2015], capacity_factor_plot[2015], width=capacity_plot[2015], linewidth=0, color=colors_plot[2015])
+axes[2,1].bar(x_pos_plot[2016], capacity_factor_plot[2016], width=capacity_plot[2016], linewidth=0, color=colors_plot[2016])
+axes[3,1].bar(x_pos_plot[2017], capacity_factor_plot[2017], width=capacity_plot[2017], linewidth=0, color=colors_plot[2017])
 
 ##### Define Plot Style
 font_title = {'size':'12', 'color':'black', 'weight':'bold',
@@ -457,14 +308,14 @@ plt.show()
 
 fig, axes = plt.subplots(4, 2, sharex=True, sharey=True, gridspec_kw={'hspace': 0.2, 'wspace': 0.1}, figsize=(12,8))
 
-axes[0,0].bar(x_pos_plot_2010, emissions_plot_2010, width=capacity_plot_2010, linewidth=0, color=colors_plot_2010)
-axes[1,0].bar(x_pos_plot_2011, emissions_plot_2011, width=capacity_plot_2011, linewidth=0, color=colors_plot_2011)
-axes[2,0].bar(x_pos_plot_2012, emissions_plot_2012, width=capacity_plot_2012, linewidth=0, color=colors_plot_2012)
-axes[3,0].bar(x_pos_plot_2013, emissions_plot_2013, width=capacity_plot_2013, linewidth=0, color=colors_plot_2013)
-axes[0,1].bar(x_pos_plot_2014, emissions_plot_2014, width=capacity_plot_2014, linewidth=0, color=colors_plot_2014)
-axes[1,1].bar(x_pos_plot_2015, emissions_plot_2015, width=capacity_plot_2015, linewidth=0, color=colors_plot_2015)
-axes[2,1].bar(x_pos_plot_2016, emissions_plot_2016, width=capacity_plot_2016, linewidth=0, color=colors_plot_2016)
-axes[3,1].bar(x_pos_plot_2017, emissions_plot_2017, width=capacity_plot_2017, linewidth=0, color=colors_plot_2017)
+axes[0,0].bar(x_pos_plot[2010], emissions_plot[2010], width=capacity_plot[2010], linewidth=0, color=colors_plot[2010])
+axes[1,0].bar(x_pos_plot[2011], emissions_plot[2011], width=capacity_plot[2011], linewidth=0, color=colors_plot[2011])
+axes[2,0].bar(x_pos_plot[2012], emissions_plot[2012], width=capacity_plot[2012], linewidth=0, color=colors_plot[2012])
+axes[3,0].bar(x_pos_plot[2013], emissions_plot[2013], width=capacity_plot[2013], linewidth=0, color=colors_plot[2013])
+axes[0,1].bar(x_pos_plot[2014], emissions_plot[2014], width=capacity_plot[2014], linewidth=0, color=colors_plot[2014])
+axes[1,1].bar(x_pos_plot[2015], emissions_plot[2015], width=capacity_plot[2015], linewidth=0, color=colors_plot[2015])
+axes[2,1].bar(x_pos_plot[2016], emissions_plot[2016], width=capacity_plot[2016], linewidth=0, color=colors_plot[2016])
+axes[3,1].bar(x_pos_plot[2017], emissions_plot[2017], width=capacity_plot[2017], linewidth=0, color=colors_plot[2017])
 
 ##### Define Plot Style
 font_title = {'size':'12', 'color':'black', 'weight':'bold',
@@ -570,14 +421,14 @@ font_subtitle = {'size':'12', 'color':'black', 'weight':'normal',
 tick_label_size = 12
 
 ##### Define Plot Content
-axes[0,0].scatter(capacity_factor_plot_2010, emissions_plot_2010, s=capacity_plot_2010, \
-            c=colors_plot_2010,alpha=0.5)
-axes[0,1].scatter(capacity_factor_plot_2012, emissions_plot_2012, s=capacity_plot_2012, \
-            c=colors_plot_2012,alpha=0.5)
-axes[1,0].scatter(capacity_factor_plot_2015, emissions_plot_2015, s=capacity_plot_2015, \
-            c=colors_plot_2015,alpha=0.5)
-axes[1,1].scatter(capacity_factor_plot_2017, emissions_plot_2017, s=capacity_plot_2017, \
-            c=colors_plot_2017,alpha=0.5)
+axes[0,0].scatter(capacity_factor_plot[2010], emissions_plot[2010], s=capacity_plot[2010], \
+            c=colors_plot[2010],alpha=0.5)
+axes[0,1].scatter(capacity_factor_plot[2012], emissions_plot[2012], s=capacity_plot[2012], \
+            c=colors_plot[2012],alpha=0.5)
+axes[1,0].scatter(capacity_factor_plot[2015], emissions_plot[2015], s=capacity_plot[2015], \
+            c=colors_plot[2015],alpha=0.5)
+axes[1,1].scatter(capacity_factor_plot[2017], emissions_plot[2017], s=capacity_plot[2017], \
+            c=colors_plot[2017],alpha=0.5)
 
 # Add titles (main and on axis)
 axes[0,0].set_title('2010', **font_subtitle)
@@ -677,51 +528,20 @@ plt.show()
 #%%
 
 # 1. Read in files
-
-# general path file
-file_path_data = "../../06_CA Power Plants/00_Original Data/02_CA_powerplants_until_2016/"
-
-powerplants_ca = pd.read_csv(file_path_data + "Overview Power Plants in CA_ until 2016.csv", sep=';', encoding = 'unicode_escape')
-
-#%%
-
 # 2. Keep columns that we need for further analysis
-
-powerplants_ca = powerplants_ca[['Plant Name','General Fuel','MW','Initial Start Date']]
-
-#%%
-
 # 3. Reduce amount of plant types
-
-powerplants_ca.replace('Landfill Gas', 'Biomass', inplace = True)
-powerplants_ca.replace('MSW', 'Biomass', inplace = True)
-powerplants_ca.replace('Digester Gas', 'Gas_undefined', inplace = True)
-powerplants_ca.replace('Other', 'Gas_undefined', inplace = True)
-
-#%%
-
-# 4.  Rename columns
-
-powerplants_ca = powerplants_ca.rename(columns={"Plant Name": "PLANT_NAME",\
-                                "General Fuel": "PLANT_TYPE",\
-                                "MW": "CAPACITY_[MW]",\
-                                "Initial Start Date": "INITIAL_START_DATE"}).set_index('PLANT_NAME')
-    
-#%%
-    
+# 4. Rename columns
 # 5. Set up columns for years 2005-2030
 
+# general path file
+file_path_data = "../../06_CA Power Plants/00_Original Data/02_CA_powerplants_until_2016/"
+
 years_long = [2005, 2006, 2007, 2008, 2009, 2010, 2011, 2012, 2013, 2014, 2015, 2016, 2017, 2018, 2019,\
               2020, 2021, 2022, 2023, 2024, 2025, 2026, 2027, 2028, 2029, 2030]
 
-# Create new columns
-add_columns = []
-
-for x in years_long:
-    add_columns.append('CAPACITY_[MW]_' + str(x))
-
-# Add new columns to dataframe
-powerplants_ca = powerplants_ca.reindex(columns = powerplants_ca.columns.tolist() + add_columns)
+## See 'ingest_cec' in 'Fleet_Build.py'
+powerplants_ca = build.run('cec_ingest', ingest_cec, files=[file_path_data + "Overview Power Plants in CA_ until 2016.csv"], \
+                           parameters={'file_name': file_path_data + "Overview Power Plants in CA_ until 2016.csv", 'years': years_long})
 
 #%%
 
@@ -735,83 +555,36 @@ powerplants_ca = powerplants_ca.reindex(columns = powerplants_ca.columns.tolist(
 #%%
 
 # 1. Read in historical and projected solar PV diffusion
+# 2. Calculate difference to capacity in dataframe 'powerplant_ca'
+# 3. Add new solar powerplants to the dataframe 'powerplant_ca'
 
 file_path_add_data = "../../06_CA Power Plants/00_Original Data/05_Solar_capacity_installations/"
 
-solar_capacity_installations_2015_2030 = pd.read_csv(file_path_add_data + "Solar_Capacity_Installations_2015_2030.csv", \
-                            sep=';', encoding = 'unicode_escape')
-
-solar_capacity_installations_2015_2030 = solar_capacity_installations_2015_2030.set_index(\
-                                                    'Unnamed: 0').rename_axis('')
-
-#%%
-
-# 2. Calculate difference to capacity in dataframe 'powerplant_ca'
-solar_capacity_difference = pd.Series([])
-solar_capacity_difference.name = 'New Capacity'
-solar_capacity_installations_2015_2030 = solar_capacity_installations_2015_2030.append(solar_capacity_difference)
-
 years_solar_diffusion = [2015, 2016, 2017, 2018, 2019, 2020, 2021, 2022, \
                          2023, 2024, 2025, 2026, 2027, 2028, 2029, 2030] 
 
-for x in years_solar_diffusion:
-    
-    # Check for 2015 because its the first year the data is not comprehensive
-    if  x == 2015: 
-        capacity_this_year = solar_capacity_installations_2015_2030.loc[\
-                                            'Solar Capacity', '2015']
-        capacity_last_year = powerplants_ca.groupby('PLANT_TYPE').sum().loc[\
-                                           'Solar','CAPACITY_[MW]']
-    else:
-        capacity_this_year = solar_capacity_installations_2015_2030.loc['Solar Capacity', str(x)]
-        capacity_last_year = solar_capacity_installations_2015_2030.loc['Solar Capacity', str(x - 1)]
-    
-    capacity_difference = capacity_this_year - capacity_last_year
-    solar_capacity_installations_2015_2030.loc['New Capacity', str(x)] = capacity_difference
-
-#%%
-    
-# 3. Add new solar powerplants to the dataframe 'powerplant_ca'
-solar_plant = pd.Series()
-solar_plants = pd.DataFrame(columns={'CAPACITY_[MW]','PLANT_TYPE','INITIAL_START_DATE'})
-solar_plant_names = []
-plant_number = 1
+# Size of the new solar powerplants (see 'synthetic_solar_plants' in 'Fleet_Panel.py'):
+# - 'average': all have the average existing PV size (about 1700 powerplants)
+# - 'lognormal': sizes around 'solar_unit_size' with coefficient of variation 'solar_size_cv'
+# - 'empirical': sizes drawn from the existing PV powerplants
+# For distributed PV units (e.g., 100k+ rooftop systems), set a small 'solar_unit_size' in [MW] (None: average existing PV size)
+solar_size_distribution = 'average'
+solar_unit_size = None
+solar_size_cv = 1.0
 
-# Average existing PV sizes
-average_pv_size = powerplants_ca.groupby('PLANT_TYPE').mean().loc['Solar','CAPACITY_[MW]']
-
-# Create new solar powerplants
-for x in years_solar_diffusion:
-    
-    counter = solar_capacity_installations_2015_2030.loc['New Capacity', str(x)]
-    
-    while counter > average_pv_size:
-        # create series with name
-        solar_plant.name = 'solar_new_' + str(plant_number)
-        # add series to dataframe
-        solar_plants = solar_plants.append(solar_plant)
-        solar_plants.loc['solar_new_' + str(plant_number), 'CAPACITY_[MW]'] = average_pv_size
-        solar_plants.loc['solar_new_' + str(plant_number), 'PLANT_TYPE'] = 'Solar'
-        solar_plants.loc['solar_new_' + str(plant_number), 'INITIAL_START_DATE'] = x
-        
-        # set counter
-        counter = counter - average_pv_size
-        plant_number = plant_number + 1
-
-# Add powerplants to the dataframe 'powerplants_ca'
-powerplants_ca = powerplants_ca.append(solar_plants) #, sort=False
+## See 'add_solar_uptake' in 'Fleet_Build.py'
+powerplants_ca = build.run('solar_uptake', add_solar_uptake, upstream=['cec_ingest'], \
+                           files=[file_path_add_data + "Solar_Capacity_Installations_2015_2030.csv"], \
+                           parameters={'file_name': file_path_add_data + "Solar_Capacity_Installations_2015_2030.csv", \
+                                       'years': years_solar_diffusion, 'size_distribution': solar_size_distribution, \
+                                       'unit_size': solar_unit_size, 'size_cv': solar_size_cv})
 
 #%%
 
 ######################    'Building' powerplant capacity after initial start date    ######################
 
-for x in years_long:
-    
-    # Indexing powerplants that have been build before that particular year
-    powerplants_active = powerplants_ca[powerplants_ca.loc[:, 'INITIAL_START_DATE'] <= x].index
-    
-    powerplants_ca.loc[powerplants_active, 'CAPACITY_[MW]_' + str(x)] = \
-                            powerplants_ca.loc[powerplants_active, 'CAPACITY_[MW]']
+# Powerplants that have been built before each year (plants x years), all years at once
+powerplants_ca = build.run('capacity_build', build_capacity, upstream=['solar_uptake'], parameters={'years': years_long})
 
 #%%
                             
@@ -824,14 +597,9 @@ for x in years_long:
 #%%
                             
 # 1. Nuclear Phase-out in 2026
+## Diablo Canyon has no capacity from this year on
+year_diablo_canyon_phaseout = 2026
 
-years_nuclear_phaseout = [2026, 2027, 2028, 2029, 2030]
-
-for x in years_nuclear_phaseout:
-    powerplants_ca.loc['Diablo Canyon', 'CAPACITY_[MW]_' + str(x)] = 0
-
-#%%
-    
 # 2. Nuclear Phase-out in 2012
 
 ## Nuclear phase-out already started in 2013
@@ -840,27 +608,13 @@ for x in years_nuclear_phaseout:
 ## Name of the phased-out plant: San Onofre
 
 year_of_nuclear_phaseout = 2012
-nuclear_plant_name = 'San Onofre'
 nuclear_plant_size = 2063
 
-# Create new power plant with index = name
-nuclear_plant = pd.Series([])
-nuclear_plant.name = nuclear_plant_name
-powerplants_ca = powerplants_ca.append(nuclear_plant)
+## See 'phase_out_nuclear' in 'Fleet_Build.py'
+powerplants_ca = build.run('nuclear_phaseout', phase_out_nuclear, upstream=['capacity_build'], \
+                           parameters={'years': years_long, 'diablo_canyon_phaseout': year_diablo_canyon_phaseout, \
+                                       'san_onofre_phaseout': year_of_nuclear_phaseout, 'san_onofre_capacity': nuclear_plant_size})
 
-# Fill Capacity, Type, and initial start year
-powerplants_ca.loc['San Onofre', 'CAPACITY_[MW]'] = nuclear_plant_size
-powerplants_ca.loc['San Onofre', 'PLANT_TYPE'] = 'Nuclear'
-powerplants_ca.loc['San Onofre', 'INITIAL_START_DATE'] = 1900
-
-for x in years_long:
-    
-    if x < year_of_nuclear_phaseout:
-        powerplants_ca.loc['San Onofre', 'CAPACITY_[MW]_' + str(x)] = nuclear_plant_size
-    
-    else:
-        powerplants_ca.loc['San Onofre', 'CAPACITY_[MW]_' + str(x)] = 0
-        
 #%%
         
 ###########      Connecting with 'powerplants_ca_emitting' dataframe     ################
@@ -879,128 +633,68 @@ for x in years_long:
 #%%
         
 # 1. Create a new dataframe 'powerplants_ca_emitting_2015_20130' 
-powerplants_ca_emitting_2015_2030 = powerplants_ca_emitting
-
-#%%
-
 # 2. Add columns for 2005 - 2030
-# Rename 'PLANT_TYPE'
-powerplants_ca_emitting_2015_2030 = powerplants_ca_emitting_2015_2030.rename(columns={\
-                                "PLANT_TYPE": "PLANT_TYPE_DETAILED",})
-add_columns = []
-add_columns.append('PLANT_TYPE_DETAILED')
-
-for x in years_long:
-    add_columns.append('CAPACITY_FACTOR_' + str(x))
-    
-for x in years_long:
-    add_columns.append('EMISSIONS_[tCO2/MWh]_' + str(x))
+# 3. Matching 
+# 5. Adding powerplant type details to 'PLANT_TYPE'
+# 6. Adding powerplant type details to unmatched power plants
 
-powerplants_ca_emitting_2015_2030 = powerplants_ca_emitting_2015_2030.reindex(columns = add_columns)
+## Powerplants with identical names match; gas, biomass, and coal powerplants also match by similar names and capacity
+## (see 'Plant_Name_Matching.py'). A pair matches if its score, (1 - 'name_match_capacity_weight') * name similarity +
+## 'name_match_capacity_weight' * capacity agreement, is at least 'name_match_min_score'.
+name_match_min_score = 0.7
+name_match_capacity_weight = 0.2
 
-#%%
+## See 'match_emitting' in 'Fleet_Build.py'
+matching = build.run('matching', match_emitting, upstream=['nuclear_phaseout', 'emitting'], \
+                     parameters={'years': years_long, 'plant_types': powerplants_ca_emitting_types, \
+                                 'min_score': name_match_min_score, 'capacity_weight': name_match_capacity_weight})
 
-# 3. Matching 
-powerplants_ca = powerplants_ca.join(powerplants_ca_emitting_2015_2030)
+powerplants_ca = matching['powerplants_ca']
 
 #%%
 
 # 4. Check matching rate
 
+matching_rates = matching['matching_rates']
+
 print("#####################  MATCHING RATE   ##################")
 print("")
 
-index_gas = powerplants_ca.loc[powerplants_ca['PLANT_TYPE'] == 'Gas'].index
-capacity_gas = powerplants_ca.loc[index_gas,'CAPACITY_[MW]'].sum()
-number_gas = powerplants_ca.loc[index_gas,'CAPACITY_[MW]'].count()
-
 print("Capacity of gas powerplants in 'powerplants_ca' dataframe: ", \
-      capacity_gas)
+      matching_rates['capacity_gas'])
 print("Number of gas powerplants in 'powerplants_ca' dataframe: ", \
-      number_gas)
+      matching_rates['number_gas'])
 
 print("")
 
-#%%
-number_gas_em = len(powerplants_ca_emitting_2015_2030['PLANT_TYPE_DETAILED'])
-
-
-#%%
-#Capacity of gas powerplants that matched
-index_na = powerplants_ca.loc[powerplants_ca['PLANT_TYPE_DETAILED'].isnull() == False].index
-capacity_match = powerplants_ca.loc[index_na,'CAPACITY_[MW]'].sum()
-# Number of gas powerplants that matched
-number_match = powerplants_ca.loc[index_na,'CAPACITY_[MW]'].count()
-
-
 print("Capacity of gas powerplants that matched: ", \
-      capacity_match)
+      matching_rates['capacity_match'])
 print("Number of gas powerplants that matched: ", \
-      number_match)
+      matching_rates['number_match'])
 
 print("")
 
 print("Share of gas powerplants that matched, in capacity: ", \
-      capacity_match / capacity_gas)
+      matching_rates['capacity_match'] / matching_rates['capacity_gas'])
 
 print("Share of gas powerplants that matched, in number of plants: ", \
-      number_match / number_gas)
+      matching_rates['number_match'] / matching_rates['number_gas'])
 
 print("Share of gas powerplants were allocated, in number of plants: ", \
-      number_match / number_gas_em)
-
-#%%
-
-# 5. Adding powerplant type details to 'PLANT_TYPE'
-powerplants_ca_gas = powerplants_ca.loc[((powerplants_ca.loc[:,'PLANT_TYPE'] == 'Gas') |
-                                     (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Biogas')) & \
-                                    (powerplants_ca.loc[:,'PLANT_TYPE_DETAILED'].isnull() == False)].index
+      matching_rates['number_match'] / matching_rates['number_gas_emitting'])
 
-powerplants_ca.loc[powerplants_ca_gas,'PLANT_TYPE'] = \
-                     powerplants_ca.loc[powerplants_ca_gas,'PLANT_TYPE_DETAILED']
+print("")
 
-#%%
+## Confidence of every match in 'matching['name_matches']' and in the column 'MATCH_CONFIDENCE'
+print("Number of powerplants that matched by similar names: ", \
+      matching_rates['number_match_similar'])
+print("Mean confidence of the matches by similar names: ", \
+      matching_rates['confidence_similar'])
 
-# 6. Adding powerplant type details to unmatched power plants
-                     
-# 6a. Calculate capacity difference for all plant_types
-for y in powerplants_ca_emitting_types:
-    
-    capacity_matched = powerplants_ca[powerplants_ca.loc[\
-                                :, 'PLANT_TYPE'] == y]['CAPACITY_[MW]'].sum()
-    
-    capacity_total = powerplants_ca_emitting[powerplants_ca_emitting.loc[\
-                                :, 'PLANT_TYPE'] == y]['CAPACITY_[MW]_2010'].sum()
-    
-    globals()['capacity_unmatched_' + str(y)] = max(0, capacity_total - capacity_matched)
-
-#%%
-    
-# 6b. Assign powerplants to types according the unmatched_capacity
-# Set counter for rows in dataset
-i = 0
-for y in powerplants_ca_emitting_types:
-    
-    # Set counter for 
-    counter = globals()['capacity_unmatched_' + str(y)]
-    # Change plant types
-    while counter > 0:
-    
-        # change plant type only when typs is gas
-        if (powerplants_ca.iloc[i, 28] == 'Gas'):
-            powerplants_ca.iloc[i, 28] = y
-            
-            #decrease counter by capacity of the adjusted powerplant
-            adjusted_powerplant_capacity = powerplants_ca.iloc[i, 1]
-            counter = counter - adjusted_powerplant_capacity
-            
-        else:
-            i = i + 1
+print("")
 
-#%%
-            
-# 6c. Replace all remaining unmatched gas powerplants to gas_undefined
-powerplants_ca.replace('Gas', 'Gas_undefined', inplace = True)
+print("Unmatched capacity that could not be allocated to unmatched gas powerplants, by type: ")
+print(matching_rates['capacity_unallocated'][matching_rates['capacity_unallocated'] > 0])
             
 #%%
 
@@ -1024,41 +718,13 @@ powerplants_ca.replace('Gas', 'Gas_undefined', inplace = True)
 #%%
 
 # 1. Add pre-2010 capacity factors and emission values to emitting power plants based on the 2010 values
-
-#  Create list with years before 2010
-years_start = [2005, 2006, 2007, 2008, 2009]
-
-#(ii) Iterate through the list and set capacity factor and emission values
-
-for x in years_start:
-    
-    fill_capacity_na = powerplants_ca[\
-                          (powerplants_ca.loc[:,'INITIAL_START_DATE'] <= x) & \
-                          (powerplants_ca.loc[:,'CAPACITY_FACTOR_' + str(x)].isnull() == True)\
-                           ].index
-    
-    fill_emissions_na = powerplants_ca[\
-                          (powerplants_ca.loc[:,'INITIAL_START_DATE'] <= x) & \
-                          (powerplants_ca.loc[:,'EMISSIONS_[tCO2/MWh]_' + str(x)].isnull() == True)\
-                           ].index    
-    
-    powerplants_ca.loc[fill_capacity_na, "CAPACITY_FACTOR_" + str(x)] = \
-                        powerplants_ca.loc[fill_capacity_na, "CAPACITY_FACTOR_2010"]
-    
-    powerplants_ca.loc[fill_emissions_na, "EMISSIONS_[tCO2/MWh]_" + str(x)] = \
-                 powerplants_ca.loc[fill_emissions_na, "EMISSIONS_[tCO2/MWh]_2010"]
-
-#%%
-                 
 # 2. Add post-2017 capacity factors and emission values to emitting power plants based on the 2016 values
-years_end = [2017, 2018, 2019, 2020, 2021, 2022, 2023, 2024, 2025, 2026, 2027, 2028, 2029, 2030]
+# 4. Calculate annual mean capacity factor and emission values for different emitting power plant type
+# 5. Fill nan capacity factors and emission values with the plant type averages (only powerplants that have been built in that year)
+
+# From here on, the yearly values are kept in a panel (plants x years, see 'Fleet_Panel.py'), so that every fill step
+# is one operation over all years. 'powerplants_ca' keeps the plant data (type, capacity, start date, ...).
 
-for x in years_end:
-    powerplants_ca['CAPACITY_FACTOR_' + str(x)] = powerplants_ca['CAPACITY_FACTOR_2016']
-    powerplants_ca['EMISSIONS_[tCO2/MWh]_' + str(x)] = powerplants_ca['EMISSIONS_[tCO2/MWh]_2016']
-       
-#%%
-    
 # 3. Create list with all powerplants types in dataset
 powerplants_ca_types = ['Biogas',\
                         'Biomass',\
@@ -1074,64 +740,13 @@ powerplants_ca_types = ['Biogas',\
                         'Wind',\
                         'Gas_undefined']
 
-#%%
+# check for 'Biogas' as emitting but not match for this type
+average_capacity_biogas = 0.51333 # This is based on 2010 powerplants_ca_emitting_2010 dataframe
 
-# 4. Calculate annual mean capacity factor and emission values for different emitting power plant type
-for y in powerplants_ca_types:
-    
-    # index of powerplants of different types
-    globals()['powerplants_ca_' + str(y)] = powerplants_ca[powerplants_ca.loc[\
-                                               :, 'PLANT_TYPE'] == y].index
-    
-    for x in years_long:
-        
-        # Calculate annual mean capacity factor for each emitting powerplant type
-        globals()[str(y) + '_mean_capacity_factor_' + str(x)] = powerplants_ca.loc[\
-                    globals()['powerplants_ca_' + str(y)],'CAPACITY_FACTOR_' + str(x)].mean()
-    
-        # Calculate annual mean emission values for each emitting powerplant type
-        globals()[str(y) + '_mean_emissions_' + str(x)] = powerplants_ca.loc[\
-                    globals()['powerplants_ca_' + str(y)],'EMISSIONS_[tCO2/MWh]_' + str(x)].mean()
-    
-        # check for 'Biogas' as emitting but not match for this type
-        average_capacity_biogas = 0.51333 # This is based on 2010 powerplants_ca_emitting_2010 dataframe
-    
-        if y == 'Biogas':
-            globals()['Biogas_mean_capacity_factor_' + str(x)] = average_capacity_biogas
-            globals()['Biogas_mean_emissions_' + str(x)] = 0
-            
-#%%
-            
-# 5. Fill nan capacity factors and emission values with the plant type averages
-
-for x in years_long:
-    
-    for y in powerplants_ca_types:    
-        
-        ## Capacity factor
-        # index of powerplants of different types with nan capacity factor 
-        no_capacity_factor = powerplants_ca[\
-                            (powerplants_ca.loc[:, 'PLANT_TYPE'] == y) & \
-                            (powerplants_ca.loc[:, 'CAPACITY_FACTOR_' + str(x)].isnull() == True) & \
-                            (powerplants_ca.loc[:,'INITIAL_START_DATE'] <= x)\
-                            ].index
-        
-        # Set mean capacity factors
-        powerplants_ca.loc[no_capacity_factor, 'CAPACITY_FACTOR_' + str(x)] = \
-                        globals()[str(y) + '_mean_capacity_factor_' + str(x)]
-        
-        
-        ## Emissions
-        # index of powerplants of different types with nan capacity factor 
-        no_emissions = powerplants_ca[\
-                        (powerplants_ca.loc[:, 'PLANT_TYPE'] == y) & \
-                        (powerplants_ca.loc[:, 'EMISSIONS_[tCO2/MWh]_' + str(x)].isnull() == True) & \
-                        (powerplants_ca.loc[:,'INITIAL_START_DATE'] <= x)\
-                        ].index
-        
-        # Set mean capacity factors
-        powerplants_ca.loc[no_emissions, 'EMISSIONS_[tCO2/MWh]_' + str(x)] = \
-                        globals()[str(y) + '_mean_emissions_' + str(x)]
+## See 'fill_emitting_gaps' in 'Fleet_Build.py'
+powerplants_ca_panel = build.run('gap_fill', fill_emitting_gaps, upstream=['matching'], \
+                                 parameters={'years': years_long, 'plant_types': powerplants_ca_types, 'first_year': 2010, \
+                                             'last_year': 2016, 'biogas_capacity_factor': average_capacity_biogas})
 
 #%%
                         
@@ -1146,28 +761,20 @@ for x in years_long:
 #%%
                         
 # 1. Read in capacity factor values
+# 2. Add capacity factor values to 'powerplants_ca'
 file_path_add_data = "../../06_CA Power Plants/"
-                        
-capacity_factors_ca_2005_2030 = pd.read_csv(file_path_add_data + "Capacity Factors_2005-2030.csv", sep=';', \
-                                  encoding = 'unicode_escape')
-
-capacity_factors_ca_2005_2030.set_index('PLANT_TYPE', inplace=True)
 
-#%%
-
-# 2. Add capacity factor values to 'powerplants_ca'
 powerplants_ca_non_emitting_types = ['Nuclear', 'Hydro', 'Wind', 'Solar', 'Solar Thermal', 'Geothermal']
 
-for y in powerplants_ca_non_emitting_types:
-    for x in years_long:
-        non_emitting_plants = powerplants_ca[\
-                            (powerplants_ca.loc[:,'PLANT_TYPE'] == y) &
-                            (powerplants_ca.loc[:,'INITIAL_START_DATE'] <= x)].index
-        
-        powerplants_ca.loc[non_emitting_plants, "CAPACITY_FACTOR_" + str(x)] = \
-                        capacity_factors_ca_2005_2030.loc[y, str(x)]
-        
-        powerplants_ca.loc[non_emitting_plants, "EMISSIONS_[tCO2/MWh]_" + str(x)] = 0
+## Capacity factors of the types by year (types x years) and no emissions, for all built powerplants of these types,
+## and the spread of the annual EIA capacity factors (2013-2019) of non-emitting powerplants (see 'add_non_emitting')
+non_emitting = build.run('non_emitting', add_non_emitting, upstream=['gap_fill', 'emitting'], \
+                         files=[file_path_add_data + "Capacity Factors_2005-2030.csv"], \
+                         parameters={'file_name': file_path_add_data + "Capacity Factors_2005-2030.csv", 'years': years_long, \
+                                     'plant_types': powerplants_ca_non_emitting_types})
+
+powerplants_ca_panel = non_emitting['panel']
+powerplants_ca = powerplants_ca_panel['PLANTS']
 
 #%%
         
@@ -1190,90 +797,67 @@ purples = matplotlib.cm.get_cmap('Purples')
 greens = matplotlib.cm.get_cmap('Greens')
 reds = matplotlib.cm.get_cmap('Reds')
 
-powerplants_ca_type = powerplants_ca['PLANT_TYPE']
-colors = []
+## Colors of the plant types, also used in the average day tables (other types: 'default_color')
+plant_type_colors = {'Coal': greys(0.5),
+                     'Nuclear': greys(0.8),
+                     'Gas_undefined': blues(0.3),
+                     'Cogen': blues(0.45),
+                     'Combined_cycle': blues(0.6),
+                     'Once_through_cooling': blues(0.75),
+                     'Peaker': blues(0.9),
+                     'Biogas': purples(0.5),
+                     'Biomass': purples(0.8),
+                     'Geothermal': greens(0.3),
+                     'Hydro': greens(0.45),
+                     'Solar': greens(0.6),
+                     'Solar Thermal': greens(0.75),
+                     'Wind': greens(0.9)}
 
-for x in powerplants_ca_type:
-    if x == 'Coal':
-        colors.append(greys(0.5)) 
-    elif x == 'Nuclear':
-        colors.append(greys(0.8))  
-    elif x == 'Gas_undefined':
-        colors.append(blues(0.3))
-    elif x == 'Cogen':
-        colors.append(blues(0.45))
-    elif x == 'Combined_cycle':
-        colors.append(blues(0.6))
-    elif x == 'Once_through_cooling':
-        colors.append(blues(0.75))
-    elif x == 'Peaker':
-        colors.append(blues(0.9))
-    elif x == 'Biogas':
-        colors.append(purples(0.5))
-    elif x == 'Biomass':
-        colors.append(purples(0.8))
-    elif x == 'Geothermal':
-        colors.append(greens(0.3)) 
-    elif x == 'Hydro':
-        colors.append(greens(0.45))
-    elif x == 'Solar':
-        colors.append(greens(0.6)) 
-    elif x == 'Solar Thermal':
-        colors.append(greens(0.75)) 
-    elif x == 'Wind':
-        colors.append(greens(0.9))
-    else: 
-        colors.append(reds(0.5))
+default_color = reds(0.5)
 
-powerplants_ca['COLORS'] = colors
+powerplants_ca['COLORS'] = [plant_type_colors.get(x, default_color) for x in powerplants_ca['PLANT_TYPE']]
 
 #%%
 
 # 2. Prepare annual Plot data
 
+## Plot data per year (dictionaries year: data)
+powerplants_plot = {}
+capacity_plot = {}
+capacity_factor_plot = {}
+emissions_plot = {}
+colors_plot = {}
+x_pos_plot = {}
+
 for x in years_long:
-    globals()['powerplants_plot_' + str(x)] = powerplants_ca.sort_values(by=[\
+    powerplants_plot[x] = panel_year_frame(powerplants_ca_panel, x).sort_values(by=[\
                                     'CAPACITY_FACTOR_' + str(x)], ascending=False)
     
-    globals()['capacity_plot_' + str(x)] = globals()['powerplants_plot_' + str(x)][\
-                                    'CAPACITY_[MW]_' + str(x)]
-
-    globals()['capacity_factor_plot_' + str(x)] = globals()['powerplants_plot_' + str(x)][\
-                                    'CAPACITY_FACTOR_' + str(x)]
-    
-    globals()['emissions_plot_' + str(x)] = globals()['powerplants_plot_' + str(x)][\
-                                    'EMISSIONS_[tCO2/MWh]_' + str(x)]
-
-    globals()['colors_plot_' + str(x)] = globals()['powerplants_plot_' + str(x)]['COLORS']
+    capacity_plot[x] = powerplants_plot[x]['CAPACITY_[MW]_' + str(x)]
+    capacity_factor_plot[x] = powerplants_plot[x]['CAPACITY_FACTOR_' + str(x)]
+    emissions_plot[x] = powerplants_plot[x]['EMISSIONS_[tCO2/MWh]_' + str(x)]
+    colors_plot[x] = powerplants_plot[x]['COLORS']
 
     ## Create x_axis distance of bars for design
-    globals()['x_pos_plot_' + str(x)] = []
-    total = 0
-    i = 0
-    j = 0
-    for num in globals()['capacity_plot_' + str(x)]:
-        i = num / 2
-        total = total + i + j
-        j = num / 2
-        globals()['x_pos_plot_' + str(x)].append(total)
+    x_pos_plot[x] = bar_positions(capacity_plot[x])
         
 #%%
     
 # Plot I: Capacity factors over capacity
 fig, axes = plt.subplots(6, 1, sharex=True, figsize=(7.5,10))
 
-axes[0].bar(x_pos_plot_2011, capacity_factor_plot_2011, width=capacity_plot_2011, \
-            linewidth=0, color=colors_plot_2011)
-axes[1].bar(x_pos_plot_2012, capacity_factor_plot_2012, width=capacity_plot_2012, \
-            linewidth=0, color=colors_plot_2012)
-axes[2].bar(x_pos_plot_2013, capacity_factor_plot_2013, width=capacity_plot_2013, \
-            linewidth=0, color=colors_plot_2013)
-axes[3].bar(x_pos_plot_2020, capacity_factor_plot_2020, width=capacity_plot_2020, \
-            linewidth=0, color=colors_plot_2020)
-axes[4].bar(x_pos_plot_2025, capacity_factor_plot_2025, width=capacity_plot_2025, \
-            linewidth=0, color=colors_plot_2025)
-axes[5].bar(x_pos_plot_2030, capacity_factor_plot_2030, width=capacity_plot_2030, \
-            linewidth=0, color=colors_plot_2030)
+axes[0].bar(x_pos_plot[2011], capacity_factor_plot[2011], width=capacity_plot[2011], \
+            linewidth=0, color=colors_plot[2011])
+axes[1].bar(x_pos_plot[2012], capacity_factor_plot[2012], width=capacity_plot[2012], \
+            linewidth=0, color=colors_plot[2012])
+axes[2].bar(x_pos_plot[2013], capacity_factor_plot[2013], width=capacity_plot[2013], \
+            linewidth=0, color=colors_plot[2013])
+axes[3].bar(x_pos_plot[2020], capacity_factor_plot[2020], width=capacity_plot[2020], \
+            linewidth=0, color=colors_plot[2020])
+axes[4].bar(x_pos_plot[2025], capacity_factor_plot[2025], width=capacity_plot[2025], \
+            linewidth=0, color=colors_plot[2025])
+axes[5].bar(x_pos_plot[2030], capacity_factor_plot[2030], width=capacity_plot[2030], \
+            linewidth=0, color=colors_plot[2030])
 
 ##### Define Plot Style
 font_title = {'size':'12', 'color':'black', 'weight':'bold',
@@ -1362,18 +946,18 @@ plt.show()
 # Plot II: Emissionsover capacity
 fig, axes = plt.subplots(6, 1, sharex=True, figsize=(7.5,10))
 
-axes[0].bar(x_pos_plot_2011, emissions_plot_2011, width=capacity_plot_2011, \
-            linewidth=0, color=colors_plot_2011)
-axes[1].bar(x_pos_plot_2012, emissions_plot_2012, width=capacity_plot_2012, \
-            linewidth=0, color=colors_plot_2012)
-axes[2].bar(x_pos_plot_2013, emissions_plot_2013, width=capacity_plot_2013, \
-            linewidth=0, color=colors_plot_2013)
-axes[3].bar(x_pos_plot_2020, emissions_plot_2020, width=capacity_plot_2020, \
-            linewidth=0, color=colors_plot_2020)
-axes[4].bar(x_pos_plot_2025, emissions_plot_2025, width=capacity_plot_2025, \
-            linewidth=0, color=colors_plot_2025)
-axes[5].bar(x_pos_plot_2030, emissions_plot_2030, width=capacity_plot_2030, \
-            linewidth=0, color=colors_plot_2030)
+axes[0].bar(x_pos_plot[2011], emissions_plot[2011], width=capacity_plot[2011], \
+            linewidth=0, color=colors_plot[2011])
+axes[1].bar(x_pos_plot[2012], emissions_plot[2012], width=capacity_plot[2012], \
+            linewidth=0, color=colors_plot[2012])
+axes[2].bar(x_pos_plot[2013], emissions_plot[2013], width=capacity_plot[2013], \
+            linewidth=0, color=colors_plot[2013])
+axes[3].bar(x_pos_plot[2020], emissions_plot[2020], width=capacity_plot[2020], \
+            linewidth=0, color=colors_plot[2020])
+axes[4].bar(x_pos_plot[2025], emissions_plot[2025], width=capacity_plot[2025], \
+            linewidth=0, color=colors_plot[2025])
+axes[5].bar(x_pos_plot[2030], emissions_plot[2030], width=capacity_plot[2030], \
+            linewidth=0, color=colors_plot[2030])
 
 ##### Define Plot Style
 font_title = {'size':'12', 'color':'black', 'weight':'bold',
@@ -1486,225 +1070,122 @@ plt.show()
 # 1. Set year of the average day
 years = list(range(2005,2031))
 
-for y in years: 
-
-    ###################         Create new powerplants dataframe           ###############################
-
-    #1. Create dataframe for the average day of this year
-    powerplants_average_day = pd.DataFrame()
-
-    # Add only those powerplants that have alread been built in this year
-    powerplanst_built = powerplants_ca[powerplants_ca.loc[:, 'INITIAL_START_DATE'] <= y].index
-
-    powerplants_average_day = powerplants_ca.loc[powerplanst_built,['PLANT_TYPE',\
-                                            'INITIAL_START_DATE',\
-                                            'CAPACITY_[MW]_' + str(y),\
-                                            'CAPACITY_FACTOR_' + str(y),\
-                                            'EMISSIONS_[tCO2/MWh]_' + str(y),\
-                                            'COLORS']]
-
-
-
-    #2. Add hourly merit order capacity and capacity factor columns
-    hours_of_the_day = list(range(0,24))
-
-    capacity_of_the_day = []
-    capacity_factor_of_the_day = []
-    emissions_of_the_day = []
-
-    for x in hours_of_the_day:
-        capacity_factor_of_the_day.append('MO_' + str(x))
-        capacity_of_the_day.append('CAPACITY_MO_[MW]_' + str(x))
-
-    powerplants_average_day = powerplants_average_day.reindex(columns = \
-                            powerplants_average_day.columns.tolist() + capacity_of_the_day + capacity_factor_of_the_day + emissions_of_the_day) 
-
-
-
-    #####################      Set Merit Order        #############################
-
-    #To order powerplants in a merit Order - as we do not have the marginal costs for the individual powerplants - we develop a relative merit order, between 0 and 1. Powerplants close to 0 in the merit order typically run every hour while the powerplants close to 1 only run in extreme cases. 
-
-    #To assign powerplants a merit order factor, we do three steps. 
-    #1. Categorizing powerplants according their marginal costs: 
-    #    - Low-marginal-cost power plants are: solar, solar thermal, wind, hydro, geothermal, nuclear. 
-    #    - High-marginal-cost powerplants are: all gas types (i.e.,Cogen, Combined_cycle, Gas_undefined, Once_through_cooling, and Peaker), coal, and biomass. 
-    #- Assigning low-marginal-cost powerplants a merit order factor close to 0
-    #- Assigning high-marginal-cost powerplants a merit order factor based on their capacity factors, but 1 - capacity factor
+hours_of_the_day = list(range(0,24))
 
+#%%
 
-    # 1. Categorize powerplants according their marginal costs
-    controllable_plants = powerplants_average_day[\
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Cogen') |
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Combined_cycle') |
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Gas_undefined') |
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Peaker') |
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Biomass') |
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Geothermal') |
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Nuclear') |
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Coal') |
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Biogas') |
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Once_through_cooling')\
-                                                   ].index
+#####################      Set Merit Order        #############################
 
-    intermittant_plants = powerplants_average_day[\
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Hydro') |
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Solar Thermal') |
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Wind')\
-                             ].index
+#To order powerplants in a merit Order - as we do not have the marginal costs for the individual powerplants - we develop a relative merit order, between 0 and 1. Powerplants close to 0 in the merit order typically run every hour while the powerplants close to 1 only run in extreme cases. 
 
-    solar_plants = powerplants_average_day[\
-                             (powerplants_ca.loc[:,'PLANT_TYPE'] == 'Solar')].index
-  
-    #2. Assigning intermittent powerplants a merit order factor close to 0
-    for x in hours_of_the_day:
-    
-        #   We do not set it to 0 to make them appear in the graph
-        powerplants_average_day.loc[intermittant_plants, 'MO_' + str(x)] = 0.05
-        powerplants_average_day.loc[solar_plants, 'MO_' + str(x)] = 0.025
-                                           
+#To assign powerplants a merit order factor, we do three steps. 
+#1. Categorizing powerplants according their marginal costs: 
+#    - Low-marginal-cost power plants are: solar, solar thermal, wind, hydro, geothermal, nuclear. 
+#    - High-marginal-cost powerplants are: all gas types (i.e.,Cogen, Combined_cycle, Gas_undefined, Once_through_cooling, and Peaker), coal, and biomass. 
+#- Assigning low-marginal-cost powerplants a merit order factor close to 0 (intermittent 0.05, solar 0.025; we do not set it to 0 to make them appear in the graph)
+#- Assigning high-marginal-cost powerplants a merit order factor based on their capacity factors, but 1 - capacity factor
 
-    # 3. Assigning controllable powerplants a merit order factor based on their capacity factors
-    ## but 1 - capacity factor
-
-    for x in hours_of_the_day: 
-        
-        powerplants_average_day.loc[controllable_plants, 'MO_' + str(x)] = \
-                1 - powerplants_average_day['CAPACITY_FACTOR_' + str(y)]
+##################           Set Merit Order Capacities             ############################
                 
+#Powerplants contribute differently to the merit oder capacity:
 
+#- For intermittant powerplants we add their capacity according their capacity factor to the merit order, e.g., hydro has a mean capacity factor of 0.389 and a capacity of around 13 GW -> 5GW for the merit order.
+#- Solar has a diurnal cycle and thus contributes to the merit order differnetly over one day
+#- For adjustable (controllable) powerplants such as gas, biomass and digester gas, we add them with their full capacity to the merit order
 
-          
-    ##################           Set Merit Order Capacities             ############################
-                
-    #Powerplants contribute differently to the merit oder capacity:
+#We extend the dataframe as follows:
+#1.  Calculate solar hourly capacity factors: We calculate hourly solar capacity factors based on the PV generation profile, which we also use in the agent-based model (Schwarz et al. 2018). The PV generation profile is from Darghouth et al. 2013.
+#2. Set merit order and merit order capacity for all years at once (see 'average_day_frames' in 'Fleet_Panel.py')
+#3. Set cumulative Merit Order Capacity
 
-    #- For intermittant powerplants we add their capacity according their capacity factor to the merit order, e.g., hydro has a mean capacity factor of 0.389 and a capacity of around 13 GW -> 5GW for the merit order.
-    #- Solar has a diurnal cycle and thus contributes to the merit order differnetly over one day
-    #- For adjustable (controllable) powerplants such as gas, biomass and digester gas, we add them with their full capacity to the merit order
+#%%
 
-    #We extend the dataframe as follows:
-    #1.  Calculate solar hourly capacity factors: We calculate hourly solar capacity factors based on the PV generation profile, which we also use in the agent-based model (Schwarz et al. 2018). The PV generation profile is from Darghouth et al. 2013.
-    #2. Set merit order capacity 
-    #3. Set cumulative Merit Order Capacity               
+#1. Define hourly solar capacity factors
+# 2. Set merit order and merit order capacities
+# 3. Set cumulative Merit Order Capacity
 
+# Read in "pv_generation_profile.csv"
+            
+file_path_add_data = "../../06_CA Power Plants/00_Original Data/04_PV_generation_profile/"
 
-                
-    #1. Define hourly solar capacity factors for this year
+## Tables of the powerplants built in each year (dictionary year: dataframe), see 'build_average_day' in 'Fleet_Build.py'.
+## Hourly solar capacity factors are based on (i) annual capacity factor and (ii) hourly generation profile
+average_day = build.run('average_day', build_average_day, upstream=['non_emitting'], \
+                        files=[file_path_add_data + "pv_generation_profile.csv"], \
+                        parameters={'file_name': file_path_add_data + "pv_generation_profile.csv", 'years': years, \
+                                    'hours': hours_of_the_day, 'colors': plant_type_colors, 'default_color': default_color})
 
-    # Read in "pv_generation_profile.csv"
-                
-    file_path_add_data = "../../06_CA Power Plants/00_Original Data/04_PV_generation_profile/"
-  
-    hourly_capacity_factor_solar = pd.read_csv(file_path_add_data + "pv_generation_profile.csv", \
-                            sep=';', encoding = 'unicode_escape')
+plants_by_year = average_day['plants_by_year']
 
-    # Formatting the dataframe
-    hourly_capacity_factor_solar = hourly_capacity_factor_solar.set_index(\
-                                                'Unnamed: 0').rename_axis('')
+#%%
 
-    hourly_capacity_factor = pd.Series()
-    hourly_capacity_factor.name = 'HOURLY_CAPACITY_FACTOR'
-    hourly_capacity_factor_solar = hourly_capacity_factor_solar.append(hourly_capacity_factor)
+#####################      Export Dataset         ################################
 
-    # Define hourly solar capacity factors based on:
-    # (i) annual capacity factor and 
-    # (ii) hourly generation profile
+# We export (see 'export_fleet' in 'Fleet_Build.py'):
+# - the dataframe 'powerplants_average_day' of every year as csv (commas and semicolons removed)
+# - the merit order lookup: 'Calculate_Carbon_Emissions.py' needs, for each year and hour, the powerplants sorted in merit order and
+#   their cumulative capacity and emissions. We export these arrays once as a memory-mappable bundle of .npy files, so that the
+#   emissions calculation can skip reading and sorting the csv files.
+# - emissions-versus-demand curves: breakpoints of the cumulative capacity with the emissions up to each breakpoint and the
+#   marginal emission factor above it, for every year and hour. Any load value can be evaluated with one lookup
+#   (see 'Emission_Curves.py'), also in the NetLogo model.
+# - hourly signals for the tariff scenarios (Tiered, TOU, Hourly Pricing): average and marginal CO2 intensity and a
+#   merit order price proxy for every year, hour, and reference load level (see 'Hourly_Signals.py')
+# - the full-year merit order lookup: for the 'full_year' time resolution of 'Calculate_Carbon_Emissions.py', every hour of the year
+#   has its own available capacity. Solar follows the PV generation profile and the annual capacity factor. If 'Hourly_Profiles_8760.csv'
+#   exists (columns 'Solar' and 'Intermittent', 8760 rows), we use its hour-of-year profiles; otherwise every day of the year repeats the average day.
+# - the parameter spreads for the Monte Carlo mode
 
-    this_year_capacity_factor = capacity_factors_ca_2005_2030.loc['Solar',str(y)]
+path_results = "../../06_CA Power Plants/"
 
-    for x in hours_of_the_day:
-        hourly_capacity_factor_solar.loc['HOURLY_CAPACITY_FACTOR', str(x)] = \
-                    this_year_capacity_factor * 24 * hourly_capacity_factor_solar.loc[\
-                    'PV_GENERATION_PROFILE', str(x)]
-                    
+file_path_hourly_profiles = "../../06_CA Power Plants/00_Original Data/04_PV_generation_profile/Hourly_Profiles_8760.csv"
 
-                
-    # 2. Set merit order 
+if os.path.isfile(file_path_hourly_profiles):
+    hourly_profiles_file = file_path_hourly_profiles
+else:
+    hourly_profiles_file = None
 
-    for x in hours_of_the_day:
-    
-        #Adjustable powerplants
-        powerplants_average_day.loc[controllable_plants, "CAPACITY_MO_[MW]_" + str(x)] = \
-            powerplants_average_day.loc[controllable_plants, "CAPACITY_[MW]_" + str(y)]
-    
-        #Intermittant powerplants
-        powerplants_average_day.loc[intermittant_plants, "CAPACITY_MO_[MW]_" + str(x)] = \
-            powerplants_average_day.loc[intermittant_plants, "CAPACITY_FACTOR_" + str(y)] * \
-            powerplants_average_day.loc[intermittant_plants, "CAPACITY_[MW]_" + str(y)]
-    
-        #Solar    
-        powerplants_average_day.loc[solar_plants, "CAPACITY_MO_[MW]_" + str(x)] = \
-            powerplants_average_day.loc[solar_plants, "CAPACITY_[MW]_" + str(y)] * \
-            hourly_capacity_factor_solar.loc['HOURLY_CAPACITY_FACTOR', str(x)]
-        
+## Runs again if an exported file is missing
+exported_files = build.run('export', export_fleet, upstream=['average_day', 'non_emitting'], \
+                           files=[f for f in [hourly_profiles_file] if f is not None], \
+                           parameters={'path_results': path_results, 'hourly_profiles_file': hourly_profiles_file, \
+                                       'years': years, 'hours': hours_of_the_day}, outputs=True)
+
+# Run report
+recorder.print_summary()
+recorder.report(path_results + "powerplants_run_report.json")
 
-        
-    ## Set cumulative Merit Order Capacity
-    for x in hours_of_the_day:
-    
-        globals()['cumululative_capacity_' + str(x)] = []
-        total = 0
-        
-        for num in powerplants_average_day['CAPACITY_MO_[MW]_' + str(x)] :
-            
-            total = total + num
-            globals()['cumululative_capacity_' + str(x)].append(total)
-        
-        powerplants_average_day['MO_CAPACITY_CUM_' + str(x)] = globals()['cumululative_capacity_' + str(x)] 
-        
-    globals()['powerplants_average_day_' + str(y)] = powerplants_average_day
-    
-    #####################      Export Dataset         ################################
-    
-    # Save dataframe 'powerplants_average_day' to csv
-    # Remove commas and semicolons in index 
-    powerplants_average_day = powerplants_average_day.replace(r',', '', regex=True) 
-    powerplants_average_day = powerplants_average_day.replace(r';', '', regex=True)
-    
-    path_results = "../../06_CA Power Plants/"
-    export_csv = powerplants_average_day.to_csv(path_results + "powerplants_average_day_" + str(y) + ".csv")
-    
-    
-        
 #%%
        
 # set year for plotting:
 
 year = 2026 
 
-powerplants_average_day = globals()['powerplants_average_day_' + str(year)]
+powerplants_average_day = plants_by_year[year]
                          
 ##########################          Visualize data           ############################
 
 # 1. Prepare annual Plot data
 
+## Plot data per hour (dictionaries hour: data)
+powerplants_plot = {}
+capacity_plot = {}
+merit_order_plot = {}
+emissions_plot = {}
+colors_plot = {}
+x_pos_plot = {}
+
 for x in hours_of_the_day:
     
-    globals()['powerplants_plot_' + str(x)] = powerplants_average_day.sort_values(by=[\
-                                    'MO_' + str(x)], ascending=True)
-    
-    globals()['capacity_plot_' + str(x)] = globals()['powerplants_plot_' + str(x)][\
-                                    'CAPACITY_MO_[MW]_' + str(x)]
-
-    globals()['merit_order_plot_' + str(x)] = globals()['powerplants_plot_' + str(x)][\
-                                    'MO_' + str(x)]
+    powerplants_plot[x] = powerplants_average_day.sort_values(by=['MO_' + str(x)], ascending=True)
     
-    globals()['emissions_plot_' + str(x)] = globals()['powerplants_plot_' + str(x)][\
-                                    'EMISSIONS_[tCO2/MWh]_' + str(year)]
-
-    globals()['colors_plot_' + str(x)] = globals()['powerplants_plot_' + str(x)]['COLORS']
+    capacity_plot[x] = powerplants_plot[x]['CAPACITY_MO_[MW]_' + str(x)]
+    merit_order_plot[x] = powerplants_plot[x]['MO_' + str(x)]
+    emissions_plot[x] = powerplants_plot[x]['EMISSIONS_[tCO2/MWh]_' + str(year)]
+    colors_plot[x] = powerplants_plot[x]['COLORS']
 
     ## Create x_axis distance of bars for design
-    globals()['x_pos_plot_' + str(x)] = []
-    total = 0
-    i = 0
-    j = 0
-    for num in globals()['capacity_plot_' + str(x)]:
-        i = num / 2
-        total = total + i + j
-        j = num / 2
-        globals()['x_pos_plot_' + str(x)].append(total)
+    x_pos_plot[x] = bar_positions(capacity_plot[x])
 
 
 #%%
@@ -1713,14 +1194,14 @@ for x in hours_of_the_day:
 # Plot I: Capacity factors over capacity
 fig, axes = plt.subplots(4, 1, sharex=True, figsize=(7.5,10))
 
-axes[0].bar(x_pos_plot_23, merit_order_plot_23, width=capacity_plot_23, \
-            linewidth=0, color=colors_plot_23)
-axes[1].bar(x_pos_plot_7, merit_order_plot_7, width=capacity_plot_7, \
-            linewidth=0, color=colors_plot_7)
-axes[2].bar(x_pos_plot_11, merit_order_plot_11, width=capacity_plot_11, \
-            linewidth=0, color=colors_plot_11)
-axes[3].bar(x_pos_plot_15, merit_order_plot_15, width=capacity_plot_15, \
-            linewidth=0, color=colors_plot_15)
+axes[0].bar(x_pos_plot[23], merit_order_plot[23], width=capacity_plot[23], \
+            linewidth=0, color=colors_plot[23])
+axes[1].bar(x_pos_plot[7], merit_order_plot[7], width=capacity_plot[7], \
+            linewidth=0, color=colors_plot[7])
+axes[2].bar(x_pos_plot[11], merit_order_plot[11], width=capacity_plot[11], \
+            linewidth=0, color=colors_plot[11])
+axes[3].bar(x_pos_plot[15], merit_order_plot[15], width=capacity_plot[15], \
+            linewidth=0, color=colors_plot[15])
 
 ##### Define Plot Style
 font_title = {'size':'12', 'color':'black', 'weight':'bold',
@@ -1794,14 +1275,14 @@ plt.show()
 # Plot II: Emissions
 fig, axes = plt.subplots(4, 1, sharex=True, figsize=(7.5,10))
 
-axes[0].bar(x_pos_plot_23, emissions_plot_23, width=capacity_plot_23, \
-            linewidth=0, color=colors_plot_23)
-axes[1].bar(x_pos_plot_7, emissions_plot_7, width=capacity_plot_7, \
-            linewidth=0, color=colors_plot_7)
-axes[2].bar(x_pos_plot_11, emissions_plot_11, width=capacity_plot_11, \
-            linewidth=0, color=colors_plot_11)
-axes[3].bar(x_pos_plot_15, emissions_plot_15, width=capacity_plot_15, \
-            linewidth=0, color=colors_plot_15)
+axes[0].bar(x_pos_plot[23], emissions_plot[23], width=capacity_plot[23], \
+            linewidth=0, color=colors_plot[23])
+axes[1].bar(x_pos_plot[7], emissions_plot[7], width=capacity_plot[7], \
+            linewidth=0, color=colors_plot[7])
+axes[2].bar(x_pos_plot[11], emissions_plot[11], width=capacity_plot[11], \
+            linewidth=0, color=colors_plot[11])
+axes[3].bar(x_pos_plot[15], emissions_plot[15], width=capacity_plot[15], \
+            linewidth=0, color=colors_plot[15])
 
 ##### Define Plot Style
 font_title = {'size':'12', 'color':'black', 'weight':'bold',
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache for the results of the emissions calculation.
+
+Helper functions used by 'Emission_Pipeline.py' (and the file fingerprints by 'Fleet_Build.py').
+"""
+
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+#%%
+
+######################################################################################################
+########################           Fingerprints                             ##########################
+######################################################################################################
+
+# A cached result is only valid for exactly the same inputs. The cache key is a hash of
+# (i) the content of the NetLogo '_pre.csv' file, (ii) the merit order bundle of the powerplant fleet,
+# (iii) the reference average the savings are calculated against, and (iv) the calculation settings.
+# Raise 'cache_version' whenever the calculation itself changes, so that old results are not used anymore.
+
+cache_version = 2
+
+
+def file_fingerprint(path, block_size=2**20):
+    """Return the hash of the content of a file."""
+
+    digest = hashlib.blake2b(digest_size=20)
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def array_fingerprint(arrays):
+    """Return the hash of a list of numpy arrays (dtype, shape, and content)."""
+
+    digest = hashlib.blake2b(digest_size=20)
+
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(array.dtype.str.encode())
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+
+    return digest.hexdigest()
+
+
+def bundle_fingerprint(bundle):
+    """Return the hash of the merit order bundle (all arrays, sorted by name)."""
+
+    return array_fingerprint([np.array(sorted(bundle))] + [bundle[name] for name in sorted(bundle)])
+
+
+def reference_fingerprint(reference):
+    """Return the hash of the reference average (None for the reference scenario itself)."""
+
+    if reference is None:
+        return 'reference'
+
+    return array_fingerprint([reference.index.values, reference.values])
+
+
+def cache_key(*parts):
+    """Return the cache key of a list of fingerprints and settings."""
+
+    return hashlib.blake2b(json.dumps([cache_version] + [str(p) for p in parts]).encode(), digest_size=20).hexdigest()
+
+#%%
+
+######################################################################################################
+########################           Result cache                             ##########################
+######################################################################################################
+
+# Every cache entry is a folder named by its key. It holds the result file ('result.csv', '.parquet', or '.feather')
+# and the reference average per year ('reference.npz', stored exactly so that its fingerprint does not change).
+# The cache is bounded in size: when it grows beyond 'max_bytes', the least recently used entries are removed.
+# Hashing multi-GB input files is the slowest part of a cache hit, so file fingerprints are remembered
+# by (path, size, modification time) in 'fingerprints.json'.
+
+class ResultCache:
+
+    def __init__(self, path, max_bytes=50 * 2**30):
+
+        self.path = path
+        self.max_bytes = max_bytes
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def file_fingerprint(self, path):
+        """Return the fingerprint of a file, reusing the remembered one if the file did not change."""
+
+        index_path = os.path.join(self.path, 'fingerprints.json')
+        stat = os.stat(path)
+        file_id = os.path.abspath(path) + '|' + str(stat.st_size) + '|' + str(stat.st_mtime_ns)
+
+        try:
+            with open(index_path) as f:
+                fingerprints = json.load(f)
+        except (OSError, ValueError):
+            fingerprints = {}
+
+        if file_id not in fingerprints:
+
+            fingerprints[file_id] = file_fingerprint(path)
+
+            temporary_path = index_path + '.' + str(os.getpid())
+            with open(temporary_path, 'w') as f:
+                json.dump(fingerprints, f)
+            os.replace(temporary_path, index_path)
+
+        return fingerprints[file_id]
+
+    def entry_path(self, key):
+
+        return os.path.join(self.path, key)
+
+    def result_path(self, entry, output_path):
+        """Return the result file in a cache entry, with the same extension as 'output_path'."""
+
+        return os.path.join(entry, 'result' + os.path.splitext(output_path)[1])
+
+    def get(self, key):
+        """Return the folder of the entry 'key' (and mark it as recently used), or None."""
+
+        entry = self.entry_path(key)
+
+        if not os.path.isfile(os.path.join(entry, 'reference.npz')):
+            return None
+
+        os.utime(entry)
+
+        return entry
+
+    def put(self, key, result_path, reference):
+        """Add the result file and the reference average as entry 'key'."""
+
+        entry = self.entry_path(key)
+        temporary_entry = entry + '.' + str(os.getpid()) + '.tmp'
+
+        os.makedirs(temporary_entry, exist_ok=True)
+        shutil.copyfile(result_path, self.result_path(temporary_entry, result_path))
+        np.savez(os.path.join(temporary_entry, 'reference.npz'), index=reference.index.values, \
+                 columns=np.array(reference.columns, dtype=str), values=reference.values)
+
+        # Entries appear complete or not at all, also with several worker processes
+        if os.path.isdir(entry):
+            shutil.rmtree(temporary_entry, ignore_errors=True)
+        else:
+            os.replace(temporary_entry, entry)
+
+        self.evict(keep=key)
+
+    def load_reference(self, entry):
+        """Return the reference average stored in a cache entry."""
+
+        with np.load(os.path.join(entry, 'reference.npz')) as f:
+            return pd.DataFrame(f['values'], index=f['index'], columns=list(f['columns']))
+
+    def size(self, entry):
+
+        return sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache is smaller than 'max_bytes'."""
+
+        entries = []
+
+        for name in os.listdir(self.path):
+
+            entry = self.entry_path(name)
+
+            if not os.path.isdir(entry) or name.endswith('.tmp'):
+                continue
+
+            try:
+                entries.append((os.path.getmtime(entry), self.size(entry), name))
+            except OSError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, name in sorted(entries):
+
+            if total <= self.max_bytes:
+                break
+
+            if name == keep:
+                continue
+
+            shutil.rmtree(self.entry_path(name), ignore_errors=True)
+            total = total - size
+
+    def clear(self):
+        """Remove all entries."""
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+
+# Settings that do not change the results
+cache_irrelevant_settings = ['chunksize', 'full_year_chunksize', 'relative_accuracy', 'dispatch_kernel']
+
+
+def scenario_cache_key(cache, input_path, bundle_id, years, hours, reference, settings):
+    """Return the cache key of one scenario."""
+
+    relevant_settings = sorted((k, v) for k, v in settings.items() if k not in cache_irrelevant_settings)
+
+    return cache_key(cache.file_fingerprint(input_path), bundle_id, reference_fingerprint(reference),
+                     list(years), list(hours), relevant_settings)
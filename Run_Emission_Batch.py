@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Command line entry point for batch runs of the emissions calculation.
+
+Usage:
+    python Run_Emission_Batch.py manifest.json [--processes N] [--serial]
+
+The manifest (JSON) lists the reference, the scenario files, the year range, and the settings,
+see 'batch_manifest_example.json'. Relative paths are relative to the folder of the manifest.
+It does the same as 'Calculate_Carbon_Emissions.py', without editing the script, and runs headless.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from Merit_Order_Dispatch import load_merit_order, lookup_from_bundle
+from Emission_Pipeline import default_settings, process_scenario, process_scenarios_parallel, scenario_average, scenario_names, \
+                              pairwise_savings
+from Result_Cache import ResultCache, bundle_fingerprint
+from NetLogo_Results import output_suffixes
+from Stage_Instrumentation import StageRecorder
+
+#%%
+
+######################################################################################################
+########################           Manifest                                 ##########################
+######################################################################################################
+
+# Manifest entries:
+# - 'powerplants_path': folder with 'merit_order_lookup' or the 'powerplants_average_day_<year>.csv' files
+#   ('merit_order_lookup_8760' with the setting 'time_resolution': 'full_year')
+# - 'reference': NetLogo '_pre.csv' file of the reference scenario
+# - 'scenarios': scenario families, {family name: [NetLogo '_pre.csv' files]} (or one list of files)
+# - 'years': first and last year, e.g. [2005, 2030]
+# - 'output_path' (optional): folder for the results; by default next to each input file
+# - 'settings' (optional): see 'default_settings' in 'Emission_Pipeline.py'
+# - 'processes' (optional): size of the process pool, by default all cores; 1 runs serially
+# - 'cache_path', 'cache_max_gb' (optional): result cache, see 'Result_Cache.py'
+# - 'pairwise_path' (optional): csv file for the savings of every scenario against every other one, see 'pairwise_savings'
+# - 'report_path' (optional): run report (.json or .csv) with time and memory of every stage, see 'Stage_Instrumentation.py'
+
+hours = list(range(0,24))
+
+
+def read_manifest(manifest_path):
+    """Read a batch manifest and resolve its paths."""
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    folder = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(path):
+        return os.path.normpath(os.path.join(folder, path))
+
+    for entry in ['powerplants_path', 'reference']:
+        if entry not in manifest:
+            raise ValueError("Manifest entry missing: " + entry)
+
+    scenarios = manifest.get('scenarios', {})
+
+    if isinstance(scenarios, list):
+        scenarios = {'scenarios': scenarios}
+
+    manifest['powerplants_path'] = resolve(manifest['powerplants_path'])
+    manifest['reference'] = resolve(manifest['reference'])
+    manifest['scenarios'] = {family: [resolve(path) for path in paths] for family, paths in scenarios.items()}
+
+    first_year, last_year = manifest.get('years', [2005, 2030])
+    manifest['years'] = list(range(first_year, last_year + 1))
+
+    manifest['settings'] = dict(default_settings, **manifest.get('settings', {}))
+    manifest['manifest_path'] = os.path.abspath(manifest_path)
+
+    for entry in ['output_path', 'cache_path', 'pairwise_path', 'report_path']:
+        if manifest.get(entry) is not None:
+            manifest[entry] = resolve(manifest[entry])
+
+    return manifest
+
+
+def output_path(input_path, manifest):
+    """Return the result file of a NetLogo '_pre.csv' file."""
+
+    name = os.path.basename(input_path)
+
+    if name.endswith('_pre.csv'):
+        name = name[:-len('_pre.csv')]
+
+    folder = manifest.get('output_path') or os.path.dirname(input_path)
+
+    return os.path.join(folder, name + output_suffixes[manifest['settings']['output_mode']])
+
+#%%
+
+######################################################################################################
+########################           Batch run                                ##########################
+######################################################################################################
+
+def run_batch(manifest, processes=None):
+    """Run the reference and all scenario families of a manifest. Returns the result files."""
+
+    start = time.time()
+
+    years = manifest['years']
+    settings = manifest['settings']
+
+    if processes is None:
+        processes = manifest.get('processes', os.cpu_count())
+
+    if manifest.get('output_path') is not None:
+        os.makedirs(manifest['output_path'], exist_ok=True)
+
+    recorder = StageRecorder(run=os.path.basename(manifest.get('manifest_path', 'batch')))
+
+    with recorder.stage('merit_order'):
+        merit_order_bundle = load_merit_order(manifest['powerplants_path'], years, hours, settings['time_resolution'])
+        lookup = lookup_from_bundle(merit_order_bundle)
+
+    if manifest.get('cache_path') is not None:
+        cache = ResultCache(manifest['cache_path'], max_bytes=manifest.get('cache_max_gb', 50) * 2**30)
+        bundle_id = bundle_fingerprint(merit_order_bundle)
+    else:
+        cache = None
+        bundle_id = None
+
+    # Reference first, all scenario families are compared against its average
+    print("REFERENCE: " + os.path.basename(manifest['reference']))
+
+    reference_output = output_path(manifest['reference'], manifest)
+    _, reference = process_scenario(manifest['reference'], reference_output, lookup, years, hours, \
+                                    settings=settings, cache=cache, bundle_id=bundle_id, load_cached=False, recorder=recorder)
+
+    scenarios = []
+
+    for family, paths in manifest['scenarios'].items():
+        print("FAMILY: " + family + " (" + str(len(paths)) + " scenarios)")
+
+        for path in paths:
+            scenarios.append((path, output_path(path, manifest)))
+
+    if processes > 1 and len(scenarios) > 1:
+        output_paths = process_scenarios_parallel(scenarios, merit_order_bundle, years, hours, reference, \
+                                                  settings=settings, processes=processes, cache=cache, bundle_id=bundle_id, \
+                                                  recorder=recorder)
+    else:
+        output_paths = []
+
+        for input_path, scenario_output in scenarios:
+            print("SCENARIO: " + os.path.basename(input_path))
+
+            process_scenario(input_path, scenario_output, lookup, years, hours, reference, \
+                             settings=settings, cache=cache, bundle_id=bundle_id, load_cached=False, recorder=recorder)
+            output_paths.append(scenario_output)
+
+    if manifest.get('pairwise_path') is not None:
+        with recorder.stage('comparison'):
+
+            scenario_averages = {}
+
+            for name, path in zip(scenario_names([reference_output] + output_paths), [reference_output] + output_paths):
+                scenario_averages[name] = scenario_average(path, years)
+
+            pairwise_savings(scenario_averages, years).to_csv(manifest['pairwise_path'])
+
+    if manifest.get('report_path') is not None:
+        recorder.report(manifest['report_path'])
+
+    print("DONE: " + str(len(scenarios) + 1) + " files in " + str(round(time.time() - start, 1)) + " s")
+
+    return [reference_output] + output_paths
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Calculate carbon emissions of NetLogo scenario files listed in a manifest.")
+    parser.add_argument('manifest', help="batch manifest (JSON)")
+    parser.add_argument('--processes', type=int, default=None, help="size of the process pool (default: manifest or all cores)")
+    parser.add_argument('--serial', action='store_true', help="process the scenarios one after another")
+
+    args = parser.parse_args(argv)
+
+    manifest = read_manifest(args.manifest)
+    processes = 1 if args.serial else args.processes
+
+    run_batch(manifest, processes)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Timing and memory of the stages of a run (ingest, clean, match, fill, average day, dispatch, aggregation, export).
+
+Helper functions used by 'Power_Plants_in_CA.py' (and 'Fleet_Build.py'), 'Calculate_Carbon_Emissions.py', and 'Emission_Pipeline.py'.
+"""
+
+import os
+import sys
+import json
+import time
+import contextlib
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak memory is not recorded there
+    resource = None
+
+#%%
+
+######################################################################################################
+########################           Stage recorder                           ##########################
+######################################################################################################
+
+# For every stage we record the wall time, the CPU time (of this process), the resident memory (RSS) at the start
+# of the stage, the peak RSS during the stage, and the number of rows processed. A stage can be recorded with
+# 'start'/'stop' (spread over the cells of a script) or as 'with recorder.stage(...)' block. Starting a stage stops
+# the open one, so running the cells in order is enough. Blocks can be nested (e.g., a stage of 'Fleet_Build.py'
+# inside a block of the script); the outer stage keeps running and includes the inner one.
+# Peak memory: on Linux, the peak RSS of the process (VmHWM) is reset at the start of every stage, thus
+# 'peak_rss_mb' is the peak during the stage ('peak_rss_scope' 'stage'). Where it cannot be reset (other systems),
+# it is the peak of the process up to the end of the stage ('peak_rss_scope' 'process'), which a stage after a
+# heavy one inherits.
+
+report_columns = ['run', 'stage', 'scenario', 'rows', 'wall_time_s', 'cpu_time_s', 'rss_start_mb', 'peak_rss_mb',
+                  'peak_rss_scope', 'rows_per_s']
+
+proc_status = '/proc/self/status'
+proc_clear_refs = '/proc/self/clear_refs'
+
+
+def _proc_status_mb(field):
+
+    try:
+        with open(proc_status) as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    # Kilobytes
+                    return int(line.split()[1]) / 2**10
+
+    except OSError:
+        pass
+
+    return None
+
+
+def current_rss_mb():
+    """Return the resident memory of this process in MB (None if unknown)."""
+
+    return _proc_status_mb('VmRSS')
+
+
+def reset_peak_rss():
+    """Reset the peak resident memory of this process to its current RSS. Returns False if not possible."""
+
+    try:
+        with open(proc_clear_refs, 'w') as f:
+            f.write('5')
+
+    except OSError:
+        return False
+
+    return _proc_status_mb('VmHWM') is not None
+
+
+def peak_rss_mb():
+    """Return the peak resident memory of this process in MB since the last reset (None if unknown)."""
+
+    peak = _proc_status_mb('VmHWM')
+
+    if peak is not None or resource is None:
+        return peak
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Bytes on macOS, kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak / 2**20
+
+    return peak / 2**10
+
+
+class StageRecorder:
+
+    def __init__(self, run=None):
+
+        self.run = run
+        self.records = []
+        self._open = None
+        self._blocks = []
+
+    def _open_records(self):
+
+        return ([self._open] if self._open is not None else []) + self._blocks
+
+    def _update_peaks(self, ending=None):
+        """Add the peak RSS since the last reset to all open stages (and the stage 'ending')."""
+
+        peak = peak_rss_mb()
+
+        for record in self._open_records() + ([ending] if ending is not None else []):
+            if peak is not None:
+                record['_peak'] = max(record['_peak'] or 0, peak)
+
+    def _begin(self, stage, scenario):
+
+        # The peak so far belongs to the stages already open; then it is reset for the new stage
+        self._update_peaks()
+        resettable = reset_peak_rss()
+
+        return {'run': self.run,
+                'stage': stage,
+                'scenario': scenario,
+                'rows': None,
+                'rss_start_mb': current_rss_mb(),
+                'peak_rss_scope': 'stage' if resettable else 'process',
+                '_peak': None,
+                '_wall_start': time.perf_counter(),
+                '_cpu_start': time.process_time()}
+
+    def _end(self, record, rows=None):
+
+        self._update_peaks(record)
+
+        record['wall_time_s'] = time.perf_counter() - record.pop('_wall_start')
+        record['cpu_time_s'] = time.process_time() - record.pop('_cpu_start')
+        record['peak_rss_mb'] = record.pop('_peak')
+
+        if rows is not None:
+            record['rows'] = rows
+
+        if record['rows'] is not None and record['wall_time_s'] > 0:
+            record['rows_per_s'] = record['rows'] / record['wall_time_s']
+        else:
+            record['rows_per_s'] = None
+
+        self.records.append(record)
+
+        return record
+
+    def start(self, stage, scenario=None):
+        """Start recording 'stage' (and stop the open stage). Not possible inside a 'stage' block."""
+
+        if self._blocks:
+            raise RuntimeError("Cannot start stage '" + str(stage) + "' inside the recorded block '" +
+                               str(self._blocks[-1]['stage']) + "'; use a nested 'stage' block instead")
+
+        self.stop()
+
+        self._open = self._begin(stage, scenario)
+
+        return self._open
+
+    def stop(self, rows=None):
+        """Stop the open stage (if any), with the number of rows it processed."""
+
+        record = self._open
+
+        if record is None:
+            return None
+
+        self._open = None
+
+        return self._end(record, rows)
+
+    @contextlib.contextmanager
+    def stage(self, stage, scenario=None, rows=None):
+        """Record the block as 'stage' (blocks can be nested). The block may set the rows with 'record['rows'] = ...'."""
+
+        record = self._begin(stage, scenario)
+        self._blocks.append(record)
+
+        if rows is not None:
+            record['rows'] = rows
+
+        try:
+            yield record
+        finally:
+            self._blocks.remove(record)
+            self._end(record)
+
+    def extend(self, records):
+        """Add the records of another recorder (e.g., of a worker process) to this run."""
+
+        for record in records:
+            self.records.append(dict(record, run=self.run))
+
+    def to_frame(self):
+
+        return pd.DataFrame(self.records, columns=report_columns)
+
+    def summary(self):
+        """Return the totals per stage, in the order the stages first appeared."""
+
+        df = self.to_frame()
+
+        summary = df.groupby('stage', sort=False)[['rows', 'wall_time_s', 'cpu_time_s']].sum(min_count=1)
+        summary['peak_rss_mb'] = df.groupby('stage', sort=False)['peak_rss_mb'].max()
+        summary['share_of_wall_time'] = summary['wall_time_s'] / summary['wall_time_s'].sum()
+
+        return summary
+
+    def report(self, path):
+        """Save all records as report, as JSON or CSV (following the file extension)."""
+
+        self.stop()
+
+        if os.path.splitext(path)[1] == '.json':
+            with open(path, 'w') as f:
+                json.dump({'run': self.run, 'records': self.records}, f, indent=4)
+
+        else:
+            self.to_frame().to_csv(path, index=False)
+
+    def print_summary(self):
+
+        print(self.summary())
+
+
+def recorded_stage(recorder, stage, scenario=None, rows=None):
+    """Return 'recorder.stage(...)', or a block that records nothing without recorder."""
+
+    if recorder is None:
+        return contextlib.nullcontext({})
+
+    return recorder.stage(stage, scenario, rows)
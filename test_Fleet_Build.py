@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the allocation of unmatched gas capacity in 'Fleet_Build.py' against the former row-by-row loop.
+"""
+
+import numpy as np
+import pandas as pd
+
+from Fleet_Build import allocate_by_capacity
+
+
+def baseline_allocation(plant_types, capacity, capacity_unmatched):
+    """Former step 5b of the matching: relabel 'Gas' powerplants row by row until every type is covered."""
+
+    plant_types = list(plant_types)
+
+    i = 0
+    for y in capacity_unmatched.index:
+
+        counter = capacity_unmatched[y]
+
+        while counter > 0:
+
+            if plant_types[i] == 'Gas':
+                plant_types[i] = y
+                counter = counter - capacity[i]
+
+            else:
+                i = i + 1
+
+    return plant_types
+
+
+def allocation(plant_types, capacity, capacity_unmatched):
+
+    plant_types = pd.Series(plant_types, dtype=object)
+    gas = (plant_types == 'Gas').values
+
+    plant_types[gas] = allocate_by_capacity(pd.Series(capacity)[gas], capacity_unmatched).fillna('Gas').values
+
+    return plant_types.tolist()
+
+
+def test_overshoot_is_not_carried_to_next_type():
+
+    capacity_unmatched = pd.Series([100, 30], index=['A', 'B'])
+
+    assert allocate_by_capacity([150, 40, 40], capacity_unmatched).fillna('Gas').tolist() == ['A', 'B', 'Gas']
+
+
+def test_zero_need_types_get_no_powerplants():
+
+    capacity_unmatched = pd.Series([0, 50, 0, 20], index=['A', 'B', 'C', 'D'])
+
+    assert allocate_by_capacity([30, 30, 10, 10, 5], capacity_unmatched).fillna('Gas').tolist() == ['B', 'B', 'D', 'D', 'Gas']
+
+
+def test_exhaustion_leaves_last_types_short():
+
+    capacity_unmatched = pd.Series([50, 100, 20], index=['A', 'B', 'C'])
+
+    assert allocate_by_capacity([30, 30, 40], capacity_unmatched).fillna('Gas').tolist() == ['A', 'A', 'B']
+
+
+def test_same_as_baseline_loop():
+
+    rng = np.random.default_rng(0)
+
+    for _ in range(200):
+
+        plants = rng.integers(5, 60)
+        plant_types = rng.choice(['Gas', 'Gas', 'Gas', 'Hydro', 'Combined_cycle'], size=plants)
+        capacity = rng.choice([0.0, 5.0, 20.0, 150.0, 400.0], size=plants)
+
+        # Large gas powerplants at the end cover all needs (some zero), so that the former loop ends
+        plant_types = np.append(plant_types, ['Gas'] * 4)
+        capacity = np.append(capacity, [400.0] * 4)
+        needs = rng.choice([0.0, 10.0, 50.0, 200.0, 390.0], size=4)
+        capacity_unmatched = pd.Series(needs, index=['Cogen', 'Peaker', 'Steam', 'Biogas'])
+
+        assert allocation(plant_types, capacity, capacity_unmatched) == \
+               baseline_allocation(plant_types, capacity, capacity_unmatched)